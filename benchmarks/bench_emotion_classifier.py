@@ -0,0 +1,87 @@
+"""
+情感分类模型基准测试：transformers 模型与 int8 TorchScript 模型的一致性、启动时间、单句延迟和内存
+
+每种运行方式在单独的子进程中加载并测量（启动时间包含导入，内存为进程峰值 RSS），
+一致性检查在主进程中逐句比较两者的分类概率。int8 缓存不存在时会先导出。
+用法（在项目根目录下）：python benchmarks/bench_emotion_classifier.py [--path ~/.swarmclone/llm/EmotionClassification/SWCBiLSTM] [--rounds 200]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # 直接运行脚本时也能导入 swarmclone
+
+DEFAULT_PATH = "~/.swarmclone/llm/EmotionClassification/SWCBiLSTM"
+
+def load(path: str, runtime: str):
+    from swarmclone.llm import LLMConfig, load_classifier
+    config = LLMConfig()
+    return load_classifier(path, config.classifier_model_id, config.classifier_model_source, runtime)
+
+def child(path: str, runtime: str, rounds: int):
+    """子进程：加载模型并逐句分类，结果以 JSON 输出到标准输出"""
+    start = time.perf_counter()
+    model, tokenizer = load(path, runtime)
+    load_time = time.perf_counter() - start
+    import torch
+    from swarmclone.emotion import PARITY_SENTENCES
+    latencies = []
+    with torch.no_grad():
+        for i in range(rounds):
+            text = PARITY_SENTENCES[i % len(PARITY_SENTENCES)]
+            t0 = time.perf_counter()
+            ids = tokenizer([text], return_tensors="pt")["input_ids"]
+            model(input_ids=ids).logits.softmax(dim=-1)
+            latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    print(json.dumps({
+        "load": load_time,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # Linux 下单位为 KiB
+    }))
+
+def run_child(path: str, runtime: str, rounds: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", runtime, "--path", path, "--rounds", str(rounds)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--child", choices=("transformers", "int8"))
+    args = parser.parse_args()
+    path = os.path.expanduser(args.path)
+    if args.child:
+        child(path, args.child, args.rounds)
+        return
+
+    from swarmclone.emotion import compare_outputs, load_int8
+    reference = load(path, "transformers")
+    if load_int8(path) is None:
+        load(path, "int8") # 导出并缓存
+    if (quantized := load_int8(path)) is None:
+        print("int8 模型未通过一致性检查或导出失败，详见日志")
+        return
+    parity = compare_outputs(reference, quantized)
+    print(f"一致性：最大概率误差 {parity['max_diff']:.4f}，类别一致率 {parity['agreement']:.0%}，分词一致 {parity['same_ids']}")
+
+    print(f"{'运行方式':<14}{'加载(s)':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'峰值RSS(MiB)':>14}")
+    for runtime in ("transformers", "int8"):
+        result = run_child(path, runtime, args.rounds)
+        print(
+            f"{runtime:<14}{result['load']:>10.2f}{result['p50'] * 1000:>10.2f}"
+            f"{result['p95'] * 1000:>10.2f}{result['rss'] / (1 << 20):>14.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+多后端连接池基准测试：主后端偶尔卡住时的首 token 延迟
+
+启动两个替身服务器（stub_llm_server.py）：主后端以 --stall-rate 的概率卡住不输出，另一个后端正常。
+对比只用主后端、以及主后端 + 备用后端并在 --deadline 秒后对冲请求两种情况下，首 token 延迟的分布。
+用法（在项目根目录下）：python benchmarks/bench_llm_hedging.py [--requests 50] [--stall-rate 0.2] [--deadline 1.0]
+"""
+import argparse
+import asyncio
+import contextlib
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # 直接运行脚本时也能导入 swarmclone
+from swarmclone.llm_pool import Backend, BackendPool
+
+STUB = Path(__file__).with_name("stub_llm_server.py")
+GIVE_UP = 10.0 # 超过这一时间仍没有首个 token 视为失败
+
+async def wait_ready(port: int):
+    import httpx
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            with contextlib.suppress(httpx.HTTPError):
+                await client.get(f"http://127.0.0.1:{port}/stats")
+                return
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"替身服务器 {port} 未能启动")
+
+async def first_token(pool: BackendPool) -> float | None:
+    start = time.perf_counter()
+    params = {"messages": [{"role": "user", "content": "你好"}], "stream": True}
+    async def consume() -> float:
+        ttft = None
+        async for chunk in pool.stream(params):
+            if ttft is None and chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                ttft = time.perf_counter() - start
+        assert ttft is not None
+        return ttft
+    try:
+        return await asyncio.wait_for(consume(), GIVE_UP)
+    except Exception:
+        return None
+
+async def run(name: str, pool: BackendPool, requests: int):
+    results = [await first_token(pool) for _ in range(requests)]
+    ok = sorted(r for r in results if r is not None)
+    p = lambda q: ok[min(len(ok) - 1, int(len(ok) * q))] * 1000 if ok else float("nan")
+    print(f"{name:<14}{len(ok):>6}/{requests:<4}{p(0.5):>10.0f}{p(0.95):>10.0f}{p(1.0):>10.0f}")
+    for stats in pool.get_stats():
+        ttft = stats["ttft_p50"]
+        print(f"    {stats['name']:<40} 请求 {stats['requests']:>4} 失败 {stats['failures']:>3} ttft p50 {ttft * 1000 if ttft else float('nan'):.0f} ms")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--stall-rate", type=float, default=0.2)
+    parser.add_argument("--deadline", type=float, default=1.0)
+    args = parser.parse_args()
+    servers = [
+        subprocess.Popen([sys.executable, str(STUB), "--port", "8101", "--stall-rate", str(args.stall_rate)]),
+        subprocess.Popen([sys.executable, str(STUB), "--port", "8102"])
+    ]
+    try:
+        await asyncio.gather(wait_ready(8101), wait_ready(8102))
+        make = lambda port: Backend(f"http://127.0.0.1:{port}/v1", "stub", "x", name=f"stub:{port}")
+        print(f"{'方式':<14}{'成功':>11}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}")
+        await run("single", BackendPool([make(8101)], failure_threshold=1000), args.requests)
+        await run("hedged", BackendPool([make(8101), make(8102)], ttft_deadline=args.deadline), args.requests)
+    finally:
+        for server in servers:
+            server.terminate()
+
+if __name__ == "__main__":
+    asyncio.run(main())
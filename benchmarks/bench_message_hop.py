@@ -0,0 +1,105 @@
+"""
+消息单跳延迟基准测试：模块 results_queue -> 主控 -> 目标模块 task_queue
+
+对比旧的 50 ms 轮询转发与现在的事件驱动转发。
+用法（在项目根目录下）：python benchmarks/bench_message_hop.py [--messages 50] [--burst 1] [--interval 0.073]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # 直接运行脚本时也能导入 swarmclone
+from swarmclone.constants import MessageType, ModuleRoles
+from swarmclone.controller import Controller
+from swarmclone.messages import Message
+from swarmclone.module_manager import ModuleBase
+
+class BenchPing(Message):
+    def __init__(self, source: ModuleBase):
+        super().__init__(
+            MessageType.DATA,
+            source,
+            destinations=[ModuleRoles.PLUGIN],
+            t0=time.perf_counter()
+        )
+
+class BenchProducer(ModuleBase):
+    role: ModuleRoles = ModuleRoles.CHAT
+    def __init__(self, n: int, burst: int, interval: float, **kwargs):
+        super().__init__(**kwargs)
+        self.n = n
+        self.burst = burst
+        self.interval = interval
+
+    async def run(self):
+        await asyncio.sleep(0.2)
+        for _ in range(self.n // self.burst):
+            for _ in range(self.burst):
+                await self.results_queue.put(BenchPing(self))
+            await asyncio.sleep(self.interval)
+        await asyncio.Event().wait()
+
+class BenchConsumer(ModuleBase):
+    role: ModuleRoles = ModuleRoles.PLUGIN
+    def __init__(self, n: int, **kwargs):
+        super().__init__(**kwargs)
+        self.n = n
+        self.latencies: list[float] = []
+        self.finished = asyncio.Event()
+
+    async def run(self):
+        while len(self.latencies) < self.n:
+            task = await self.task_queue.get()
+            self.latencies.append(time.perf_counter() - task.get_value(self)["t0"])
+        self.finished.set()
+        await asyncio.Event().wait()
+
+class PollingController(Controller):
+    """旧实现：每 50 ms 检查一次结果队列，每次只转发一条"""
+    async def handle_module(self, module: ModuleBase, module_task: asyncio.Task[None]):
+        while True:
+            if module_task.done():
+                module.running = False
+                break
+            if not module.results_queue.empty():
+                result = module.results_queue.get_nowait()
+                self.message_log.append(result)
+                await self.handle_message(result)
+            await asyncio.sleep(0.05)
+
+async def measure(controller_class: type[Controller], n: int, burst: int, interval: float) -> list[float]:
+    controller = controller_class()
+    consumer = BenchConsumer(n)
+    controller.add_module(BenchProducer(n, burst, interval))
+    controller.add_module(consumer)
+    with contextlib.redirect_stdout(io.StringIO()):
+        controller.start_modules()
+        await consumer.finished.wait()
+        await controller.stop_modules()
+    return consumer.latencies
+
+def report(name: str, latencies: list[float]):
+    ms = sorted(x * 1000 for x in latencies)
+    p = lambda q: ms[min(len(ms) - 1, int(q * len(ms)))]
+    print(
+        f"{name:<8} n={len(ms):<5} mean={statistics.mean(ms):8.3f}ms "
+        f"p50={p(0.5):8.3f}ms p95={p(0.95):8.3f}ms max={ms[-1]:8.3f}ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--burst", type=int, default=1, help="每次突发连续发送的消息数")
+    parser.add_argument("--interval", type=float, default=0.073, help="两次突发之间的间隔（秒）")
+    args = parser.parse_args()
+    n = args.messages - args.messages % args.burst
+    report("polling", asyncio.run(measure(PollingController, n, args.burst, args.interval)))
+    report("push", asyncio.run(measure(Controller, n, args.burst, args.interval)))
+
+if __name__ == "__main__":
+    main()
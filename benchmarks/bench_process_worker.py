@@ -0,0 +1,143 @@
+"""
+子进程模块基准测试：渲染帧间隔抖动与端到端延迟
+
+模拟一个 60 fps 的渲染循环（与 Live2D 前端一样跑在主控的事件循环上），
+以及一个占用 GIL 的合成模块（纯 Python 计算，在线程中运行，类似 CosyVoice 推理），
+每次合成产生约 3 秒的 16 bit 音频，经主控转发给渲染模块。
+对比合成模块在主进程中运行和在子进程中运行（音频经共享内存传递）两种情况。
+用法（在项目根目录下）：python benchmarks/bench_process_worker.py [--requests 30] [--work 0.05] [--interval 0.2]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # 直接运行脚本时也能导入 swarmclone
+from swarmclone.constants import MessageType, ModuleRoles
+from swarmclone.controller import Controller
+from swarmclone.messages import Message
+from swarmclone.module_manager import ModuleBase, ModuleConfig
+from swarmclone.process_worker import ProcessModule
+
+FRAME = 1 / 60
+AUDIO_BYTES = 16000 * 2 * 3
+
+class BenchRequest(Message):
+    def __init__(self, source: ModuleBase):
+        super().__init__(MessageType.DATA, source, destinations=[ModuleRoles.TTS], t0=time.monotonic_ns())
+
+class BenchAudio(Message):
+    def __init__(self, source: ModuleBase, t0: int, data: bytes):
+        super().__init__(MessageType.DATA, source, destinations=[ModuleRoles.FRONTEND], t0=t0, data=data)
+
+@dataclass
+class BenchSynthConfig(ModuleConfig):
+    work: float = field(default=0.05)
+
+def burn(seconds: float) -> bytes:
+    """占用 GIL 的纯 Python 计算"""
+    end = time.perf_counter() + seconds
+    x = 0
+    while time.perf_counter() < end:
+        for i in range(1000):
+            x += i * i
+    return bytes(AUDIO_BYTES)
+
+class BenchSynth(ModuleBase):
+    role: ModuleRoles = ModuleRoles.TTS
+    config_class = BenchSynthConfig
+    config: BenchSynthConfig
+
+    async def run(self):
+        while True:
+            task = await self.task_queue.get()
+            data = await asyncio.to_thread(burn, self.config.work)
+            await self.results_queue.put(BenchAudio(self, task.get_value(self)["t0"], data))
+
+class BenchRequester(ModuleBase):
+    role: ModuleRoles = ModuleRoles.CHAT
+    def __init__(self, n: int, interval: float, **kwargs):
+        super().__init__(**kwargs)
+        self.n = n
+        self.interval = interval
+
+    async def run(self):
+        await asyncio.sleep(0.5)
+        for _ in range(self.n):
+            await self.results_queue.put(BenchRequest(self))
+            await asyncio.sleep(self.interval)
+        await asyncio.Event().wait()
+
+class BenchRenderer(ModuleBase):
+    role: ModuleRoles = ModuleRoles.FRONTEND
+    def __init__(self, n: int, **kwargs):
+        super().__init__(**kwargs)
+        self.n = n
+        self.latencies: list[float] = []
+        self.frames: list[float] = []
+        self.finished = asyncio.Event()
+
+    async def render(self):
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(FRAME)
+            now = time.perf_counter()
+            if self.latencies: # 只统计开始合成后的帧
+                self.frames.append(now - last)
+            last = now
+
+    async def run(self):
+        renderer = asyncio.create_task(self.render())
+        while len(self.latencies) < self.n:
+            task = await self.task_queue.get()
+            value = task.get_value(self)
+            assert len(value["data"]) == AUDIO_BYTES
+            self.latencies.append((time.monotonic_ns() - value["t0"]) / 1e9)
+        self.finished.set()
+        renderer.cancel()
+        await asyncio.Event().wait()
+
+async def measure(in_process: bool, n: int, work: float, interval: float) -> tuple[list[float], list[float]]:
+    controller = Controller()
+    renderer = BenchRenderer(n)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if in_process:
+            controller.add_module(BenchSynth(work=work))
+        else: # 先等子进程启动完成，不把进程启动时间算进延迟
+            synth = ProcessModule(BenchSynth, lookup=controller.get_module, work=work)
+            controller.add_module(synth)
+            controller.start_modules()
+            await synth.ready.wait()
+        controller.add_module(BenchRequester(n, interval))
+        controller.add_module(renderer)
+        controller.start_modules()
+        await renderer.finished.wait()
+        await controller.stop_modules()
+    return renderer.latencies, renderer.frames
+
+def report(name: str, latencies: list[float], frames: list[float]):
+    p = lambda values, q: values[min(len(values) - 1, int(q * len(values)))]
+    jitter = sorted(abs(x - FRAME) * 1000 for x in frames)
+    ms = sorted(x * 1000 for x in latencies)
+    print(
+        f"{name:<10} frames={len(jitter):<5} jitter p50={p(jitter, 0.5):6.2f}ms p99={p(jitter, 0.99):6.2f}ms "
+        f"max={jitter[-1]:6.2f}ms | latency n={len(ms)} mean={statistics.mean(ms):7.2f}ms "
+        f"p50={p(ms, 0.5):7.2f}ms p95={p(ms, 0.95):7.2f}ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--work", type=float, default=0.05, help="每次合成占用 GIL 的时间（秒）")
+    parser.add_argument("--interval", type=float, default=0.2, help="两次合成请求之间的间隔（秒）")
+    args = parser.parse_args()
+    report("in-process", *asyncio.run(measure(True, args.requests, args.work, args.interval)))
+    report("subprocess", *asyncio.run(measure(False, args.requests, args.work, args.interval)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+网络消息总线基准测试（本机回环，多进程）
+
+消息路径：发送模块 -> 主控 -> 回声模块（TTS 角色）-> 主控 -> 中继模块（PLUGIN 角色）-> 主控 -> 接收模块
+local 模式下全部在主控进程中运行；remote 模式下回声模块和中继模块各在一个节点进程中运行（共 3 个进程）。
+--restart-node 会在发送到一半时杀掉并重启回声节点，用于观察重连和丢失的消息数。
+用法（在项目根目录下）：python benchmarks/bench_remote_bus.py [--messages 200] [--interval 0.02] [--size 98304] [--restart-node]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT)) # 直接运行脚本时也能导入 swarmclone
+from swarmclone.constants import MessageType, ModuleRoles
+from swarmclone.controller import Controller
+from swarmclone.messages import Message
+from swarmclone.module_manager import ModuleBase
+from swarmclone.remote import RemoteModule, TOKEN_ENV
+
+class BenchPing(Message):
+    def __init__(self, source: ModuleBase, seq: int, data: bytes):
+        super().__init__(MessageType.DATA, source, destinations=[ModuleRoles.TTS], seq=seq, data=data)
+
+class BenchEchoed(Message):
+    def __init__(self, source: ModuleBase, seq: int, data: bytes):
+        super().__init__(MessageType.DATA, source, destinations=[ModuleRoles.PLUGIN], seq=seq, data=data)
+
+class BenchDone(Message):
+    def __init__(self, source: ModuleBase, seq: int, data: bytes):
+        super().__init__(MessageType.DATA, source, destinations=[ModuleRoles.FRONTEND], seq=seq, data=data)
+
+class BenchEcho(ModuleBase):
+    role: ModuleRoles = ModuleRoles.TTS
+    async def run(self):
+        while True:
+            value = (await self.task_queue.get()).get_value(self)
+            await self.results_queue.put(BenchEchoed(self, value["seq"], value["data"]))
+
+class BenchRelay(ModuleBase):
+    role: ModuleRoles = ModuleRoles.PLUGIN
+    async def run(self):
+        while True:
+            value = (await self.task_queue.get()).get_value(self)
+            await self.results_queue.put(BenchDone(self, value["seq"], value["data"]))
+
+class BenchSender(ModuleBase):
+    role: ModuleRoles = ModuleRoles.CHAT
+    def __init__(self, n: int, interval: float, size: int, **kwargs):
+        super().__init__(**kwargs)
+        self.n = n
+        self.interval = interval
+        self.size = size
+        self.sent: dict[int, int] = {} # 序号 -> 发送时间
+        self.halfway = asyncio.Event()
+        self.finished = asyncio.Event()
+
+    async def run(self):
+        data = bytes(self.size)
+        for seq in range(self.n):
+            if seq == self.n // 2:
+                self.halfway.set()
+            self.sent[seq] = time.monotonic_ns()
+            await self.results_queue.put(BenchPing(self, seq, data))
+            await asyncio.sleep(self.interval)
+        self.finished.set()
+        await asyncio.Event().wait()
+
+class BenchCollector(ModuleBase):
+    role: ModuleRoles = ModuleRoles.FRONTEND
+    def __init__(self, sender: BenchSender, **kwargs):
+        super().__init__(**kwargs)
+        self.sender = sender
+        self.latencies: list[float] = []
+        self.complete = asyncio.Event()
+
+    async def run(self):
+        while True:
+            value = (await self.task_queue.get()).get_value(self)
+            assert len(value["data"]) == self.sender.size
+            self.latencies.append((time.monotonic_ns() - self.sender.sent[value["seq"]]) / 1e9)
+            if len(self.latencies) == self.sender.n:
+                self.complete.set()
+
+def start_node(port: int) -> subprocess.Popen[bytes]:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), str(ROOT), os.environ.get("PYTHONPATH", "")])}
+    return subprocess.Popen(
+        [sys.executable, "-m", "swarmclone.node", "--host", "127.0.0.1", "--port", str(port), "--import", "bench_remote_bus"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+async def measure(remote: bool, args: argparse.Namespace) -> tuple[list[float], list[RemoteModule]]:
+    controller = Controller()
+    sender = BenchSender(args.messages, args.interval, args.size)
+    collector = BenchCollector(sender)
+    nodes: list[subprocess.Popen[bytes]] = []
+    links: list[RemoteModule] = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        if remote:
+            nodes = [start_node(args.port), start_node(args.port + 1)]
+            links = [
+                RemoteModule(BenchEcho, f"127.0.0.1:{args.port}", lookup=controller.get_module),
+                RemoteModule(BenchRelay, f"127.0.0.1:{args.port + 1}", lookup=controller.get_module)
+            ]
+            for link in links:
+                controller.add_module(link)
+            controller.start_modules()
+            await asyncio.gather(*(link.ready.wait() for link in links))
+        else:
+            controller.add_module(BenchEcho())
+            controller.add_module(BenchRelay())
+        controller.add_module(sender)
+        controller.add_module(collector)
+        controller.start_modules()
+        if remote and args.restart_node:
+            await sender.halfway.wait()
+            nodes[0].kill()
+            nodes[0].wait()
+            nodes[0] = start_node(args.port)
+        await sender.finished.wait()
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(collector.complete.wait(), 5)
+        await controller.stop_modules()
+    for node in nodes:
+        node.kill()
+        node.wait()
+    return collector.latencies, links
+
+def report(name: str, n: int, latencies: list[float], links: list[RemoteModule]):
+    ms = sorted(x * 1000 for x in latencies)
+    p = lambda q: ms[min(len(ms) - 1, int(q * len(ms)))]
+    print(
+        f"{name:<7} received={len(ms)}/{n} mean={statistics.mean(ms):7.3f}ms "
+        f"p50={p(0.5):7.3f}ms p95={p(0.95):7.3f}ms max={ms[-1]:7.3f}ms"
+    )
+    for link in links:
+        stats = link.stats.to_dict()
+        print(
+            f"  link {stats['module']:<10} rtt p50={stats['rtt_ms']['p50']}ms reconnects={stats['reconnects']} "
+            f"sent={stats['bytes_sent']}B received={stats['bytes_received']}B"
+        )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.02, help="发送间隔（秒）")
+    parser.add_argument("--size", type=int, default=96 * 1024, help="每条消息携带的字节数")
+    parser.add_argument("--port", type=int, default=18010, help="节点使用 port 和 port+1")
+    parser.add_argument("--restart-node", action="store_true")
+    args = parser.parse_args()
+    os.environ.setdefault(TOKEN_ENV, secrets.token_hex(16)) # 节点子进程和 RemoteModule 都从环境变量读取
+    report("local", args.messages, *asyncio.run(measure(False, args)))
+    report("remote", args.messages, *asyncio.run(measure(True, args)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+OpenAI 兼容的本地替身服务器，用于测试多后端连接池（故障转移、熔断、对冲请求）
+
+可模拟首 token 延迟、输出速度、请求失败和卡住不输出。
+用法（在项目根目录下）：python benchmarks/stub_llm_server.py [--port 8101] [--ttft 0.2] [--interval 0.02] [--fail-rate 0] [--stall-rate 0]
+然后把 LLM 的模型api网址（或备用模型）设为 http://127.0.0.1:8101/v1，模型id 任意
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+REPLY = "你好呀！我是一个用来测试的替身模型，这句话会被拆成很多小块慢慢输出。希望一切顺利～"
+
+def make_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI()
+    stats = {"requests": 0, "failed": 0, "stalled": 0}
+
+    def chunk(model: str, delta: dict, finish_reason: str | None = None) -> str:
+        return "data: " + json.dumps({
+            "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }, ensure_ascii=False) + "\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        stats["requests"] += 1
+        if random.random() < args.fail_rate:
+            stats["failed"] += 1
+            return Response(json.dumps({"error": {"message": "stub failure"}}), status_code=500, media_type="application/json")
+        stall = random.random() < args.stall_rate
+        stats["stalled"] += stall
+        if not body.get("stream"):
+            await asyncio.sleep(args.ttft)
+            return {
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": len(REPLY), "total_tokens": 10 + len(REPLY)}
+            }
+
+        async def generate():
+            yield chunk(model, {"role": "assistant", "content": ""}) # 先返回角色，与多数后端一致
+            await asyncio.sleep(3600 if stall else args.ttft)
+            for i in range(0, len(REPLY), args.chunk_size):
+                yield chunk(model, {"content": REPLY[i:i + args.chunk_size]})
+                await asyncio.sleep(args.interval)
+            yield chunk(model, {}, "stop")
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--ttft", type=float, default=0.2, help="首个 token 前的延迟（秒）")
+    parser.add_argument("--interval", type=float, default=0.02, help="两个响应块之间的间隔（秒）")
+    parser.add_argument("--chunk-size", type=int, default=2, help="每个响应块的字数")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="直接返回 500 的概率")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="返回角色后卡住不输出的概率")
+    args = parser.parse_args()
+    uvicorn.run(make_app(args), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
+import sys
 from mcp.server.fastmcp import FastMCP
+from mcp.types import ToolAnnotations
 
 mcp = FastMCP("Test Server")
 
-@mcp.tool()
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True, idempotentHint=True)) # 幂等工具的结果可被 LLM 模块缓存
 async def get_weather(location: str):
     """获取指定城市（包含“市”字）的天气
     Args:
@@ -13,4 +15,5 @@ async def get_weather(location: str):
     return f"{location}的天气是晴朗的"
 
 if __name__ == "__main__":
-    mcp.run("stdio")
+    # python test_weather.py 以 stdio 方式运行；python test_weather.py streamable-http 在 http://127.0.0.1:8000/mcp 提供服务
+    mcp.run(sys.argv[1] if len(sys.argv) > 1 else "stdio")
@@ -1,15 +1,20 @@
 import asyncio
+import time
 import numpy as np
 import json
 from typing import Any
 from dataclasses import dataclass, field
 
-from .sherpa_asr import create_recognizer
 from ..modules import *
 from ..messages import ASRMessage, ASRActivated
 from ..utils import *
+from ..metrics import Gauge, Histogram
 
-available_devices = get_devices()
+asr_active_clients = Gauge("swarmclone_asr_active_clients", "Connected ASR clients", ("module",))
+asr_decode_seconds = Histogram(
+    "swarmclone_asr_decode_seconds", "Time spent decoding one ASR audio chunk", ("module",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
 
 @dataclass
 class ASRSherpaConfig(ModuleConfig):
@@ -58,12 +63,12 @@ class ASRSherpaConfig(ModuleConfig):
             {"key": "束搜索", "value": "beam_search"}
         ]
     })
-    provider: str = field(default=[*available_devices.keys()][0], metadata={
+    provider: str = field(default_factory=lambda: next(iter(get_devices())), metadata={
         "required": False,
         "desc": "语音识别模型运行设备",
         "selection": True,
-        "options": [
-            {"key": v, "value": k} for k, v in available_devices.items()
+        "options": lambda: [
+            {"key": v, "value": k} for k, v in get_devices().items()
         ]
     })
     hotwords_file: str = field(default="", metadata={
@@ -91,10 +96,12 @@ class ASRSherpaConfig(ModuleConfig):
 class ASRSherpa(ModuleBase):
     role: ModuleRoles = ModuleRoles.ASR
     config_class = ASRSherpaConfig
+    subscriptions = () # 只发送识别结果，不接收消息
     def __init__(self, config: ASRSherpaConfig | None = None, **kwargs):
         super().__init__()
         self.config = self.config_class(**kwargs) if config is None else config
-        self.recognizer = create_recognizer(self.config)
+        from .sherpa_asr import get_recognizer
+        self.recognizer = get_recognizer(self.config) # 识别器可在多个模块实例间共享，识别状态在 stream 中
         self.stream = self.recognizer.create_stream()
         self.sample_rate = 16000
         self.samples_per_read = int(0.1 * self.sample_rate)
@@ -102,6 +109,9 @@ class ASRSherpa(ModuleBase):
         self.clientdict = {}
         self.server = None
 
+    def collect_metrics(self):
+        asr_active_clients.set(len(self.clientdict), (self.name,))
+
     async def run(self):
         self.server = await asyncio.start_server(
             self.handle_client,
@@ -148,9 +158,11 @@ class ASRSherpa(ModuleBase):
                 break
             sample = np.frombuffer(data, dtype=np.float32).astype(np.float64)
             # 语音识别
+            decode_start = time.perf_counter()
             self.stream.accept_waveform(self.sample_rate, sample)
             while self.recognizer.is_ready(self.stream):
                 self.recognizer.decode_stream(self.stream)
+            asr_decode_seconds.observe(time.perf_counter() - decode_start, (self.name,))
             # 将检测到的结果发送给客户端
             result: str = self.recognizer.get_result(self.stream)
             if result:
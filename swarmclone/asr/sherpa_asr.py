@@ -4,6 +4,7 @@ import os
 from pathlib import Path
 from typing import TYPE_CHECKING
 import sherpa_onnx
+from ..model_pool import model_pool
 if TYPE_CHECKING:
     from .asr import ASRSherpaConfig
 
@@ -14,6 +15,15 @@ def assert_file_exists(filename: str):
         "https://k2-fsa.github.io/sherpa/onnx/pretrained_models/index.html to download it"
     )
 
+def get_recognizer(asr_config: ASRSherpaConfig):
+    """从模型池获取识别器，只有影响识别器构造的配置改变时才重新加载"""
+    key = (
+        "sherpa", asr_config.model, asr_config.quantized, os.path.expanduser(asr_config.model_path),
+        asr_config.decoding_method, asr_config.provider, asr_config.hotwords_file,
+        asr_config.hotwords_score, asr_config.blank_penalty
+    )
+    return model_pool.get(key, lambda: create_recognizer(asr_config))
+
 def create_recognizer(asr_config: ASRSherpaConfig):
     download_models(asr_config)
     assert isinstance((model_path := asr_config.model_path), str)
@@ -32,6 +32,7 @@ class BiliBiliChatConfig(ModuleConfig):
 class BiliBiliChat(ModuleBase):
     role: ModuleRoles = ModuleRoles.CHAT
     config_class = BiliBiliChatConfig
+    subscriptions = () # 只发送弹幕，不接收消息
     config: config_class
     def __init__(self, config: config_class | None = None, **kwargs):
         super().__init__(config, **kwargs)
@@ -23,6 +23,13 @@ class ModuleRoles(Enum):
     # 未指定（仅用于基类，任何未指定角色的模块在注册时都会引发错误）
     UNSPECIFIED = "Unspecified"
 
+class OverflowPolicy(Enum):
+    """模块消息队列满时的处理策略"""
+    BLOCK = "Block" # 等待队列有空位（默认）
+    DROP_OLDEST = "DropOldest" # 丢弃队列中最早的可丢弃消息
+    DROP_NEWEST = "DropNewest" # 丢弃新到达的消息
+    COALESCE_LATEST = "CoalesceLatest" # 用新消息替换队列中同类型的旧消息，只保留最新的一条
+
 class LLMState(Enum):
     IDLE = "Idle"
     GENERATING = "Generating"
@@ -1,20 +1,29 @@
 """
 主控——主控端的核心
 """
+import os
+import time
 import asyncio
+from dataclasses import asdict
 from typing import Any
-from collections import deque
 
 import uvicorn
 from fastapi import FastAPI, Request, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from .modules import *
 from .constants import *
 from .module_manager import module_classes
 from .utils import *
+from .tracing import tracer, STAGES
+from . import metrics
+from .log import logger
+from .message_log import MessageLog
+from .process_worker import ModuleProxy, ProcessModule
+from .remote import RemoteModule
+from .model_pool import model_pool
 
 from . import __version__
 
@@ -23,10 +32,20 @@ class Controller:
         self.clear_modules()
         self.app: FastAPI = FastAPI(title="Zhiluo Controller")
         self.register_routes()
-        self.module_tasks: list[asyncio.Task[Any]] = []
-        self.handler_tasks: list[asyncio.Task[Any]] = []
+        self.module_tasks: dict[str, asyncio.Task[Any]] = {} # 模块名 -> 模块任务
+        self.handler_tasks: dict[str, asyncio.Task[Any]] = {} # 模块名 -> 转发任务
+        self.restart_tasks: dict[str, asyncio.Task[Any]] = {} # 模块名 -> 等待自动重启的任务
+        self.module_locks: dict[str, asyncio.Lock] = {} # 同一模块的停止/重启操作依次进行
+        self.started_at: dict[str, float] = {} # 模块名 -> 最近一次启动的时间
+        self.failures: dict[str, int] = {} # 模块名 -> 连续出错次数，用于计算退避时间
+        self.restarts: dict[str, int] = {} # 模块名 -> 自动重启次数
+        self.restart_backoff: tuple[float, float] = (1.0, 60.0) # 自动重启的初始和最大等待时间（秒）
+        self.stable_time: float = 60.0 # 模块连续运行超过此时间（秒）后出错，退避时间重新计算
         self.agent: ModuleBase = ControllerDummy()
-        self.messages_buffer: deque[Message] = deque(maxlen=200)
+        self.message_log: MessageLog = MessageLog(maxlen=1000)
+        self.legacy_cursor: int = 0 # 不带 since 参数的 /api/get_messages 请求（旧版面板）读到的位置
+        self.max_batch_size: int = 64 # 突发消息一次最多转发多少条
+        self.startup_param: asyncio.Future[list[Any]] | None = None # /api/startup_param 的缓存
 
     def add_module(self, module: ModuleBase):
         """
@@ -43,11 +62,35 @@ class Controller:
                 pass
         assert module.role in self.modules, "不明的模块类型"
         self.modules[module.role].append(module)
+        self.routes.clear()
     
     def clear_modules(self):
         self.modules: dict[ModuleRoles, list[ModuleBase]] = {
             role: [] for role in ModuleRoles if role not in [ModuleRoles.UNSPECIFIED, ModuleRoles.CONTROLLER]
         }
+        self.routes: dict[type[Message], dict[ModuleRoles, list[ModuleBase]]] = {}
+        self.loading: dict[str, dict[str, Any]] = {} # 模块名 -> 加载状态，见 load_module
+        self.stopped_modules: dict[str, ModuleBase] = {} # 通过 /api/stop_module 单独停止的模块
+
+    def compile_routes(self):
+        """
+        根据各模块订阅的消息类型预先计算路由表：
+        {消息类型: {角色: [该角色下接收此类消息的模块, ...]}}
+        """
+        self.routes = {}
+        for message_class in message_classes.values():
+            self.get_route(message_class)
+
+    def get_route(self, message_class: type[Message]) -> dict[ModuleRoles, list[ModuleBase]]:
+        try:
+            return self.routes[message_class]
+        except KeyError: # 路由表编译后才定义的消息类型
+            route = {
+                role: [module for module in modules if module.accepts(message_class)]
+                for role, modules in self.modules.items()
+            }
+            self.routes[message_class] = route
+            return route
 
     def register_routes(self):
         """ 注册FastAPI路由
@@ -59,11 +102,26 @@ class Controller:
         /api/startup_param: 获取配置信息(GET)
         /api/start: 加载配置信息并启动(POST)
         /api/stop: 停止运行(POST)
+        /api/stop_module: 单独停止一个模块(POST)
+        /api/restart_module: 单独重启一个模块(POST)
+        /api/reconfigure_module: 修改一个模块的配置并重启它(POST)
         /api/get_status: 获取状态(GET)
         /api/get_messages: 获取最新信息(GET)
+        /api/stream_messages: 以 Server-Sent Events 推送最新信息(GET)
+        /api/get_queue_stats: 获取各模块消息队列状态(GET)
+        /api/set_queue_policy: 设置模块消息队列溢出策略(POST)
+        /api/get_interrupt_latency: 获取各模块的打断延迟(GET)
+        /api/get_traces: 获取各轮次的延迟瀑布图和各阶段延迟分布(GET)
+        /api/metrics: Prometheus 格式的运行指标(GET)
+        /api/get_links: 获取远程模块的连接状态和延迟(GET)
+        /api/get_model_pool: 获取模型池中已加载的模型(GET)
+        /api/clear_model_pool: 清空模型池(POST)
         /health: 检查是否在线(GET)
         """
-        self.app.mount("/assets", StaticFiles(directory="panel/dist/assets"), name="assets")
+        if os.path.isdir("panel/dist/assets"):
+            self.app.mount("/assets", StaticFiles(directory="panel/dist/assets"), name="assets")
+        else:
+            logger.warning("未找到 panel/dist/assets，网页控制端将不可用（请先构建 panel）")
 
         self.app.add_middleware(
             CORSMiddleware,
@@ -91,7 +149,9 @@ class Controller:
                             "module_name":【模块名字】,
                             "running":【布尔值，是否运行】,
                             "loaded":【布尔值，是否加载】,
-                            "err":【加载错误信息，若无错误则为null，若有错误则为错误信息】
+                            "err":【加载错误信息，若无错误则为null，若有错误则为错误信息】,
+                            "load_time":【加载用时（秒），仍在加载中时为已用时间，未开始加载时为null】,
+                            "restarts":【出错后被自动重启的次数】
                         },...
                     ]
                 },...
@@ -108,11 +168,17 @@ class Controller:
                 for module_name, _module_class in role_module_classes.items():
                     if module_name not in names:
                         continue
+                    state = self.loading.get(module_name, {})
+                    load_time = state.get("load_time")
+                    if state.get("status") == "loading":
+                        load_time = time.perf_counter() - state["start_time"]
                     status[-1]["modules"].append({
                         "module_name": module_name,
                         "running": False,
                         "loaded": False,
-                        "err": None
+                        "err": state.get("err"),
+                        "load_time": load_time,
+                        "restarts": self.restarts.get(module_name, 0)
                     })
             # 将运行中的模块标记为True
             for role in self.modules:
@@ -157,25 +223,9 @@ class Controller:
                 },...
             ]
             """
-            config: list[Any] = []
-            for role, role_module_classes in module_classes.items():
-                if role in [ModuleRoles.LLM, ModuleRoles.TTS, ModuleRoles.CHAT, ModuleRoles.FRONTEND]:
-                    allowed_num = 1
-                else:
-                    allowed_num = len(role_module_classes)
-                
-                config.append({"role_name": role.value, "allowed_num": allowed_num, "modules": []})
-                for module_name, module_class in role_module_classes.items():
-                    if "dummy" in module_name.lower() or "base" in module_name.lower():
-                        continue  # 占位模块和模块基类不应被展示出来
-                    # 使用ModuleBase的get_config_schema方法获取配置信息
-                    schema = module_class.get_config_schema()
-                    config[-1]["modules"].append({
-                        "module_name": schema["module_name"],
-                        "desc": schema["desc"],
-                        "config": schema["config"]
-                    })
-            return JSONResponse(config)
+            if self.startup_param is None: # 部分选项需要联网或导入 torch 才能获得，放到线程中执行，结果缓存
+                self.startup_param = asyncio.ensure_future(asyncio.to_thread(self.get_startup_param))
+            return JSONResponse(await asyncio.shield(self.startup_param))
         
         @self.app.post("/api/start", response_class=JSONResponse)
         async def start(request: Request) -> JSONResponse:
@@ -190,37 +240,49 @@ class Controller:
                 },
                 "selected": [
                     "选中模块名称", ...
-                ]
+                ],
+                "processes": [ // 可选，在独立子进程中运行的模块（run_in_process 为真的模块总是如此）
+                    "模块名称", ...
+                ],
+                "remotes": { // 可选，在远程节点上运行的模块（节点见 node.py）
+                    "模块名称": "节点地址:端口", ...
+                }
             }
             """
             data = await request.json()
-            self.clear_modules()
-            missing_modules: list[str] = []
+            processes: list[str] = data.get("processes", [])
+            remotes: dict[str, str] = data.get("remotes", {})
             cfg = data["cfg"]
-            for role in cfg.keys():
-                for module in cfg[role].keys():
-                    module_config = cfg[role][module]
-                    try:
-                        module_class: type = module_classes[ModuleRoles(role)][module]
-                    except KeyError:
-                        missing_modules.append(module)
-                        continue
-                    
-                    if not missing_modules: # 如果已有缺少模块就不再尝试加载更多模块
-                        for key, value in module_config.items():
-                            if isinstance(value, str):
-                                # 去转义
-                                module_config[key] = unescape_all(value)
-                            else:
-                                module_config[key] = value
-                        try:
-                            module = module_class(**module_config)
-                        except Exception as e:
-                            print(f"ERR: {e}")
-                            return JSONResponse({"error": str(e)}, 500)
-                        self.add_module(module)
+            missing_modules: list[str] = [
+                module for role in cfg.keys() for module in cfg[role].keys()
+                if module not in module_classes[ModuleRoles(role)]
+            ]
             if missing_modules:
                 return JSONResponse(missing_modules, 404)
+            self.clear_modules()
+            jobs: list[tuple[type[ModuleBase], dict[str, Any]]] = []
+            for role in cfg.keys():
+                for module, module_config in cfg[role].items():
+                    jobs.append((module_classes[ModuleRoles(role)][module], {
+                        key: unescape_all(value) if isinstance(value, str) else value # 去转义
+                        for key, value in module_config.items()
+                    }))
+            # 各模块同时加载，只能在主线程中加载的模块排在最后，以免阻塞其他模块开始加载
+            jobs.sort(key=lambda job: not job[0].load_in_thread)
+            start_time = time.perf_counter()
+            results = await asyncio.gather(
+                *(self.load_module(module_class, module_config, processes, remotes) for module_class, module_config in jobs),
+                return_exceptions=True
+            )
+            errors: dict[str, str] = {}
+            for (module_class, _), result in zip(jobs, results):
+                if isinstance(result, BaseException):
+                    errors[module_class.name] = str(result)
+                else:
+                    self.add_module(result)
+            if errors:
+                return JSONResponse({"error": next(iter(errors.values())), "errors": errors}, 500)
+            logger.info("全部模块加载完成，用时 {:.2f} 秒", time.perf_counter() - start_time)
             self.start_modules()
             return JSONResponse({"status": "started"})
 
@@ -229,6 +291,40 @@ class Controller:
             await self.stop_modules()
             return Response()
 
+        @self.app.post("/api/stop_module", response_class=JSONResponse)
+        async def stop_module(request: Request) -> JSONResponse:
+            """
+            {"module": "【模块名】"}
+            只停止该模块，其他模块继续运行，该模块尚未处理的消息被丢弃
+            """
+            data = await request.json()
+            if self.get_module(name := data.get("module", "")) is None:
+                return JSONResponse({"error": "Module not found"}, 404)
+            dropped = await self.stop_module(name)
+            return JSONResponse({"status": "stopped", "dropped": dropped})
+
+        @self.app.post("/api/restart_module", response_class=JSONResponse)
+        async def restart_module(request: Request) -> JSONResponse:
+            """
+            {"module": "【模块名】"}
+            重新构造并启动该模块（也可重启已单独停止的模块），尚未处理的消息会转交给新模块
+            """
+            data = await request.json()
+            return await self.restart_response(data.get("module", ""), None)
+
+        @self.app.post("/api/reconfigure_module", response_class=JSONResponse)
+        async def reconfigure_module(request: Request) -> JSONResponse:
+            """
+            {"module": "【模块名】", "config": {"【配置项名】": 【配置项值】,...}}
+            只需给出要修改的配置项，其余保持不变；模型等资源未改变时直接从模型池复用
+            """
+            data = await request.json()
+            config = {
+                key: unescape_all(value) if isinstance(value, str) else value # 去转义
+                for key, value in data.get("config", {}).items()
+            }
+            return await self.restart_response(data.get("module", ""), config)
+
         @self.app.post("/api")
         async def api(request: Request):
             try:
@@ -268,64 +364,410 @@ class Controller:
             return response
 
         @self.app.get("/api/get_messages", response_class=JSONResponse)
-        async def get_messages():
+        async def get_messages(since: int | None = None, limit: int = 200):
+            """
+            带 since 参数时返回序号大于 since 的消息，不会影响其他客户端：
+            {
+                "messages": [
+                    {
+                        "seq": 【消息序号，单调递增】,
+                        "message_name": "【信息名】",
+                        "send_time": 【发送时间戳，整数】,
+                        "message_type": "【信息类型，DATA或者SIGNAL】",
+                        "message_source": "【消息来源模块名】",
+                        "message_destinations": [
+                            "【消息目的地名】"
+                        ],
+                        "message": [
+                            {"key": "键", "value": "值"},...
+                        ],
+                        "getters": [
+                            {"name": "【获取者名】", "time": 【获取时间戳，整数】},...
+                        ]
+                    },...
+                ],
+                "next": 【下次请求使用的 since】
+            }
+            不带 since 参数时与旧版相同，返回上次不带 since 的请求之后的消息列表（即上面的 "messages"）
+            """
+            if since is None:
+                entries = self.message_log.since(self.legacy_cursor)
+                if entries:
+                    self.legacy_cursor = entries[-1].seq
+                return JSONResponse([entry.to_dict() for entry in entries])
+            entries = self.message_log.since(since, limit)
+            return JSONResponse({
+                "messages": [entry.to_dict() for entry in entries],
+                "next": entries[-1].seq if entries else max(since, self.message_log.last_seq)
+            })
+
+        @self.app.get("/api/stream_messages")
+        async def stream_messages(request: Request, since: int | None = None):
+            """
+            Server-Sent Events 推送，每条消息为一个 event: message，id 为消息序号，data 同 /api/get_messages 中的一条消息
+            可用 since 参数或 Last-Event-ID 请求头从指定序号之后开始，默认只推送新消息
+            """
+            if since is None:
+                last_event_id = request.headers.get("last-event-id", "")
+                since = int(last_event_id) if last_event_id.isdigit() else self.message_log.last_seq
+
+            async def event_stream():
+                cursor = since
+                while not await request.is_disconnected():
+                    if not await self.message_log.wait(cursor, timeout=15):
+                        yield b": keep-alive\n\n"
+                        continue
+                    await asyncio.sleep(0.05) # 稍作等待，合并突发消息并让接收模块先取走消息
+                    entries = self.message_log.since(cursor)
+                    if entries:
+                        cursor = entries[-1].seq
+                        yield b"".join(entry.to_sse() for entry in entries)
+                    else:
+                        cursor = self.message_log.last_seq
+
+            return StreamingResponse(
+                event_stream(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        @self.app.get("/api/get_queue_stats", response_class=JSONResponse)
+        async def get_queue_stats():
             """
             [
                 {
-                    "message_name": "【信息名】",
-                    "send_time": 【发送时间戳，整数】,
-                    "message_type": "【信息类型，DATA或者SIGNAL】",
-                    "message_source": "【消息来源模块名】",
-                    "message_destinations": [
-                        "【消息目的地名】"
-                    ],
-                    "message": [
-                        {"key": "键", "value": "值"},...
-                    ],
-                    "getters": [
-                        {"name": "【获取者名】", "time": 【获取时间戳，整数】},...
-                    ]
+                    "module_name": "【模块名】",
+                    "task_queue_size": 【待处理消息数】,
+                    "task_queue_maxsize": 【队列容量】,
+                    "results_queue_size": 【待转发消息数】,
+                    "default_policy": "【默认溢出策略】",
+                    "policies": {"【消息类名】": "【溢出策略】", ...},
+                    "dropped": {"【消息类名】": 【丢弃数量】, ...}
                 },...
             ]
             """
             res: list[dict[str, Any]] = []
-            for message in self.messages_buffer:
-                res.append(message.get_dict_repr())
-            self.messages_buffer.clear()
+            for modules in self.modules.values():
+                for module in modules:
+                    res.append({
+                        "module_name": module.name,
+                        "task_queue_size": module.task_queue.qsize(),
+                        "task_queue_maxsize": module.task_queue.maxsize,
+                        "results_queue_size": module.results_queue.qsize(),
+                        "default_policy": module.task_queue.default_policy.value,
+                        "policies": {
+                            cls.__name__: policy.value
+                            for cls, policy in module.task_queue.policies.items()
+                        },
+                        "dropped": dict(module.task_queue.dropped)
+                    })
+            return JSONResponse(res)
+
+        @self.app.get("/api/get_interrupt_latency", response_class=JSONResponse)
+        async def get_interrupt_latency():
+            """
+            从 ASRActivated 产生到各模块停止播放/生成的延迟（毫秒）
+            [
+                {"module_name": "【模块名】", "count": 【样本数】, "last": 【最近一次】, "p50": 【中位数】, "p95": 【95分位】, "max": 【最大值】},...
+            ]
+            """
+            res: list[dict[str, Any]] = []
+            for modules in self.modules.values():
+                for module in modules:
+                    if not module.interrupt_latencies:
+                        continue
+                    latencies = sorted(module.interrupt_latencies)
+                    res.append({
+                        "module_name": module.name,
+                        "count": len(latencies),
+                        "last": module.interrupt_latencies[-1],
+                        "p50": latencies[len(latencies) // 2],
+                        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                        "max": latencies[-1]
+                    })
             return JSONResponse(res)
 
+        @self.app.get("/api/get_traces", response_class=JSONResponse)
+        async def get_traces(limit: int = 20):
+            """
+            {
+                "stages": ["input", "first_token", ...],
+                "turns": [
+                    {
+                        "trace_id": "【轮次id】",
+                        "source": "【开启轮次的消息类型】",
+                        "wall_time": 【开始时间戳】,
+                        "stages": [{"stage": "【阶段名】", "offset_ms": 【相对输入的时间，毫秒】},...]
+                    },...
+                ],
+                "histograms": {
+                    "【阶段名（相对上一阶段）或total】": {"count": 【样本数】, "p50": 【毫秒】, "p95": 【毫秒】, "p99": 【毫秒】},...
+                }
+            }
+            """
+            return JSONResponse({
+                "stages": STAGES,
+                "turns": tracer.get_waterfalls(limit),
+                "histograms": tracer.get_histograms()
+            })
+
+        @self.app.get("/api/get_links", response_class=JSONResponse)
+        async def get_links():
+            """
+            [
+                {
+                    "module": 【模块名】,
+                    "address": 【节点地址】,
+                    "connected": 【布尔值，是否已连接】,
+                    "reconnects": 【重连次数】,
+                    "messages_sent": 【发送的消息数】, "messages_received": 【接收的消息数】,
+                    "bytes_sent": 【发送的字节数】, "bytes_received": 【接收的字节数】,
+                    "rtt_ms": {"last": 【最近一次】, "p50": ..., "p95": ..., "smoothed": 【平滑值】}
+                },...
+            ]
+            """
+            return JSONResponse([
+                {**module.stats.to_dict(), "address": f"{module.host}:{module.port}"}
+                for modules in self.modules.values()
+                for module in modules
+                if isinstance(module, RemoteModule)
+            ])
+
+        @self.app.get("/api/get_model_pool", response_class=JSONResponse)
+        async def get_model_pool():
+            """
+            [
+                {
+                    "kind": 【模型种类】,
+                    "key": [【与加载相关的配置】,...],
+                    "size": 【估计占用的字节数，无法估计时为null】,
+                    "load_time": 【加载用时，秒】,
+                    "hits": 【被复用的次数】,
+                    "last_used": 【最近一次使用的时间戳】
+                },...
+            ]
+            """
+            return JSONResponse(model_pool.get_stats())
+
+        @self.app.post("/api/clear_model_pool", response_class=JSONResponse)
+        async def clear_model_pool():
+            """清空模型池，正在运行的模块仍持有自己的模型，停止后才会释放"""
+            await asyncio.to_thread(model_pool.clear)
+            return JSONResponse({"status": "OK"})
+
+        @self.app.get("/api/metrics", response_class=PlainTextResponse)
+        async def get_metrics():
+            """Prometheus 文本格式（0.0.4）的运行指标，队列深度等只在此时计算"""
+            self.collect_metrics()
+            return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+        @self.app.post("/api/set_queue_policy", response_class=JSONResponse)
+        async def set_queue_policy(request: Request) -> JSONResponse:
+            """
+            {
+                "module": "【模块名】",
+                "message": "【消息类名，不填则设置默认策略】",
+                "policy": "【Block/DropOldest/DropNewest/CoalesceLatest】"
+            }
+            """
+            data = await request.json()
+            if (module := self.get_module(data.get("module", ""))) is None:
+                return JSONResponse({"error": "Module not found"}, 404)
+            try:
+                policy = OverflowPolicy(data.get("policy"))
+                message_class = message_classes[data["message"]] if data.get("message") else None
+            except (ValueError, KeyError) as e:
+                return JSONResponse({"error": f"Invalid policy or message: {e}"}, 400)
+            module.task_queue.set_policy(message_class, policy)
+            return JSONResponse({"status": "OK"})
+
+    async def load_module(self, module_class: type[ModuleBase], module_config: dict[str, Any],
+                          processes: list[str], remotes: dict[str, str]) -> ModuleBase:
+        """
+        构造模块（加载模型等），默认在线程池中进行，以便多个模块同时加载且不阻塞服务器
+        加载进度记录在 self.loading 中：
+        {"status": "loading"/"loaded"/"error", "err": 【错误信息】, "load_time": 【加载用时，秒】, "start_time": 【开始时间】}
+        """
+        name = module_class.name
+        start_time = time.perf_counter()
+        state = self.loading[name] = {"status": "loading", "err": None, "load_time": None, "start_time": start_time}
+
+        def build() -> ModuleBase:
+            if name in remotes:
+                return RemoteModule(module_class, remotes[name], lookup=self.get_module, **module_config)
+            if module_class.run_in_process or name in processes:
+                return ProcessModule(module_class, lookup=self.get_module, **module_config)
+            return module_class(**module_config)
+
+        try:
+            module = await asyncio.to_thread(build) if module_class.load_in_thread else build()
+        except Exception as e:
+            logger.exception("加载模块 {} 失败：{}", name, e)
+            state.update(status="error", err=repr(e), load_time=time.perf_counter() - start_time)
+            raise
+        state.update(status="loaded", load_time=time.perf_counter() - start_time)
+        logger.info("模块 {} 加载完成，用时 {:.2f} 秒", name, state["load_time"])
+        return module
+
+    def collect_metrics(self):
+        metrics.task_queue_depth.clear()
+        metrics.results_queue_depth.clear()
+        for modules in self.modules.values():
+            for module in modules:
+                metrics.task_queue_depth.set(module.task_queue.qsize(), (module.name,))
+                metrics.results_queue_depth.set(module.results_queue.qsize(), (module.name,))
+                for message_name, count in module.task_queue.dropped.items():
+                    metrics.queue_dropped_total.set_total(count, (module.name, message_name))
+                module.collect_metrics()
+
+    def get_module(self, name: str) -> ModuleBase | None:
+        for modules in self.modules.values():
+            for module in modules:
+                if module.name == name:
+                    return module
+        return None
+
     async def handle_message(self, message: Message):
+        """
+        将消息放入所有目标模块的 task_queue
+        先按各队列的溢出策略非阻塞地投递，需要等待的队列再并发等待，
+        这样一个处理缓慢的模块不会拖慢同一消息的其他目标
+        """
+        metrics.messages_total.inc(1, (type(message).__name__,))
+        route = self.get_route(type(message))
+        blocked: list[ModuleBase] = []
         for destination in message.destinations:
-            for module_destination in self.modules[destination]:
-                await module_destination.task_queue.put(message)
+            module_destinations = route.get(destination, ()) if isinstance(destination, ModuleRoles) else (destination,)
+            for module_destination in module_destinations:
+                try:
+                    module_destination.task_queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    blocked.append(module_destination)
+        if blocked:
+            await asyncio.gather(*(module.task_queue.put(message) for module in blocked))
     
     def start_modules(self):
-        loop = asyncio.get_event_loop()
+        self.compile_routes()
         for (module_role, modules) in self.modules.items():
             for i, module in enumerate(filter(lambda x: not x.running, modules)):
-                module_task = loop.create_task(module.run(), name=repr(module))
-                handler_task = loop.create_task(self.handle_module(module, module_task), name=f"{module_role} handler")
-                self.module_tasks.append(module_task)
-                self.handler_tasks.append(handler_task)
-                print(f"{module}已启动（{i + 1}/{len(modules)}）")
-                module.running = True
+                self.start_module(module)
+                logger.info("{}已启动（{}/{}）", module, i + 1, len(modules))
             if len(modules) > 0:
-                print(f"{module_role.value}模块已启动")
+                logger.info("{}模块已启动", module_role.value)
+
+    def start_module(self, module: ModuleBase):
+        loop = asyncio.get_event_loop()
+        module_task = loop.create_task(module.run(), name=repr(module))
+        handler_task = loop.create_task(self.handle_module(module, module_task), name=f"{module.role} handler")
+        self.module_tasks[module.name] = module_task
+        self.handler_tasks[module.name] = handler_task
+        self.started_at[module.name] = time.monotonic()
+        module.running = True
+
+    async def halt_module(self, module: ModuleBase):
+        """取消模块任务及其子任务并等待退出，模块已产生的结果会先被转发出去"""
+        module_task = self.module_tasks.pop(module.name, None)
+        handler_task = self.handler_tasks.pop(module.name, None)
+        tasks = [task for task in (module_task, handler_task) if task is not None]
+        if module_task is not None:
+            module_task.cancel()
+        if tasks: # handle_module 在模块任务结束后会自行退出
+            _done, pending = await asyncio.wait(tasks, timeout=10)
+            for task in pending:
+                logger.warning("{}未能及时退出", task.get_name())
+                task.cancel()
+        await module.cancel_child_tasks()
+        module.running = False
+
+    async def stop_module(self, name: str) -> int:
+        """单独停止一个模块，其他模块继续运行；返回被丢弃的待处理消息数"""
+        async with self.module_locks.setdefault(name, asyncio.Lock()):
+            if (restart_task := self.restart_tasks.pop(name, None)) is not None:
+                restart_task.cancel()
+            if (module := self.get_module(name)) is None:
+                raise KeyError(name)
+            self.modules[module.role].remove(module) # 先从路由中移除，不再接收新消息
+            self.compile_routes()
+            await self.halt_module(module)
+            dropped = module.task_queue.qsize()
+            while not module.task_queue.empty():
+                module.task_queue.get_nowait()
+            self.stopped_modules[name] = module
+            logger.info("{}已停止，丢弃 {} 条待处理消息", module, dropped)
+            return dropped
+
+    async def restart_module(self, name: str, config: dict[str, Any] | None = None) -> ModuleBase:
+        """
+        重新构造并启动一个模块（可同时修改配置），其他模块继续运行
+        新模块构造完成前旧模块照常工作；替换时旧模块未处理的消息按原顺序移入新模块的队列
+        """
+        async with self.module_locks.setdefault(name, asyncio.Lock()):
+            if (restart_task := self.restart_tasks.pop(name, None)) is not None and restart_task is not asyncio.current_task():
+                restart_task.cancel()
+            if (old := self.get_module(name) or self.stopped_modules.get(name)) is None:
+                raise KeyError(name)
+            module_class = old.module_class if isinstance(old, ModuleProxy) else type(old)
+            module_config = {**asdict(old.config), **(config or {})}
+            processes = [name] if isinstance(old, ProcessModule) else []
+            remotes = {name: f"{old.host}:{old.port}"} if isinstance(old, RemoteModule) else {}
+            new = await self.load_module(module_class, module_config, processes, remotes)
+            await self.halt_module(old)
+            modules = self.modules[old.role]
+            if old in modules:
+                modules[modules.index(old)] = new
+            else:
+                modules.append(new)
+            self.stopped_modules.pop(name, None)
+            self.compile_routes()
+            moved = await old.task_queue.hand_over(new.task_queue) # 包括替换前已在等待放入旧队列的消息
+            self.start_module(new)
+            logger.info("{}已重启，转移 {} 条待处理消息", new, moved)
+            return new
+
+    async def restart_response(self, name: str, config: dict[str, Any] | None) -> JSONResponse:
+        if self.get_module(name) is None and name not in self.stopped_modules:
+            return JSONResponse({"error": "Module not found"}, 404)
+        start_time = time.perf_counter()
+        try:
+            await self.restart_module(name, config)
+        except Exception as e: # 构造失败时旧模块仍在运行
+            return JSONResponse({"error": str(e)}, 500)
+        return JSONResponse({"status": "restarted", "time": time.perf_counter() - start_time})
+
+    def schedule_restart(self, module: ModuleBase):
+        """模块出错后按指数退避自动重启"""
+        if time.monotonic() - self.started_at.get(module.name, 0) > self.stable_time:
+            self.failures[module.name] = 0
+        failures = self.failures[module.name] = self.failures.get(module.name, 0) + 1
+        initial, maximum = self.restart_backoff
+        delay = min(maximum, initial * 2 ** (failures - 1))
+        logger.warning("{}将在 {:.1f} 秒后自动重启（连续第 {} 次出错）", module, delay, failures)
+
+        async def restart():
+            await asyncio.sleep(delay)
+            if self.restart_tasks.get(module.name) is asyncio.current_task():
+                del self.restart_tasks[module.name]
+            if self.get_module(module.name) is not module: # 期间已被手动停止、重启或重新 /api/start
+                return
+            self.restarts[module.name] = self.restarts.get(module.name, 0) + 1
+            try:
+                await self.restart_module(module.name)
+            except Exception as e:
+                logger.error("{}自动重启失败：{}", module, e)
+                self.started_at[module.name] = time.monotonic()
+                self.schedule_restart(module)
+
+        self.restart_tasks[module.name] = asyncio.get_event_loop().create_task(restart(), name=f"{module.name} restart")
 
     async def stop_modules(self):
-        for task in self.module_tasks:
-            print(f"停止{task.get_name()}模块任务")
+        for task in self.restart_tasks.values():
             task.cancel()
-        for task in self.handler_tasks:
-            print(f"停止{task.get_name()}模块任务")
-            task.cancel()
-        for _role, modules in self.modules.items():
-            for module in modules:
-                module.running = False
-        self.module_tasks.clear()
-        self.handler_tasks.clear()
-        self.messages_buffer.clear()
-        print("等待剩余协程退出")
+        self.restart_tasks.clear()
+        running = [module for modules in self.modules.values() for module in modules]
+        for module in running:
+            logger.info("停止{}", module)
+        await asyncio.gather(*(self.halt_module(module) for module in running))
+        logger.info("等待剩余协程退出")
         tasks = [
             t for t in asyncio.all_tasks()
             if t is not asyncio.current_task()
@@ -336,6 +778,28 @@ class Controller:
                 t.cancel()
         await asyncio.gather(*tasks, return_exceptions=True)
 
+    def get_startup_param(self) -> list[Any]:
+        """生成 /api/startup_param 返回的模块配置信息，可能较慢，不应在事件循环线程中调用"""
+        config: list[Any] = []
+        for role, role_module_classes in module_classes.items():
+            if role in [ModuleRoles.LLM, ModuleRoles.TTS, ModuleRoles.CHAT, ModuleRoles.FRONTEND]:
+                allowed_num = 1
+            else:
+                allowed_num = len(role_module_classes)
+            
+            config.append({"role_name": role.value, "allowed_num": allowed_num, "modules": []})
+            for module_name, module_class in role_module_classes.items():
+                if "dummy" in module_name.lower() or "base" in module_name.lower():
+                    continue  # 占位模块和模块基类不应被展示出来
+                # 使用ModuleBase的get_config_schema方法获取配置信息
+                schema = module_class.get_config_schema()
+                config[-1]["modules"].append({
+                    "module_name": schema["module_name"],
+                    "desc": schema["desc"],
+                    "config": schema["config"]
+                })
+        return config
+
     def run(self):
         self.start_modules()
         
@@ -349,6 +813,8 @@ class Controller:
         loop = asyncio.get_event_loop()
 
         server_task = loop.create_task(server.serve(), name="ROOT SERVER")
+        # 在后台提前生成模块配置信息，面板打开时不必等待
+        self.startup_param = loop.create_task(asyncio.to_thread(self.get_startup_param))
         try:
             loop.run_until_complete(server_task)
         except KeyboardInterrupt:
@@ -357,16 +823,36 @@ class Controller:
         finally:
             loop.run_until_complete(server.shutdown())
     
+    async def dispatch(self, messages: list[Message]):
+        """批量转发一次唤醒中取出的所有消息"""
+        for message in messages:
+            self.message_log.append(message)
+            await self.handle_message(message)
+
     async def handle_module(self, module: ModuleBase, module_task: asyncio.Task[None]):
-        while True:
-            if module_task.done():
-                module.running = False
-                if (not module_task.cancelled()) and ((err := module_task.exception()) is not None):
-                    print(f"{module}模块任务异常：{err}")
-                    module.err = err
+        """
+        转发模块产生的消息
+        结果队列中一有消息就会被立即唤醒，同时取出突发到达的其余消息（至多 max_batch_size 条）一并转发；
+        模块任务结束时也会被唤醒，转发完残留的消息后退出
+        """
+        while not module_task.done():
+            getter = asyncio.ensure_future(module.results_queue.get())
+            await asyncio.wait((getter, module_task), return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel() # 模块已退出，取消等待（未取出的消息仍留在队列中）
                 break
-            if not module.results_queue.empty():
-                result = module.results_queue.get_nowait()
-                self.messages_buffer.append(result)
-                await self.handle_message(result)
-            await asyncio.sleep(0.05) # 以防空转占满 CPU
+            batch = [getter.result()]
+            while len(batch) < self.max_batch_size and not module.results_queue.empty():
+                batch.append(module.results_queue.get_nowait())
+            await self.dispatch(batch)
+        remaining: list[Message] = []
+        while not module.results_queue.empty():
+            remaining.append(module.results_queue.get_nowait())
+        if remaining:
+            await self.dispatch(remaining)
+        module.running = False
+        if (not module_task.cancelled()) and ((err := module_task.exception()) is not None):
+            logger.opt(exception=err).error("{}模块任务异常：{}", module, err)
+            module.err = err
+            if module.restart_on_failure and self.get_module(module.name) is module:
+                self.schedule_restart(module)
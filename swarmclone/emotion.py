@@ -0,0 +1,265 @@
+"""
+情感分类流水线
+句子生成完毕后立即提交分类，分类在后台进行，同时 LLM 继续生成后面的句子；
+分类任务排队时会被合并为一批，在一次线程切换中完成（同样长度的句子共用一次前向计算，不需要补齐，结果与逐句分类相同）。
+句子发送给 TTS 前最多等待 deadline 秒，超时则沿用上一句的情感（或中性），不让 TTS 等待分类器。
+可选把分类模型动态量化为 int8 并导出为 TorchScript（缓存在模型目录下），之后启动时无需导入 transformers。
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Coroutine
+from .metrics import Counter, Histogram
+from .log import logger
+
+EMOTION_LABELS = ['neutral', 'like', 'sad', 'disgust', 'anger', 'happy']
+NEUTRAL: dict[str, float] = {label: float(label == 'neutral') for label in EMOTION_LABELS}
+
+emotion_batch_size = Histogram(
+    "swarmclone_llm_emotion_batch_size", "Sentences classified per emotion classifier batch", buckets=(1, 2, 3, 4, 6, 8, 16)
+)
+emotion_fallbacks_total = Counter(
+    "swarmclone_llm_emotion_fallbacks_total", "Sentences sent to TTS with a fallback emotion because the classifier missed its deadline"
+)
+emotion_cache_hits_total = Counter("swarmclone_llm_emotion_cache_hits_total", "Emotion classifications served from the cache")
+
+class EmotionClassifier:
+    def __init__(self, model: Any, tokenizer: Any, spawn: Callable[[Coroutine[Any, Any, None]], asyncio.Task[None]] | None = None,
+                 max_batch_size: int = 8, cache_size: int = 256):
+        """
+        model, tokenizer: 情感分类模型及其分词器
+        spawn: 创建后台任务的函数（如 ModuleBase.create_task），默认 asyncio.create_task
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.spawn = spawn or asyncio.create_task
+        self.max_batch_size = max_batch_size
+        self.cache: OrderedDict[str, dict[str, float]] = OrderedDict()
+        self.cache_size = cache_size
+        self.queue: asyncio.Queue[tuple[str, asyncio.Future[dict[str, float]]]] = asyncio.Queue()
+        self.pending: dict[str, asyncio.Future[dict[str, float]]] = {} # 已提交、尚未完成的句子
+        self.worker: asyncio.Task[None] | None = None
+
+    def submit(self, text: str) -> asyncio.Future[dict[str, float]]:
+        """提交一个句子，立即返回，分类结果通过 Future 获得"""
+        loop = asyncio.get_running_loop()
+        if (emotion := self.cache.get(text)) is not None:
+            self.cache.move_to_end(text)
+            emotion_cache_hits_total.inc()
+            future: asyncio.Future[dict[str, float]] = loop.create_future()
+            future.set_result(emotion)
+            return future
+        if (future := self.pending.get(text)) is not None: # 同一句子正在分类
+            return future
+        future = self.pending[text] = loop.create_future()
+        self.queue.put_nowait((text, future))
+        if self.worker is None or self.worker.done():
+            self.worker = self.spawn(self.run())
+        return future
+
+    async def classify(self, text: str) -> dict[str, float]:
+        return await asyncio.shield(self.submit(text))
+
+    async def get(self, future: asyncio.Future[dict[str, float]], deadline: float,
+                  fallback: dict[str, float] | None = None) -> dict[str, float]:
+        """最多等待 deadline 秒，超时返回 fallback（默认中性），分类仍会在后台完成并写入缓存"""
+        if not future.done() and deadline > 0:
+            await asyncio.wait((future,), timeout=deadline)
+        if future.done() and not future.cancelled() and future.exception() is None:
+            return future.result()
+        emotion_fallbacks_total.inc()
+        return fallback or NEUTRAL
+
+    async def run(self):
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                while len(batch) < self.max_batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                texts = [text for text, _ in batch]
+                emotion_batch_size.observe(len(batch))
+                try:
+                    emotions = await asyncio.to_thread(self.classify_batch, texts)
+                except Exception as e:
+                    for text, future in batch:
+                        self.pending.pop(text, None)
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (text, future), emotion in zip(batch, emotions):
+                    self.pending.pop(text, None)
+                    self.cache[text] = emotion
+                    if not future.done():
+                        future.set_result(emotion)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        finally: # 被取消（模块停止）时，尚未完成的分类不会再有结果
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+    def classify_batch(self, texts: list[str]) -> list[dict[str, float]]:
+        """在线程中运行：按 token 长度分组，每组一次前向计算"""
+        import torch
+        ids_list: list[list[int]] = self.tokenizer(texts)['input_ids']
+        groups: dict[int, list[int]] = {}
+        for i, ids in enumerate(ids_list):
+            groups.setdefault(len(ids), []).append(i)
+        results: list[dict[str, float]] = [NEUTRAL] * len(texts)
+        with torch.no_grad(): # no_grad 需要在运行模型的线程中生效
+            for indices in groups.values():
+                ids = torch.tensor([ids_list[i] for i in indices])
+                probs = self.model(input_ids=ids).logits.softmax(dim=-1)
+                for i, row in zip(indices, probs.tolist()):
+                    results[i] = dict(zip(EMOTION_LABELS, row))
+        return results
+
+# 量化模型的一致性检查用句，覆盖不同长度和情感
+PARITY_SENTENCES = [
+    "你好。",
+    "今天天气真不错，我们出去玩吧！",
+    "我好难过，谁来安慰一下我……",
+    "这也太恶心了吧。",
+    "你再说一遍试试？我真的生气了！",
+    "哈哈哈哈，笑死我了，这个弹幕太有意思了。",
+    "嗯。",
+    "谢谢大家今天来看我的直播，明天同一时间再见哦～",
+]
+INT8_DIR = "int8" # 量化模型缓存在 classifier_model_path 下的这个目录中
+INT8_MODEL = "model.pt"
+INT8_TOKENIZER = "tokenizer.json"
+INT8_META = "meta.json"
+
+class ScriptedOutput:
+    __slots__ = ("logits",)
+    def __init__(self, logits: Any):
+        self.logits = logits
+
+class ScriptedClassifier:
+    """TorchScript 模型的包装，调用方式与 transformers 模型相同（model(input_ids=ids).logits）"""
+    def __init__(self, module: Any):
+        self.module = module
+
+    def __call__(self, input_ids: Any) -> ScriptedOutput:
+        return ScriptedOutput(self.module(input_ids))
+
+class FastTokenizer:
+    """tokenizers 库分词器的包装，只提供 EmotionClassifier 需要的接口，不导入 transformers"""
+    def __init__(self, tokenizer: Any):
+        self.tokenizer = tokenizer
+
+    def __call__(self, texts: list[str], return_tensors: str | None = None) -> dict[str, Any]:
+        ids = [encoding.ids for encoding in self.tokenizer.encode_batch(texts)]
+        if return_tensors == "pt":
+            import torch
+            return {"input_ids": torch.tensor(ids)}
+        return {"input_ids": ids}
+
+def source_mtime(path: str) -> float:
+    """模型目录中文件（不含量化缓存）的最新修改时间，用于判断缓存是否过期"""
+    return max((entry.stat().st_mtime for entry in os.scandir(path) if entry.is_file()), default=0.0)
+
+def read_meta(path: str) -> dict[str, Any] | None:
+    """读取量化缓存的元数据，不存在或已过期（模型文件或 torch 版本变化）时返回 None"""
+    import torch
+    try:
+        with open(os.path.join(path, INT8_DIR, INT8_META)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("torch") != torch.__version__ or meta.get("source_mtime") != source_mtime(path):
+        return None
+    return meta
+
+def load_int8(path: str) -> tuple[Any, Any] | None:
+    """加载缓存的 int8 TorchScript 模型及分词器，缓存不存在、已过期或未通过一致性检查时返回 None"""
+    import torch
+    if (meta := read_meta(path)) is None or meta.get("rejected"):
+        return None
+    cache_dir = os.path.join(path, INT8_DIR)
+    model = ScriptedClassifier(torch.jit.load(os.path.join(cache_dir, INT8_MODEL), map_location="cpu"))
+    if os.path.exists(tokenizer_path := os.path.join(cache_dir, INT8_TOKENIZER)):
+        from tokenizers import Tokenizer
+        tokenizer: Any = FastTokenizer(Tokenizer.from_file(tokenizer_path))
+    else:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(path, trust_remote_code=True)
+    return model, tokenizer
+
+def write_meta(path: str, **meta: Any):
+    import torch
+    with open(os.path.join(path, INT8_DIR, INT8_META), "w") as f:
+        json.dump({"torch": torch.__version__, "source_mtime": source_mtime(path), **meta}, f)
+
+def compare_outputs(reference: tuple[Any, Any], candidate: tuple[Any, Any],
+                    sentences: list[str] = PARITY_SENTENCES) -> dict[str, Any]:
+    """逐句比较两个（模型, 分词器）的分类概率，返回最大概率误差、类别一致率及分词是否一致"""
+    import torch
+    ref_model, ref_tokenizer = reference
+    model, tokenizer = candidate
+    max_diff = 0.0
+    agree = 0
+    same_ids = True
+    with torch.no_grad():
+        for text in sentences:
+            ref_ids = ref_tokenizer([text], return_tensors="pt")["input_ids"]
+            ids = tokenizer([text], return_tensors="pt")["input_ids"]
+            same_ids = same_ids and ref_ids.tolist() == ids.tolist()
+            ref_probs = ref_model(input_ids=ref_ids).logits.softmax(dim=-1)
+            probs = model(input_ids=ids).logits.softmax(dim=-1)
+            max_diff = max(max_diff, (ref_probs - probs).abs().max().item())
+            agree += int(ref_probs.argmax(dim=-1).item() == probs.argmax(dim=-1).item())
+    return {"max_diff": max_diff, "agreement": agree / len(sentences), "same_ids": same_ids}
+
+def export_int8(path: str, model: Any, tokenizer: Any, tolerance: float = 0.05) -> tuple[Any, Any] | None:
+    """
+    把 transformers 模型动态量化为 int8（LSTM 和 Linear 层）并导出为 TorchScript，缓存到 path 下
+    导出后与原模型逐句比较，最大概率误差超过 tolerance 或类别不一致时放弃导出，返回 None
+    """
+    import torch
+    if (meta := read_meta(path)) is not None and meta.get("rejected"): # 之前已检查过，不再重复导出
+        return None
+    class Logits(torch.nn.Module):
+        def __init__(self, model: Any):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids: Any) -> Any:
+            return self.model(input_ids=input_ids).logits
+
+    model.eval()
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+    example = tokenizer([PARITY_SENTENCES[1]], return_tensors="pt")["input_ids"]
+    with torch.no_grad():
+        scripted = torch.jit.trace(Logits(quantized), example, strict=False, check_trace=False)
+    candidate: tuple[Any, Any] = (ScriptedClassifier(scripted), tokenizer)
+    backend = getattr(tokenizer, "backend_tokenizer", None) # 快速分词器可以脱离 transformers 使用
+    if backend is not None:
+        from tokenizers import Tokenizer
+        fast_tokenizer = FastTokenizer(Tokenizer.from_str(backend.to_str()))
+        if tokenizer(PARITY_SENTENCES)["input_ids"] == fast_tokenizer(PARITY_SENTENCES)["input_ids"]:
+            candidate = (candidate[0], fast_tokenizer)
+        else:
+            backend = None
+    parity = compare_outputs((model, tokenizer), candidate)
+    cache_dir = os.path.join(path, INT8_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    if parity["max_diff"] > tolerance or parity["agreement"] < 1.0:
+        logger.warning("情感分类量化模型与原模型不一致（{}），继续使用 transformers 模型", parity)
+        write_meta(path, rejected=True, **parity)
+        return None
+    torch.jit.save(scripted, os.path.join(cache_dir, INT8_MODEL))
+    if backend is not None:
+        backend.save(os.path.join(cache_dir, INT8_TOKENIZER))
+    else:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(cache_dir, INT8_TOKENIZER))
+    write_meta(path, **parity) # 最后写入，作为缓存完整的标志
+    logger.info("情感分类模型已量化并缓存到 {}，最大概率误差 {:.4f}", cache_dir, parity["max_diff"])
+    return candidate
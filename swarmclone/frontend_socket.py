@@ -5,6 +5,7 @@ from typing import Any
 from dataclasses import dataclass, field
 from .modules import *
 from .messages import *
+from . import log
 
 @dataclass
 class FrontendSocketConfig(ModuleConfig):
@@ -26,35 +27,35 @@ class FrontendSocket(ModuleBase):
     role: ModuleRoles = ModuleRoles.FRONTEND
     config_class = FrontendSocketConfig
     config: config_class
+    queue_policies = {ChatMessage: OverflowPolicy.DROP_OLDEST, ASRMessage: OverflowPolicy.DROP_OLDEST} # 客户端跟不上时优先丢弃聊天记录
     def __init__(self, config: config_class | None = None, **kwargs):
         super().__init__(config, **kwargs)
         self.clientdict: dict[int, asyncio.StreamWriter] = {}
         self.server: asyncio.Server | None = None
 
     async def run(self):
-        loop = asyncio.get_running_loop()
         self.server = await asyncio.start_server(
             self.handle_client,
             self.config.host,
             port=self.config.port
         )
-        loop.create_task(self.send_to_frontend())
+        self.create_task(self.send_to_frontend())
         async with self.server:
             await self.server.serve_forever()
     
     async def send_to_frontend(self):
         while True:
             task = await self.task_queue.get()
-            print(type(task))
             to_remove = []
             message = self.load(task)
             for addr, client in self.clientdict.items():
                 try:
                     client.write(message.encode('utf-8'))
                     await client.drain()
-                    print(f"消息已发送给 {addr}")
+                    if log.debug_enabled:
+                        self.logger.debug("{} 已发送给 {}", get_type_name(task), addr)
                 except ConnectionResetError:
-                    print(f"客户端 {addr} 已断开连接")
+                    self.logger.info("客户端 {} 已断开连接", addr)
                     client.close()
                     to_remove.append(addr)
             for addr in to_remove:
@@ -62,11 +63,12 @@ class FrontendSocket(ModuleBase):
 
     async def handle_client(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
         addr = writer.get_extra_info('peername')
-        print(f"客户端已连接：{addr}")
+        self.logger.info("客户端已连接：{}", addr)
         self.clientdict[addr[1]] = writer
         while True:
             data = await reader.read(1024)
-            print(f"消息来自：{addr}")
+            if log.debug_enabled:
+                self.logger.debug("消息来自：{}", addr)
             if not data:
                 break
             message = json.loads(data.decode(), object_hook=dict[str, Any])
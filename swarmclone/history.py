@@ -0,0 +1,156 @@
+"""
+按 token 预算管理的对话历史
+系统提示词固定在最前面，不计入预算，也不会被压缩。
+其余对话超过预算的一定比例后，在后台把较早的对话交给总结函数压缩为一段摘要（放在系统提示词之后）；
+总结完成前对话仍可继续追加，若超出预算上限（或未提供总结函数、总结失败）则直接丢弃最早的对话。
+每条记录转换后的消息参数和 token 数只计算一次。
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+from typing import Any, Awaitable, Callable, Coroutine
+from .log import logger
+
+MESSAGE_OVERHEAD = 4 # 每条消息除内容外的 token 数（角色、分隔符等）
+_CJK = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+def estimate_tokens(text: str) -> int:
+    """没有分词器时的估算：中日韩字符每字约 1 个 token，其余约 4 个字符 1 个 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+class HistoryEntry:
+    __slots__ = ("seq", "message", "param", "tokens")
+    def __init__(self, seq: int, message: dict[str, str], param: Any, tokens: int):
+        self.seq = seq
+        self.message = message
+        self.param = param
+        self.tokens = tokens
+
+Summarizer = Callable[[str, list[dict[str, str]]], Awaitable[str]]
+
+class HistoryManager:
+    def __init__(self, max_tokens: int, convert: Callable[[dict[str, str]], Any],
+                 count_tokens: Callable[[str], int] | None = None,
+                 summarize: Summarizer | None = None,
+                 spawn: Callable[[Coroutine[Any, Any, None]], asyncio.Task[None]] | None = None,
+                 compact_ratio: float = 0.75, keep_ratio: float = 0.4):
+        """
+        max_tokens: 对话（不含系统提示词）的 token 预算
+        convert: 把 {"role", "content"} 转换为发送给模型的消息参数
+        count_tokens: 计算文本的 token 数，不提供则使用 estimate_tokens
+        summarize: 总结函数，参数为旧摘要和要压缩的对话，返回新摘要；不提供则超出预算时直接丢弃最早的对话
+        spawn: 创建后台任务的函数（如 ModuleBase.create_task），默认 asyncio.create_task
+        compact_ratio: 对话超过预算的这一比例时开始总结
+        keep_ratio: 总结后保留的最近对话占预算的比例
+        """
+        self.max_tokens = max_tokens
+        self.convert = convert
+        self.count_tokens = count_tokens or estimate_tokens
+        self.summarize = summarize
+        self.spawn = spawn or asyncio.create_task
+        self.compact_ratio = compact_ratio
+        self.keep_ratio = keep_ratio
+        self.pinned: HistoryEntry | None = None # 系统提示词
+        self.summary: HistoryEntry | None = None # 较早对话的摘要
+        self.summary_text: str = ""
+        self.entries: list[HistoryEntry] = []
+        self.params: list[Any] = [] # 与 entries 一一对应的消息参数
+        self.tokens: int = 0 # entries 和 summary 的 token 总数
+        self.last_seq: int = 0
+        self.summarizing: asyncio.Task[None] | None = None
+        self.summaries: int = 0 # 已完成的总结次数
+        self.dropped: int = 0 # 被直接丢弃的对话条数
+        self.retry_seq: int = 0 # 总结失败后，再追加若干条对话才重试
+
+    def make_entry(self, role: str, content: str) -> HistoryEntry:
+        self.last_seq += 1
+        message = {'role': role, 'content': content}
+        return HistoryEntry(self.last_seq, message, self.convert(message), self.count_tokens(content) + MESSAGE_OVERHEAD)
+
+    def set_pinned(self, content: str):
+        """设置固定在最前面的系统提示词"""
+        self.pinned = self.make_entry('system', content) if content else None
+
+    def append(self, role: str, content: str):
+        entry = self.make_entry(role, content)
+        self.entries.append(entry)
+        self.params.append(entry.param)
+        self.tokens += entry.tokens
+        if self.tokens > self.max_tokens:
+            self.drop_oldest()
+        if (
+            self.summarize is not None and self.summarizing is None and self.last_seq >= self.retry_seq
+            and self.tokens > self.max_tokens * self.compact_ratio
+        ):
+            self.start_summary()
+
+    def messages(self) -> list[Any]:
+        """发送给模型的消息参数列表（新列表，调用方可以追加）"""
+        head = [entry.param for entry in (self.pinned, self.summary) if entry is not None]
+        return head + self.params
+
+    def __iter__(self):
+        for entry in (self.pinned, self.summary, *self.entries):
+            if entry is not None:
+                yield entry.message
+
+    def __len__(self) -> int:
+        return len(self.entries) + (self.pinned is not None) + (self.summary is not None)
+
+    def remove_head(self, count: int):
+        for entry in self.entries[:count]:
+            self.tokens -= entry.tokens
+        del self.entries[:count]
+        del self.params[:count]
+
+    def drop_oldest(self):
+        """丢弃最早的对话直到不超过预算（至少保留最新的一条）"""
+        count = 0
+        tokens = self.tokens
+        while tokens > self.max_tokens and count < len(self.entries) - 1:
+            tokens -= self.entries[count].tokens
+            count += 1
+        if count:
+            self.remove_head(count)
+            self.dropped += count
+            logger.debug("对话历史超出预算，丢弃最早的 {} 条", count)
+
+    def start_summary(self):
+        """选出最早的若干条对话，在后台总结"""
+        assert self.summarize is not None
+        keep_tokens = self.max_tokens * self.keep_ratio
+        count = 0
+        tokens = self.tokens
+        while tokens > keep_tokens and count < len(self.entries) - 1:
+            tokens -= self.entries[count].tokens
+            count += 1
+        if count == 0:
+            return
+        turns = self.entries[:count]
+        self.summarizing = self.spawn(self.run_summary(turns))
+
+    async def run_summary(self, turns: list[HistoryEntry]):
+        assert self.summarize is not None
+        try:
+            content = await self.summarize(self.summary_text, [entry.message for entry in turns])
+        except Exception as e:
+            logger.warning("总结对话历史失败：{}，将直接丢弃超出预算的对话", e)
+            self.retry_seq = self.last_seq + 10
+            return
+        finally:
+            self.summarizing = None
+        # 总结期间被丢弃的对话已经不在 entries 中，只移除仍在的部分
+        last = turns[-1].seq
+        count = 0
+        while count < len(self.entries) and self.entries[count].seq <= last:
+            count += 1
+        self.remove_head(count)
+        if self.summary is not None:
+            self.tokens -= self.summary.tokens
+        self.summary_text = content
+        self.summary = self.make_entry('system', f"以下是之前对话的摘要：\n{content}")
+        self.tokens += self.summary.tokens
+        self.summaries += 1
+        logger.debug("已将 {} 条对话总结为摘要，当前约 {} tokens", len(turns), self.tokens)
@@ -0,0 +1,192 @@
+"""
+Live2D 前端使用的 Qt 窗口和控件
+导入本文件会加载 PySide6、live2d-py 和 OpenGL，只应在 FrontendLive2D 初始化时导入
+"""
+import asyncio
+import live2d.v2 as live2d_v2
+import live2d.v3 as live2d_v3
+from live2d.utils.lipsync import WavHandler
+from PySide6.QtWidgets import *
+from PySide6.QtOpenGLWidgets import QOpenGLWidget
+from PySide6.QtGui import *
+from PySide6.QtCore import QPoint, QTimerEvent, Qt
+from OpenGL.GL import *
+from markdown import markdown
+from .log import logger
+
+async def qt_poller(app: QApplication):
+    while not app.closingDown():
+        app.processEvents()
+        await asyncio.sleep(1 / 120)
+
+class ModelLabel(QLabel):
+    def __init__(self, text: str = ""):
+        super().__init__(text)
+        self.setStyleSheet("background: transparent; color: white; font: 20px; padding: 20px;")
+        self.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.setTextFormat(Qt.TextFormat.RichText)
+        self.setWordWrap(True)
+        self.setFixedHeight(100)
+    
+    def paintEvent(self, event: QPaintEvent, /) -> None:
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        brush = QBrush(QColor(0, 0, 0, 200))
+        painter.setBrush(brush)
+        painter.setPen(QPen(Qt.PenStyle.NoPen))
+        painter.drawRoundedRect(self.rect(), 12, 12)
+        
+        # Custom text painting with bottom-up overflow
+        text_rect = self.rect().adjusted(20, 20, -20, -20)  # Account for padding
+        
+        # Use QTextDocument for proper word wrapping with rich text support
+        doc = QTextDocument()
+        doc.setHtml(self.text())  # Support rich text
+        doc.setDefaultFont(self.font())
+        doc.setTextWidth(text_rect.width())
+        doc.setDefaultTextOption(QTextOption(Qt.AlignmentFlag.AlignHCenter))
+        doc.setDocumentMargin(0)  # Remove internal margins
+        
+        # Calculate total height
+        total_height = doc.size().height()
+        
+        # Calculate starting Y position to align from bottom
+        if total_height > text_rect.height():
+            # Overflow case: show bottom portion (upward overflow)
+            start_y = text_rect.bottom() - total_height
+        else:
+            # Normal case: center vertically
+            start_y = text_rect.top() + (text_rect.height() - total_height) / 2
+        
+        # Draw the document
+        painter.save()
+        painter.setClipRect(text_rect)  # Clip to visible area
+        painter.translate(text_rect.left(), start_y)
+        doc.drawContents(painter)
+        painter.restore()
+
+class ChatRecordWidget(QTextEdit):
+    def __init__(self):
+        super().__init__()
+        self.setStyleSheet("background: transparent; color: white; font: 20px; padding: 20px;")
+        self.setAcceptRichText(True)
+        self.setReadOnly(True)
+        self.appendRecord("系统", "开始")
+
+    def paintEvent(self, event): # By: Kimi-K2
+        # 1. 在 viewport 上绘制背景
+        painter = QPainter(self.viewport())
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        brush = QBrush(QColor(0, 0, 0, 200))
+        painter.setBrush(brush)
+        painter.setPen(QPen(Qt.PenStyle.NoPen))
+
+        # 2. 用 viewport 的 rect（可减去滚动条的 margin）
+        rect = self.viewport().rect()
+        painter.drawRoundedRect(rect, 12, 12)
+
+        # 3. 继续让父类完成文本本身的绘制
+        super().paintEvent(event)
+    
+    def appendRecord(self, name: str, content: str):
+        processed_content = markdown(content).strip()
+        # Remove <p> tags that markdown might add, as they cause line breaks
+        if processed_content.startswith('<p>') and processed_content.endswith('</p>'):
+            processed_content = processed_content[3:-4]
+        self.append(f"<b>{name}</b>: {processed_content}")
+        cursor = self.textCursor()
+        cursor.movePosition(cursor.MoveOperation.End)
+        self.setTextCursor(cursor)
+        self.ensureCursorVisible()
+
+class Live2DWidget(QOpenGLWidget):
+    def __init__(self, model_path: str):
+        super().__init__()
+        self.model: live2d_v2.LAppModel | live2d_v3.LAppModel
+        self.model_path = model_path
+        # 根据模型文件后缀推断版本
+        if model_path.endswith(".model.json"): # v2
+            self.live2d = live2d_v2
+        elif model_path.endswith(".model3.json"): # v3
+            self.live2d = live2d_v3
+        else:
+            raise ValueError(f"模型文件后缀名错误，必须为 .model.json 或 .model3.json")
+        self.live2d.init()
+        self.wav_hander = WavHandler()
+        self.lip_sync_n = 3
+    
+    def initializeGL(self, /) -> None:
+        if self.live2d.LIVE2D_VERSION == 2:
+            self.live2d.glewInit()
+        else:
+            self.live2d.glInit()
+        logger.info("加载模型：{}", self.model_path)
+        self.model = self.live2d.LAppModel()
+        self.model.LoadModelJson(self.model_path)
+        self.startTimer(1000 // 120)
+    
+    def resizeGL(self, w: int, h: int, /) -> None:
+        glViewport(0, 0, w, h)
+        self.model.Resize(w, h)
+    
+    def paintGL(self, /) -> None:
+        self.live2d.clearBuffer()
+        self.model.Update()
+        if self.wav_hander.Update():
+            self.model.SetParameterValue("ParamMouthOpenY", self.wav_hander.currentRms * self.lip_sync_n)
+        self.model.Draw()
+    
+    def timerEvent(self, event: QTimerEvent, /) -> None:
+        self.update()
+    
+    def speak(self, fname: str):
+        self.wav_hander.Start(fname)
+
+    def stop_speaking(self):
+        self.wav_hander = WavHandler()
+        self.model.SetParameterValue("ParamMouthOpenY", 0)
+
+class FrontendWindow(QMainWindow):
+    def __init__(self, model_path: str):
+        super().__init__()
+        self.setWindowTitle("Live2D")
+        self.resize(800, 900)
+        # 【Live2D形象】(400, 800) | 此处是
+        # -----------------------+ 聊天 (400, 900)
+        # 【此处字幕】(400, 100)   | 记录
+        widget = QWidget()
+        self.setCentralWidget(widget)
+        layout = QHBoxLayout(widget)
+
+        # 左侧：Live2D 与字幕
+        left = QWidget()
+        left.setFixedWidth(400)
+        layout.addWidget(left)
+        layout_left = QVBoxLayout(left)
+        # 左上：Live2D
+        self.live2d_widget = Live2DWidget(model_path)
+        layout_left.addWidget(self.live2d_widget)
+        # 左下：字幕
+        self.label = ModelLabel("")
+        layout_left.addWidget(self.label)
+
+        # 右侧：聊天记录
+        self.chat_record_widget = ChatRecordWidget()
+        layout.addWidget(self.chat_record_widget)
+
+        self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
+        self.setWindowFlag(Qt.WindowType.FramelessWindowHint)
+        self.setStyleSheet("background: transparent;")
+
+        self._drag_pos: QPoint | None = None
+    
+    def mousePressEvent(self, e: QMouseEvent):
+        if e.button() == Qt.MouseButton.LeftButton:
+            self._drag_pos = e.globalPosition().toPoint()
+
+    def mouseMoveEvent(self, e: QMouseEvent):
+        if e.buttons() & Qt.MouseButton.LeftButton and self._drag_pos is not None:
+            delta = e.globalPosition().toPoint() - self._drag_pos
+            self.move(self.pos() + delta)
+            self._drag_pos = e.globalPosition().toPoint()
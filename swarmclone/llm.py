@@ -1,23 +1,39 @@
+from __future__ import annotations
+
 import asyncio
 import os
-import torch
-import openai
 from dataclasses import dataclass, field
-from transformers import (
-    AutoModelForSequenceClassification,
-    AutoTokenizer
-)
 from uuid import uuid4
-from contextlib import AsyncExitStack
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from mcp.types import Tool
 import time
 import random
-from typing import Any
+from typing import Any, Callable
 from .modules import *
 from .messages import *
 from .utils import *
+from .tracing import new_trace_id, tracer
+from .metrics import Counter, Gauge, Histogram
+from .model_pool import model_pool
+from .history import HistoryManager
+from .response_cache import Reply, ResponseCache
+from .llm_pool import Backend, BackendPool, parse_backends
+from .mcp_tools import MCPServer, ToolRegistry, parse_servers
+from .emotion import EmotionClassifier, NEUTRAL, export_int8, load_int8
+from . import log
+
+chat_queue_size = Gauge("swarmclone_llm_chat_queue_size", "Chats waiting to be answered by the LLM")
+chats_discarded_total = Counter("swarmclone_llm_chats_discarded_total", "Chats discarded by the LLM because the chat queue was too long")
+history_tokens = Gauge("swarmclone_llm_history_tokens", "Estimated tokens in the LLM conversation history (excluding the system prompt)")
+history_summaries_total = Counter("swarmclone_llm_history_summaries_total", "Times older conversation turns were summarised")
+prompt_tokens_total = Counter("swarmclone_llm_prompt_tokens_total", "Prompt tokens reported by the LLM backend")
+cached_prompt_tokens_total = Counter("swarmclone_llm_cached_prompt_tokens_total", "Prompt tokens served from the backend's prefix cache")
+chats_per_reply = Histogram(
+    "swarmclone_llm_chat_batch_size", "Chats answered by a single LLM generation", buckets=(1, 2, 3, 5, 8, 13, 20, 50)
+)
+
+SUMMARY_PROMPT = (
+    "你是直播对话的记录员。请把下面的直播对话压缩为一段简洁的中文摘要，"
+    "保留观众的名字、他们提到的重要信息、主播做出的承诺和正在进行的话题，不超过 200 字，只输出摘要本身。"
+)
 
 @dataclass
 class LLMConfig(ModuleConfig):
@@ -33,6 +49,37 @@ class LLMConfig(ModuleConfig):
         "min": 1,  # 最少逐条回复 1 条
         "max": 100
     })
+    chat_batch_size: int = field(default=1, metadata={
+        "required": False,
+        "desc": "一次回复的弹幕数量上限（1 为逐条回复），排队的弹幕越多一次回复的越多",
+        "min": 1,
+        "max": 50
+    })
+    chat_batch_window: float = field(default=0.0, metadata={
+        "required": False,
+        "desc": "一次回复多条弹幕时，收到第一条弹幕后最多再等待多久（秒）以凑齐更多弹幕",
+        "min": 0.0,
+        "max": 10.0,
+        "step": 0.1
+    })
+    response_cache: bool = field(default=False, metadata={
+        "required": False,
+        "desc": "是否缓存弹幕回复：内容相同（忽略标点、大小写和重复字符）的单条弹幕在有效期内直接复用上次的回复"
+    })
+    response_cache_ttl: float = field(default=300.0, metadata={
+        "required": False,
+        "desc": "弹幕回复缓存的有效期（秒）",
+        "min": 10.0,
+        "max": 3600.0,
+        "step": 10.0
+    })
+    response_cache_size: int = field(default=256, metadata={
+        "required": False,
+        "desc": "弹幕回复缓存最多保存的回复数",
+        "min": 16,
+        "max": 4096,
+        "step": 16
+    })
     do_start_topic: bool = field(default=False, metadata={
         "required": False,
         "desc": "是否自动发起对话"
@@ -72,7 +119,7 @@ class LLMConfig(ModuleConfig):
         "required": False,
         "desc": "语音输入提示词模板"
     })
-    system_prompt: str = field(default=f"""# 提示词开始
+    system_prompt: str = field(default="""# 提示词开始
 ## 人物设定
 你是一只十六岁的人工智能少女猫娘主播，名叫【xxxxx】，你的外观是【xxxx】。
 你现在的主人名叫【xxxx】，是【xxxxx】。
@@ -87,22 +134,45 @@ class LLMConfig(ModuleConfig):
 ## 语言
 你使用中文进行交流，除非你的主人要求你使用别的语言。
 ## 额外信息
-当前时间：{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}
+当前时间等实时信息会在对话末尾的【实时信息】中给出。
 你的记忆：【xxxx】
 # 提示词结束
 
 以上为提示词模板，使用前请将【】内容替换为你希望的实际内容，也可自行撰写。启动前请删除这一行。""", metadata={
         "required": False,
-        "desc": "系统提示词",
+        "desc": "系统提示词（请不要在其中写入时间等经常变化的内容，以便后端复用前缀缓存）",
         "multiline": True
     })  # TODO：更好的系统提示、MCP支持
+    history_max_tokens: int = field(default=6000, metadata={
+        "required": False,
+        "desc": "对话历史的 token 上限（不含系统提示词），超出后较早的对话会被总结或丢弃",
+        "min": 500,
+        "max": 200000
+    })
+    history_summary: bool = field(default=True, metadata={
+        "required": False,
+        "desc": "是否由模型在后台总结较早的对话（否则直接丢弃）"
+    })
+    tokenizer_path: str = field(default="", metadata={
+        "required": False,
+        "desc": "计算 token 数使用的分词器（Huggingface 模型名或本地路径），留空则按字数估算"
+    })
+    report_usage: bool = field(default=True, metadata={
+        "required": False,
+        "desc": "请求 token 用量统计（含前缀缓存命中数），后端不支持 stream_options 时请关闭"
+    })
     mcp_support: bool = field(default=False, metadata={
         "required": False,
         "desc": "是否支持 MCP"
     })
+    mcp_servers: str = field(default="", metadata={
+        "required": False,
+        "desc": "MCP 服务器列表，每行一个：以 .py 或 .js 结尾的脚本、stdio 服务器的启动命令，或 streamable HTTP 地址（http(s):// 开头）",
+        "multiline": True
+    })
     mcp_path1: str = field(default="", metadata={
         "required": False,
-        "desc": "MCP 路径 1 (请指向 MCP 脚本，以 .py 或 .js 结尾，仅支持 stdio 交互方式)"
+        "desc": "MCP 路径 1 (请指向 MCP 脚本，以 .py 或 .js 结尾，仅支持 stdio 交互方式；更多服务器请填写在 MCP 服务器列表中)"
     })
     mcp_path2: str = field(default="", metadata={
         "required": False,
@@ -112,6 +182,20 @@ class LLMConfig(ModuleConfig):
         "required": False,
         "desc": "MCP 路径 3"
     })
+    mcp_tool_timeout: float = field(default=10.0, metadata={
+        "required": False,
+        "desc": "单个 MCP 工具调用的超时时间（秒），0 为不限制",
+        "min": 0.0,
+        "max": 120.0,
+        "step": 1.0
+    })
+    mcp_cache_ttl: float = field(default=60.0, metadata={
+        "required": False,
+        "desc": "声明为幂等的 MCP 工具，相同参数的结果在这段时间（秒）内直接复用，0 为不缓存",
+        "min": 0.0,
+        "max": 3600.0,
+        "step": 10.0
+    })
     classifier_model_path: str = field(default="~/.swarmclone/llm/EmotionClassification/SWCBiLSTM", metadata={
         "required": False,
         "desc": "情感分类模型路径"
@@ -129,6 +213,36 @@ class LLMConfig(ModuleConfig):
             {"key": "ModelScope", "value": "modelscope"}
         ]
     })
+    classifier_runtime: str = field(default="transformers", metadata={
+        "required": False,
+        "desc": "情感分类模型的运行方式，int8 为动态量化后的 TorchScript 模型（首次使用时导出并缓存，启动更快、内存更少）",
+        "selection": True,
+        "options": [
+            {"key": "transformers", "value": "transformers"},
+            {"key": "TorchScript int8", "value": "int8"}
+        ]
+    })
+    emotion_deadline: float = field(default=0.05, metadata={
+        "required": False,
+        "desc": "句子发送前等待情感分类的最长时间（秒），超时沿用上一句的情感",
+        "min": 0.0,
+        "max": 1.0,
+        "step": 0.01
+    })
+    first_clause_length: int = field(default=8, metadata={
+        "required": False,
+        "desc": "回复的第一句达到这一字数时在逗号处提前发送给 TTS，以缩短首个音频的等待时间，0 为不提前",
+        "min": 0,
+        "max": 50,
+        "step": 1
+    })
+    max_sentence_length: int = field(default=80, metadata={
+        "required": False,
+        "desc": "发送给 TTS 的单句最大字数，超过时在逗号处截断，0 为不限制",
+        "min": 0,
+        "max": 500,
+        "step": 10
+    })
     model_id: str = field(default="", metadata={
         "required": True,
         "desc": "模型id"
@@ -142,6 +256,39 @@ class LLMConfig(ModuleConfig):
         "desc": "api key",
         "password": True
     })
+    backup_models: str = field(default="", metadata={
+        "required": False,
+        "desc": "备用模型，每行一个：“api网址 模型id [api key]”（省略 api key 时使用上面的），主模型出错、熔断或首个 token 过慢时按顺序使用",
+        "multiline": True
+    })
+    ttft_deadline: float = field(default=5.0, metadata={
+        "required": False,
+        "desc": "超过这一时间（秒）仍未收到首个 token 时，同时请求下一个备用模型，先输出的胜出，0 为不对冲",
+        "min": 0.0,
+        "max": 30.0,
+        "step": 0.5
+    })
+    chunk_timeout: float = field(default=30.0, metadata={
+        "required": False,
+        "desc": "开始输出后超过这一时间（秒）没有新内容即视为出错，0 为不限制",
+        "min": 0.0,
+        "max": 120.0,
+        "step": 5.0
+    })
+    circuit_failures: int = field(default=3, metadata={
+        "required": False,
+        "desc": "模型连续失败这么多次后暂停使用（熔断）",
+        "min": 1,
+        "max": 20,
+        "step": 1
+    })
+    circuit_cooldown: float = field(default=30.0, metadata={
+        "required": False,
+        "desc": "熔断后暂停使用的时间（秒），之后再试一次",
+        "min": 1.0,
+        "max": 600.0,
+        "step": 1.0
+    })
     temperature: float = field(default=0.7, metadata={
         "required": False,
         "desc": "模型温度",
@@ -156,18 +303,68 @@ class LLMConfig(ModuleConfig):
         "step": 0.1  # 步长为 0.1
     })
 
+def load_classifier(path: str, model_id: str, model_source: str, runtime: str = "transformers") -> tuple[Any, Any]:
+    """加载情感分类模型，本地不存在时先下载；runtime 为 int8 时优先使用缓存的量化模型，没有则导出"""
+    if runtime == "int8" and os.path.isdir(path) and (cached := load_int8(path)) is not None:
+        log.logger.info("已从{}加载情感分类量化模型", path)
+        return cached
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    while True:
+        try:
+            log.logger.info("正在从{}加载情感分类模型……", path)
+            classifier_model = AutoModelForSequenceClassification.from_pretrained(
+                path,
+                torch_dtype="auto",
+                trust_remote_code=True
+            ).to("cpu")
+            classifier_tokenizer = AutoTokenizer.from_pretrained(
+                path,
+                padding_side="left",
+                trust_remote_code=True
+            )
+            break
+        except Exception:
+            download_model(model_id, model_source, path)
+    if runtime == "int8":
+        try:
+            if (exported := export_int8(path, classifier_model, classifier_tokenizer)) is not None:
+                return exported
+        except Exception as e:
+            log.logger.opt(exception=e).warning("导出情感分类量化模型失败，继续使用 transformers 模型：{!r}", e)
+    return classifier_model, classifier_tokenizer
+
 class LLM(ModuleBase):
     role: ModuleRoles = ModuleRoles.LLM
     config_class = LLMConfig
+    subscriptions = (ChatMessage, ASRMessage, ASRActivated, AudioFinished, SongInfo, FinishedSinging)
+    queue_policies = {ChatMessage: OverflowPolicy.DROP_OLDEST} # 弹幕过多时丢弃旧弹幕，不阻塞其他消息
     config: config_class
     def __init__(self, config: config_class | None = None, **kwargs):
         super().__init__(config, **kwargs)
         self.state: LLMState = LLMState.IDLE
-        self.history: list[dict[str, str]] = []
+        self.history = HistoryManager(
+            self.config.history_max_tokens,
+            self.dict2message,
+            count_tokens=self.load_token_counter(),
+            summarize=self.summarize_history if self.config.history_summary else None,
+            spawn=self.create_task
+        )
         self.generated_text: str = ""
+        self.response_cache = (
+            ResponseCache(self.config.response_cache_ttl, self.config.response_cache_size)
+            if self.config.response_cache else None
+        )
+        self.cache_key: tuple[Any, ...] | None = None # 当前回复可以写入缓存时的键
+        self.cache_user: str = "" # 当前回复的弹幕发送者，回复中提到其名字时不写入缓存
+        self.cached_reply: Reply | None = None # 命中缓存时要直接输出的回复
+        self.reply_incomplete: bool = False # 生成出错或被打断，不写入缓存
         self.generate_task: asyncio.Task[Any] | None = None
+        self.trace_id: str | None = None # 当前回复所属的轮次
         self.chat_maxsize: int = self.config.chat_maxsize
         self.chat_size_threshold: int = self.config.chat_size_threshold
+        self.chat_batch_size: int = max(1, self.config.chat_batch_size)
+        self.chat_batch_window: float = self.config.chat_batch_window
+        self.chat_window_start: float | None = None # 当前待回复的第一条弹幕进入 chat_queue 的时间
         self.chat_queue: asyncio.Queue[ChatMessage] = asyncio.Queue(maxsize=self.chat_maxsize)
         self.do_start_topic: bool = self.config.do_start_topic
         self.idle_timeout: int | float = self.config.idle_timeout
@@ -183,66 +380,88 @@ class LLM(ModuleBase):
         self.asr_role = self.config.asr_role
         self.chat_template = self.config.chat_template
         self.asr_template = self.config.asr_template
-        if self.config.system_prompt:
-            self._add_system_history(self.config.system_prompt)
-        self.mcp_sessions: list[ClientSession] = []
-        self.tools: list[list[Tool]] = []
-        self.exit_stack = AsyncExitStack()
+        self.history.set_pinned(self.config.system_prompt)
+        self.notices: list[str] = [] # 下一次生成时放在【实时信息】中的一次性提示
+        self.last_usage: dict[str, Any] = {} # 最近一次请求的 token 用量
+        self.tool_registry = ToolRegistry(self.config.mcp_tool_timeout, self.config.mcp_cache_ttl)
+        self.mcp_servers: list[MCPServer] = []
         abs_classifier_path = os.path.expanduser(self.config.classifier_model_path)
-        successful = False
-        while not successful: # 加载情感分类模型
-            try:
-                print(f"正在从{abs_classifier_path}加载情感分类模型……")
-                classifier_model = AutoModelForSequenceClassification.from_pretrained(
-                    abs_classifier_path,
-                    torch_dtype="auto",
-                    trust_remote_code=True
-                ).to("cpu")
-                classifier_tokenizer = AutoTokenizer.from_pretrained(
-                    abs_classifier_path,
-                    padding_side="left",
-                    trust_remote_code=True
-                )
-                successful = True
-                self.classifier_model = classifier_model
-                self.classifier_tokenizer = classifier_tokenizer
-            except Exception:
-                download_model(
-                    self.config.classifier_model_id,
-                    self.config.classifier_model_source,
-                    abs_classifier_path
-                )
+        self.classifier_model, self.classifier_tokenizer = model_pool.get(
+            ("classifier", abs_classifier_path, self.config.classifier_runtime),
+            lambda: load_classifier(
+                abs_classifier_path, self.config.classifier_model_id, self.config.classifier_model_source,
+                self.config.classifier_runtime
+            )
+        ) # 修改其他配置后重启时直接复用已加载的模型
+        self.emotion_classifier = EmotionClassifier(self.classifier_model, self.classifier_tokenizer, spawn=self.create_task)
         
         self.model_id = self.config.model_id
-        self.client = openai.AsyncOpenAI(
-            api_key=self.config.api_key,
-            base_url=self.config.model_url
+        endpoints = [
+            (self.config.model_url, self.model_id, self.config.api_key),
+            *parse_backends(self.config.backup_models, self.config.api_key)
+        ]
+        self.backends = BackendPool(
+            [ # 有备用模型时出错直接换用下一个，不在同一个后端上重试
+                Backend(url, model_id, api_key, max_retries=0 if len(endpoints) > 1 else 2)
+                for url, model_id, api_key in endpoints
+            ],
+            ttft_deadline=self.config.ttft_deadline,
+            chunk_timeout=self.config.chunk_timeout,
+            failure_threshold=self.config.circuit_failures,
+            cooldown=self.config.circuit_cooldown
         )
         self.temperature = self.config.temperature
 
-    async def init_mcp(self):
-        available_servers = filter(lambda x: bool(x), [self.config.mcp_path1, self.config.mcp_path2, self.config.mcp_path3])
-        for server in available_servers:
-            is_python = server.endswith('.py')
-            is_js = server.endswith('.js')
-            if not (is_python or is_js):
-                continue
-            command = 'python' if is_python else 'node'
-            server_params = StdioServerParameters(
-                command=command,
-                args=[server],
-            )
-            stdio, write = await self.exit_stack.enter_async_context(stdio_client(server_params))
-            session = await self.exit_stack.enter_async_context(ClientSession(stdio, write))
-            await session.initialize()
-            tools: list[Tool] = (await session.list_tools()).tools
-            self.tools.append(tools)
-            self.mcp_sessions.append(session)
+    def start_mcp(self):
+        """在后台并行启动所有 MCP 服务器，各服务器启动完成后其工具即可使用"""
+        specs = parse_servers(self.config.mcp_servers)
+        for path in (self.config.mcp_path1, self.config.mcp_path2, self.config.mcp_path3):
+            if path.endswith(('.py', '.js')) and path not in specs:
+                specs.append(path)
+        for spec in specs:
+            server = MCPServer(spec, self.tool_registry)
+            self.mcp_servers.append(server)
+            self.create_task(server.run(), name=f"MCP {spec}")
     
+    def collect_metrics(self):
+        chat_queue_size.set(self.chat_queue.qsize())
+        history_tokens.set(self.history.tokens)
+        history_summaries_total.set_total(self.history.summaries)
+
+    def load_token_counter(self) -> Callable[[str], int] | None:
+        """加载用于计算 token 数的分词器，未配置或加载失败时返回 None（按字数估算）"""
+        if not (path := self.config.tokenizer_path):
+            return None
+        def load():
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(os.path.expanduser(path), trust_remote_code=True)
+        try:
+            tokenizer = model_pool.get(("tokenizer", path), load)
+        except Exception as e:
+            self.logger.warning("加载分词器 {} 失败：{}，将按字数估算 token 数", path, e)
+            return None
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+    async def summarize_history(self, summary: str, turns: list[dict[str, str]]) -> str:
+        """把较早的对话（连同之前的摘要）总结为一段新摘要"""
+        text = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        if summary:
+            text = f"之前的摘要：\n{summary}\n\n之后的对话：\n{text}"
+        response = await self.backends.create(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": text}
+            ],
+            temperature=0.3
+        )
+        if not (content := (response.choices[0].message.content or "").strip()):
+            raise ValueError("模型返回了空的摘要")
+        return content
+
     def _switch_to_generating(self):
         self.state = LLMState.GENERATING
         self.generated_text = ""
-        self.generate_task = asyncio.create_task(self.start_generating())
+        self.generate_task = self.create_task(self.start_generating())
     
     def _switch_to_waiting4asr(self):
         if self.generate_task is not None and not self.generate_task.done():
@@ -269,7 +488,7 @@ class LLM(ModuleBase):
     def _switch_to_singing(self):
         self.state = LLMState.SINGING
         self.about_to_sing = False
-        self._add_system_history(f'你唱了一首名为{self.song_id}的歌。')
+        self.notices.append(f'你刚刚唱了一首名为{self.song_id}的歌。')
 
     def _add_history(self, role: str, content: str, template: str | None = None, user: str | None = None):
         """统一的历史添加方法"""
@@ -277,129 +496,240 @@ class LLM(ModuleBase):
             formatted_content = template.format(user=user, content=content)
         else:
             formatted_content = content
-        self.history.append({'role': role, 'content': formatted_content})
+        self.history.append(role, formatted_content)
 
     def _add_chat_history(self, user: str, content: str):
         self._add_history(self.chat_role, content, self.chat_template, user)
+
+    def _add_chats_history(self, chats: list[dict[str, Any]]):
+        """多条弹幕合并为一条聊天记录，每条弹幕一行"""
+        if len(chats) == 1:
+            self._add_chat_history(chats[0]['user'], chats[0]['content'])
+            return
+        self._add_history(self.chat_role, "\n".join(
+            self.chat_template.format(user=chat['user'], content=chat['content']) for chat in chats
+        ))
     
     def _add_asr_history(self, user: str, content: str):
         self._add_history(self.asr_role, content, self.asr_template, user)
     
     def _add_llm_history(self, content: str):
         self._add_history('assistant', content)
-    
-    def _add_system_history(self, content: str):
-        self._add_history('system', content)
+
+    def build_messages(self) -> list[Any]:
+        """
+        组装发送给模型的消息
+        系统提示词、摘要和对话历史只会在末尾增长，每轮请求的前缀保持不变，后端可以复用前缀缓存；
+        当前时间和一次性的提示（如自动发起话题、刚唱完歌）放在末尾的【实时信息】中，不写入对话历史
+        """
+        messages = self.history.messages()
+        lines = [f"当前时间：{time.strftime('%Y-%m-%d %H:%M')}", *self.notices]
+        self.notices.clear()
+        messages.append(self.dict2message({'role': 'system', 'content': "【实时信息】\n" + "\n".join(lines)}))
+        return messages
+
+    def record_usage(self, usage: Any):
+        """记录一次请求的 token 用量和前缀缓存命中数"""
+        prompt_tokens = usage.prompt_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        prompt_tokens_total.inc(prompt_tokens)
+        cached_prompt_tokens_total.inc(cached_tokens)
+        self.last_usage = {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": usage.completion_tokens or 0,
+            "cached_ratio": cached_tokens / prompt_tokens if prompt_tokens else 0.0
+        }
+        if log.debug_enabled:
+            self.logger.debug("提示词 {} tokens，其中 {} 命中前缀缓存（{:.0%}）", prompt_tokens, cached_tokens, self.last_usage["cached_ratio"])
    
     async def run(self):
         if self.config.mcp_support:
-            await self.init_mcp()
-        while True:
-            try:
-                task = self.task_queue.get_nowait()
-                print(self.state, task)
-            except asyncio.QueueEmpty:
-                task = None
-            
-            if isinstance(task, ChatMessage):
-                # 若小于一定阈值则回复每一条信息，若超过则逐渐降低回复概率
-                if (qsize := self.chat_queue.qsize()) < self.chat_size_threshold:
-                    prob = 1
-                else:
-                    prob = 1 - (qsize - self.chat_size_threshold) / (self.chat_maxsize - self.chat_size_threshold)
-                if random.random() < prob:
-                    try:
-                        self.chat_queue.put_nowait(task)
-                    except asyncio.QueueFull:
-                        pass
-            if isinstance(task, SongInfo):
-                self.about_to_sing = True
-                self.song_id = task.get_value(self)["song_id"]
+            self.start_mcp()
+        self.idle_start_time = time.time() # 从开始运行时计时，而不是从（可能很慢的）加载开始时
+        getter: asyncio.Future[Message] = asyncio.ensure_future(self.task_queue.get())
+        try:
+            while True:
+                # 等待新消息、生成结束或当前状态的超时，三者之一发生即被唤醒
+                waiters: list[asyncio.Future[Any]] = [getter]
+                if self.state == LLMState.GENERATING and self.generate_task is not None:
+                    waiters.append(self.generate_task)
+                timeout = None if (deadline := self.next_deadline()) is None else max(0, deadline - time.time() + 0.001)
+                await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    tasks = [getter.result()]
+                    while not self.task_queue.empty(): # 一次唤醒处理所有已到达的消息
+                        tasks.append(self.task_queue.get_nowait())
+                    getter = asyncio.ensure_future(self.task_queue.get())
+                    for task in tasks:
+                        await self.step(task)
+                state = None
+                while state != self.state: # 状态改变后立即检查新状态下是否有事可做（如回到待机时已有弹幕在排队）
+                    state = self.state
+                    await self.step(None)
+        finally:
+            getter.cancel()
 
-            match self.state:
-                case LLMState.IDLE:
-                    if isinstance(task, ASRActivated):
-                        self._switch_to_waiting4asr()
-                    elif self.about_to_sing:
-                        await self.results_queue.put(
-                            ReadyToSing(self, self.song_id)
-                        )
-                        self._switch_to_singing()
-                    elif not self.chat_queue.empty():
-                        try:
-                            chat = self.chat_queue.get_nowait().get_value(self) # 逐条回复弹幕
-                            self._add_chat_history(chat['user'], chat['content']) ## TODO：可能需要一次回复多条弹幕
-                            self._switch_to_generating()
-                        except asyncio.QueueEmpty:
-                            pass
-                    elif self.do_start_topic and time.time() - self.idle_start_time > self.idle_timeout:
-                        self._add_system_history("请随便说点什么吧！")
-                        self._switch_to_generating()
+    def next_deadline(self) -> float | None:
+        """当前状态的超时时刻（time.time()），没有超时则为 None"""
+        match self.state:
+            case LLMState.IDLE if not self.chat_queue.empty(): # 等待凑齐弹幕
+                return None if self.chat_window_start is None else self.chat_window_start + self.chat_batch_window
+            case LLMState.IDLE if self.do_start_topic:
+                return self.idle_start_time + self.idle_timeout
+            case LLMState.WAITING4ASR:
+                return self.waiting4asr_start_time + self.asr_timeout
+            case LLMState.WAITING4TTS:
+                return self.waiting4tts_start_time + self.tts_timeout
+        return None
+
+    def chat_batch_ready(self) -> bool:
+        """弹幕已凑齐一批或等待时间已到"""
+        return (
+            self.chat_batch_size <= 1
+            or self.chat_queue.qsize() >= self.chat_batch_size
+            or self.chat_window_start is None
+            or time.time() - self.chat_window_start >= self.chat_batch_window
+        )
 
-                case LLMState.GENERATING:
-                    if isinstance(task, ASRActivated):
-                        self._switch_to_waiting4asr()
-                    if self.generate_task is not None and self.generate_task.done():
-                        self._switch_to_waiting4tts()
+    def _reply_chats(self):
+        """取出至多 chat_batch_size 条排队的弹幕，合并为一次回复"""
+        chat_messages = [self.chat_queue.get_nowait() for _ in range(min(self.chat_batch_size, self.chat_queue.qsize()))]
+        self.trace_id = chat_messages[0].trace_id # 以等待最久的弹幕计算延迟
+        chats = [chat_message.get_value(self) for chat_message in chat_messages]
+        self._add_chats_history(chats)
+        chats_per_reply.observe(len(chat_messages))
+        if self.response_cache is not None and len(chats) == 1: # 合并回复多条弹幕时不使用缓存
+            self.cache_key = self.response_cache.make_key(self.context_fingerprint(), chats[0]['content'])
+            self.cache_user = chats[0]['user']
+            self.cached_reply = self.response_cache.get(self.cache_key)
+        if self.chat_queue.empty(): # 否则剩下的弹幕已等了一段时间，下次回复时不必再等
+            self.chat_window_start = None
+        self._switch_to_generating()
 
-                case LLMState.WAITING4ASR:
-                    if time.time() - self.waiting4asr_start_time > self.asr_timeout:
-                        self._switch_to_idle() # ASR超时，回到待机
-                    if isinstance(task, ASRMessage):
-                        message_value = task.get_value(self)
-                        speaker_name = message_value["speaker_name"]
-                        content = message_value["message"]
-                        self._add_asr_history(speaker_name, content)
-                        self.asr_counter -= 1 # 有人说话完毕，计数器-1
-                    if isinstance(task, ASRActivated):
-                        self.asr_counter += 1 # 有人开始说话，计数器+1
-                    if self.asr_counter <= 0: # 所有人说话完毕，开始生成
-                        self._switch_to_generating()
+    async def step(self, task: Message | None):
+        """状态机前进一步，task 为 None 表示没有新消息（超时或生成结束）"""
+        if task is not None and log.debug_enabled:
+            self.logger.opt(lazy=True).debug("{} {}", lambda: self.state, lambda: task)
+        if isinstance(task, ChatMessage):
+            # 若小于一定阈值则回复每一条信息，若超过则逐渐降低回复概率；一次回复多条时阈值相应放大
+            threshold = min(self.chat_size_threshold * self.chat_batch_size, self.chat_maxsize)
+            if (qsize := self.chat_queue.qsize()) < threshold:
+                prob = 1
+            else:
+                prob = 1 - (qsize - threshold) / max(1, self.chat_maxsize - threshold)
+            if random.random() < prob:
+                try:
+                    self.chat_queue.put_nowait(task)
+                    if self.chat_window_start is None:
+                        self.chat_window_start = time.time()
+                except asyncio.QueueFull:
+                    chats_discarded_total.inc()
+            else:
+                chats_discarded_total.inc()
+        if isinstance(task, SongInfo):
+            self.about_to_sing = True
+            self.song_id = task.get_value(self)["song_id"]
 
-                case LLMState.WAITING4TTS:
-                    if time.time() - self.waiting4tts_start_time > self.tts_timeout:
-                        self._switch_to_idle() # 太久没有TTS完成信息，说明TTS生成失败，回到待机
-                    if isinstance(task, AudioFinished):
-                        self._switch_to_idle()
-                    elif isinstance(task, ASRActivated):
-                        self._switch_to_waiting4asr()
-                
-                case LLMState.SINGING:
-                    if isinstance(task, FinishedSinging):
-                        self._switch_to_idle()
+        match self.state:
+            case LLMState.IDLE:
+                if isinstance(task, ASRActivated):
+                    self._switch_to_waiting4asr()
+                elif self.about_to_sing:
+                    await self.results_queue.put(
+                        ReadyToSing(self, self.song_id)
+                    )
+                    self._switch_to_singing()
+                elif not self.chat_queue.empty():
+                    if self.chat_batch_ready():
+                        self._reply_chats()
+                elif self.do_start_topic and time.time() - self.idle_start_time > self.idle_timeout:
+                    self.notices.append("现在没有人说话，请随便说点什么吧！")
+                    self.trace_id = new_trace_id()
+                    tracer.start(self.trace_id, "IdleTopic")
+                    self._switch_to_generating()
+
+            case LLMState.GENERATING:
+                if isinstance(task, ASRActivated):
+                    self._switch_to_waiting4asr()
+                if self.generate_task is not None and self.generate_task.done():
+                    self._switch_to_waiting4tts()
 
-            await asyncio.sleep(0.1) # 避免卡死事件循环
+            case LLMState.WAITING4ASR:
+                if time.time() - self.waiting4asr_start_time > self.asr_timeout:
+                    self._switch_to_idle() # ASR超时，回到待机
+                if isinstance(task, ASRMessage):
+                    message_value = task.get_value(self)
+                    speaker_name = message_value["speaker_name"]
+                    content = message_value["message"]
+                    self.trace_id = task.trace_id # 以最后一个说完话的人为准
+                    self._add_asr_history(speaker_name, content)
+                    self.asr_counter -= 1 # 有人说话完毕，计数器-1
+                if isinstance(task, ASRActivated):
+                    self.asr_counter += 1 # 有人开始说话，计数器+1
+                if self.asr_counter <= 0: # 所有人说话完毕，开始生成
+                    self._switch_to_generating()
+
+            case LLMState.WAITING4TTS:
+                if time.time() - self.waiting4tts_start_time > self.tts_timeout:
+                    self._switch_to_idle() # 太久没有TTS完成信息，说明TTS生成失败，回到待机
+                if isinstance(task, AudioFinished):
+                    self._switch_to_idle()
+                elif isinstance(task, ASRActivated):
+                    self._switch_to_waiting4asr()
+                
+            case LLMState.SINGING:
+                if isinstance(task, FinishedSinging):
+                    self._switch_to_idle()
     
     async def start_generating(self) -> None:
-        iterator = self.iter_sentences_emotions()
+        trace_id = self.trace_id
+        cache_key, cache_user, cached_reply = self.cache_key, self.cache_user, self.cached_reply
+        self.cache_key = self.cached_reply = None
+        self.reply_incomplete = False
+        if cached_reply is not None:
+            iterator = self.iter_cached_reply(cached_reply, trace_id)
+        else:
+            iterator = self.iter_sentences_emotions()
+        reply: Reply = []
+        completed = False
         try:
             async for sentence, emotion in iterator:
                 self.generated_text += sentence
+                reply.append((sentence, emotion))
                 await self.results_queue.put(
                     LLMMessage(
                         self,
                         sentence,
                         str(uuid4()),
-                        emotion
+                        emotion,
+                        trace_id=trace_id
                     )
                 )
+            completed = True
         except asyncio.CancelledError:
             await iterator.aclose()
         finally:
-            await self.results_queue.put(LLMEOS(self))
+            await self.results_queue.put(LLMEOS(self, trace_id))
+        if (
+            completed and not self.reply_incomplete and cached_reply is None and cache_key is not None and reply
+            and self.response_cache is not None and not (cache_user and any(cache_user in text for text, _ in reply))
+        ):
+            self.response_cache.put(cache_key, reply)
+
+    async def iter_cached_reply(self, reply: Reply, trace_id: str | None):
+        tracer.mark(trace_id, "first_sentence")
+        for sentence, emotion in reply:
+            yield sentence, emotion
+
+    def context_fingerprint(self) -> tuple[Any, ...]:
+        """回复缓存的上下文指纹：模型、系统提示词和当前小时（问候语等与时间有关）"""
+        return (self.model_id, self.config.system_prompt, time.strftime("%Y-%m-%d %H"))
     
-    @torch.no_grad()
     async def get_emotion(self, text: str) -> dict[str, float]:
-        print(text)
-        labels = ['neutral', 'like', 'sad', 'disgust', 'anger', 'happy']
-        ids = self.classifier_tokenizer([text], return_tensors="pt")['input_ids']
-        probs = (
-            (await asyncio.to_thread(self.classifier_model, input_ids=ids))
-            .logits
-            .softmax(dim=-1)
-            .squeeze()
-        )
-        return dict(zip(labels, probs.tolist()))
+        """分类单个句子（不设时限）"""
+        return await self.emotion_classifier.classify(text)
     
     def dict2message(self, message: dict[str, Any]):
         from openai.types.chat import (
@@ -429,63 +759,23 @@ class LLM(ModuleBase):
             case _:
                 raise ValueError(f"Invalid message: {message}")
 
-    def get_mcp_tools(self):
-        ## By: Claude Code (Powered by Kimi-K2)
-        """获取所有可用的MCP工具"""
+    def get_mcp_tools(self) -> list[dict[str, Any]]:
+        """获取所有可用的MCP工具（注册时已构造好，不要修改返回的列表）"""
         if not self.config.mcp_support:
             return []
-        
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": tool.name,
-                    "description": tool.description,
-                    "parameters": tool.inputSchema
-                }
-            }
-            for tool_list in self.tools
-            for tool in tool_list
-        ]
+        return self.tool_registry.schemas
 
-    async def execute_mcp_tool(self, tool_name: str, arguments):
-        ## By: Claude Code (Powered by Kimi-K2)
+    async def execute_mcp_tool(self, tool_name: str, arguments: dict[str, Any]) -> dict[str, Any]:
         """执行指定的MCP工具调用"""
         if not self.config.mcp_support:
             raise ValueError("MCP support is not enabled")
-        
-        # 查找对应的工具会话
-        for session_idx, tool_list in enumerate(self.tools):
-            for tool in tool_list:
-                if tool.name == tool_name:
-                    session = self.mcp_sessions[session_idx]
-                    try:
-                        result = await session.call_tool(tool_name, arguments)
-                        # 将 CallToolResult 转为可序列化的字典格式
-                        if hasattr(result, 'content'):
-                            # 处理 CallToolResult 对象
-                            content_list = []
-                            for content_item in result.content:
-                                if hasattr(content_item, 'text'):
-                                    content_list.append({"type": "text", "text": content_item.text})
-                                elif hasattr(content_item, 'type') and hasattr(content_item, 'data'):
-                                    content_list.append({"type": content_item.type, "data": content_item.data})
-                            return {"content": content_list}
-                        else:
-                            # 处理其他格式的结果
-                            return {"content": [{"type": "text", "text": str(result)}]}
-                    except Exception as e:
-                        print(f"Error executing MCP tool {tool_name}: {e}")
-                        return {"error": str(e)}
-        
-        raise ValueError(f"Tool {tool_name} not found")
+        return await self.tool_registry.call(tool_name, arguments)
     
     async def _generate_with_tools_stream(self, messages, available_tools):
         ## By: Claude Code (Powered by Kimi-K2)
         """流式模式：使用工具进行对话生成的辅助方法"""
         try:
             request_params = {
-                "model": self.model_id,
                 "messages": messages,
                 "stream": True,
                 "temperature": self.temperature
@@ -494,11 +784,16 @@ class LLM(ModuleBase):
             if available_tools:
                 request_params["tools"] = available_tools
                 request_params["tool_choice"] = "auto"
+            if self.config.report_usage:
+                request_params["stream_options"] = {"include_usage": True}
             
-            response_stream = await self.client.chat.completions.create(**request_params)
+            response_stream = self.backends.stream(request_params) # 出错时自动换用备用模型，首个 token 过慢时对冲请求
             tool_calls_accumulator = {}
+            final_chunk = None # 带 finish_reason 的块等到用量信息（紧随其后）到达后再输出
             
             async for chunk in response_stream:
+                if getattr(chunk, "usage", None) is not None:
+                    self.record_usage(chunk.usage)
                 if chunk.choices and chunk.choices[0].delta:
                     delta = chunk.choices[0].delta
                     content = delta.content or ""
@@ -530,28 +825,49 @@ class LLM(ModuleBase):
                     if finish_reason == "tool_calls":
                         tool_calls_output = list(tool_calls_accumulator.values())
                     
-                    yield {
+                    output = {
                         "content": content,
                         "tool_calls": tool_calls_output,
                         "finish_reason": finish_reason
                     }
+                    if finish_reason:
+                        final_chunk = output
+                    else:
+                        yield output
+            if final_chunk is not None:
+                yield final_chunk
         except Exception as e:
-            print(f"Error in _generate_with_tools_stream: {e}")
+            self.logger.error("Error in _generate_with_tools_stream: {}", e)
+            self.reply_incomplete = True # 不缓存出错的回复
             yield {
                 "content": f"抱歉，生成回复时出现错误: {e}",
                 "tool_calls": [],
                 "finish_reason": "stop"
             }
 
+    async def with_emotions(self, sentences: list[str], emotion: dict[str, float], trace_id: str | None):
+        """为句子附上情感：先提交所有句子，使它们在同一批中分类，超时沿用上一句的情感 emotion"""
+        pending = [(sentence, self.emotion_classifier.submit(sentence)) for sentence in sentences]
+        for sentence, future in pending:
+            tracer.mark(trace_id, "first_sentence")
+            emotion = await self.emotion_classifier.get(future, self.config.emotion_deadline, emotion)
+            tracer.mark(trace_id, "emotion")
+            yield sentence, emotion
+
     async def iter_sentences_emotions(self):
         ## By: KyvYang + Claude Code (Powered by Kimi-K2)
-        generating_sentence = ""
+        trace_id = self.trace_id
+        segmenter = StreamingSentenceSegmenter(
+            first_clause_length=self.config.first_clause_length,
+            max_length=self.config.max_sentence_length
+        )
+        emotion = NEUTRAL # 分类超时时沿用上一句的情感
         try:
             # 获取可用的MCP工具
             available_tools = self.get_mcp_tools()
             
             # 创建消息历史
-            current_messages = [self.dict2message(message) for message in self.history]
+            current_messages = self.build_messages()
             
             # 循环处理工具调用，直到没有更多工具调用
             while True:
@@ -569,16 +885,12 @@ class LLM(ModuleBase):
                     
                     # 处理内容流
                     if content and not tool_calls_buffer:  # 没有待处理的工具调用
-                        generating_sentence += str(content)
+                        tracer.mark(trace_id, "first_token")
                         self.generated_text += str(content)
                         
                         # 检查是否有完整的句子可以发送
-                        sentences = split_text(generating_sentence)
-                        if sentences[:-1]:
-                            for sentence in sentences[:-1]:
-                                if sentence.strip():
-                                    yield sentence.strip(), await self.get_emotion(sentence.strip())
-                            generating_sentence = sentences[-1]
+                        async for sentence, emotion in self.with_emotions(segmenter.feed(str(content)), emotion, trace_id):
+                            yield sentence, emotion
                     
                     # 收集工具调用信息（在流结束时处理）
                     if tool_calls:
@@ -614,35 +926,36 @@ class LLM(ModuleBase):
                         )
                         current_messages.append(assistant_message)
                     
-                    # 执行所有工具调用
+                    # 并行执行所有工具调用，结果按调用顺序加入消息历史
+                    from openai.types.chat import ChatCompletionToolMessageParam
+                    calls: list[tuple[str, dict[str, Any]]] = []
+                    parsed: list[dict[str, Any] | Exception] = []
                     for tool_call in tool_calls_buffer:
-                        tool_name = tool_call["function"]["name"]
                         try:
                             tool_args = json.loads(tool_call["function"]["arguments"] or "{}")
-                            result = await self.execute_mcp_tool(tool_name, tool_args)
-                            
-                            # 添加工具结果到消息历史
-                            from openai.types.chat import ChatCompletionToolMessageParam
-                            
-                            # 确保结果是可序列化的格式
-                            tool_content = json.dumps(result)
-                            
-                            tool_result_message = ChatCompletionToolMessageParam(
-                                role="tool",
-                                content=tool_content,
-                                tool_call_id=tool_call["id"]
-                            )
-                            current_messages.append(tool_result_message)
-                            
-                            # 输出简洁的调用提示给用户
-                            tool_hint = f"<调用了 {tool_name} 工具成功>"
-                            generating_sentence += tool_hint
-                            self.generated_text += tool_hint
-                            
+                            calls.append((tool_call["function"]["name"], tool_args))
+                            parsed.append(tool_args)
                         except Exception as e:
-                            error_hint = f"<调用 {tool_name} 工具失败：{e}>"
-                            generating_sentence += error_hint
-                            self.generated_text += error_hint
+                            parsed.append(e)
+                    results = iter(await self.tool_registry.call_many(calls))
+                    for tool_call, tool_args in zip(tool_calls_buffer, parsed):
+                        tool_name = tool_call["function"]["name"]
+                        result = tool_args if isinstance(tool_args, Exception) else next(results)
+                        if isinstance(result, Exception):
+                            result = {"error": str(result)}
+                        # 每个工具调用都要有对应的结果消息，失败时返回错误信息
+                        current_messages.append(ChatCompletionToolMessageParam(
+                            role="tool",
+                            content=json.dumps(result), # 确保结果是可序列化的格式
+                            tool_call_id=tool_call["id"]
+                        ))
+                        if "error" in result:
+                            hint = f"<调用 {tool_name} 工具失败：{result['error']}>"
+                        else:
+                            hint = f"<调用了 {tool_name} 工具成功>" # 输出简洁的调用提示给用户
+                        async for sentence, emotion in self.with_emotions(segmenter.feed(hint), emotion, trace_id):
+                            yield sentence, emotion
+                        self.generated_text += hint
                     
                     # 继续下一轮循环，让LLM基于工具结果继续生成
                     continue
@@ -651,18 +964,13 @@ class LLM(ModuleBase):
                 break
 
         except asyncio.CancelledError:
-            pass
+            self.reply_incomplete = True
         except Exception as e:
-            print(repr(e))
-            yield f"Someone tell the developer that there's something wrong with my AI: {repr(e)}", {
-                "neutral": 1.0,
-                "like": 0.0,
-                "sad": 0.0,
-                "disgust": 0.0,
-                "anger": 0.0,
-                "happy": 0.0
-            }
+            self.reply_incomplete = True
+            self.logger.opt(exception=e).error("生成回复时出错：{!r}", e)
+            yield f"Someone tell the developer that there's something wrong with my AI: {repr(e)}", NEUTRAL
         
         # 处理剩余的句子
-        if generating_sentence.strip():
-            yield generating_sentence.strip(), await self.get_emotion(generating_sentence)
+        if rest := segmenter.flush():
+            async for sentence, emotion in self.with_emotions([rest], emotion, trace_id):
+                yield sentence, emotion
@@ -0,0 +1,273 @@
+"""
+多后端 LLM 连接池
+按配置顺序使用多个 OpenAI 兼容的后端：
+- 熔断：连续失败 failure_threshold 次的后端暂停使用 cooldown 秒，之后进入半开状态，只放行一个探测请求，
+  成功则恢复，失败则再暂停 cooldown 秒；
+- 故障转移：首个 token 之前出错时立即改用下一个后端；
+- 对冲请求：超过 ttft_deadline 秒仍未收到首个 token 时，同时向下一个后端发出相同的请求，先产生 token 的流胜出，其余取消；
+- 已开始输出后超过 chunk_timeout 秒没有新内容视为出错，不再等到 TTS 超时。
+每个后端的请求结果、首 token 延迟记录在指标中，也可通过 get_stats 获取。
+"""
+from __future__ import annotations
+
+import asyncio
+import statistics
+import time
+from collections import deque
+from typing import Any, AsyncIterator
+from .metrics import Counter, Gauge, Histogram
+from .log import logger
+
+backend_requests_total = Counter(
+    "swarmclone_llm_backend_requests_total", "LLM backend requests by outcome (ok, error, hedge_lost)", ("backend", "result")
+)
+backend_ttft_seconds = Histogram(
+    "swarmclone_llm_backend_ttft_seconds", "Time from request to first token per LLM backend", ("backend",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0)
+)
+backend_up = Gauge("swarmclone_llm_backend_up", "Whether the LLM backend's circuit is closed (1) or open (0)", ("backend",))
+hedged_requests_total = Counter("swarmclone_llm_hedged_requests_total", "Requests sent to another backend after the TTFT deadline")
+
+def has_token(chunk: Any) -> bool:
+    """流式响应块是否包含实际内容（只有角色或用量的块不算）"""
+    if not chunk.choices:
+        return False
+    choice = chunk.choices[0]
+    delta = choice.delta
+    return bool(choice.finish_reason or (delta is not None and (delta.content or delta.tool_calls)))
+
+class Backend:
+    def __init__(self, base_url: str, model_id: str, api_key: str, name: str | None = None, max_retries: int = 2):
+        """max_retries: 客户端自身的重试次数，有备用后端时应设为 0，直接故障转移"""
+        import openai
+        self.base_url = base_url
+        self.model_id = model_id
+        self.name = name or f"{model_id}@{base_url}"
+        self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0 # 熔断结束的时间（time.monotonic），0 为未熔断
+        self.probing = False # 半开状态下是否已有探测请求在进行
+        self.last_error: str | None = None
+        self.ttfts: deque[float] = deque(maxlen=200) # 最近的首 token 延迟
+        backend_up.set(1, (self.name,))
+
+    @property
+    def state(self) -> str:
+        if not self.open_until:
+            return "closed"
+        return "half_open" if time.monotonic() >= self.open_until else "open"
+
+    def available(self) -> bool:
+        """未熔断，或熔断时间已过且还没有探测请求"""
+        return time.monotonic() >= self.open_until and not self.probing
+
+    def get_stats(self) -> dict[str, Any]:
+        ttfts = sorted(self.ttfts)
+        return {
+            "name": self.name,
+            "model": self.model_id,
+            "available": self.available(),
+            "state": self.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "ttft_p50": statistics.median(ttfts) if ttfts else None,
+            "ttft_p95": ttfts[int(len(ttfts) * 0.95)] if ttfts else None
+        }
+
+def parse_backends(text: str, default_api_key: str) -> list[tuple[str, str, str]]:
+    """每行一个后端：“api网址 模型id [api key]”，省略 api key 时使用主后端的；忽略空行和 # 开头的注释行"""
+    backends: list[tuple[str, str, str]] = []
+    for line in text.splitlines():
+        if not (line := line.strip()) or line.startswith("#"):
+            continue
+        match line.split():
+            case [base_url, model_id]:
+                backends.append((base_url, model_id, default_api_key))
+            case [base_url, model_id, api_key]:
+                backends.append((base_url, model_id, api_key))
+            case _:
+                raise ValueError(f"无法解析备用模型：{line}")
+    return backends
+
+class OpenedStream:
+    """已收到首个 token 的流"""
+    __slots__ = ("backend", "stream", "iterator", "buffered", "ttft")
+    def __init__(self, backend: Backend, stream: Any, iterator: AsyncIterator[Any], buffered: list[Any], ttft: float):
+        self.backend = backend
+        self.stream = stream
+        self.iterator = iterator
+        self.buffered = buffered
+        self.ttft = ttft
+
+class BackendPool:
+    def __init__(self, backends: list[Backend], ttft_deadline: float = 0.0, chunk_timeout: float = 0.0,
+                 failure_threshold: int = 3, cooldown: float = 30.0):
+        """
+        backends: 按优先顺序排列的后端
+        ttft_deadline: 超过这一时间（秒）未收到首个 token 时向下一个后端发出对冲请求，0 为不对冲
+        chunk_timeout: 开始输出后两个响应块之间的最长间隔（秒），0 为不限制
+        failure_threshold: 连续失败这么多次后熔断
+        cooldown: 熔断持续的时间（秒）
+        """
+        assert backends, "至少需要一个后端"
+        self.backends = backends
+        self.ttft_deadline = ttft_deadline
+        self.chunk_timeout = chunk_timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+    def candidates(self) -> list[Backend]:
+        """可用的后端按配置顺序排在前面，熔断中（含正在探测）的按熔断结束时间排在后面（全部熔断时仍会尝试）"""
+        available = [backend for backend in self.backends if backend.available()]
+        tripped = sorted((backend for backend in self.backends if not backend.available()), key=lambda b: b.open_until)
+        return available + tripped
+
+    @staticmethod
+    def acquire(backend: Backend):
+        """向后端发出请求前调用：熔断过的后端（半开或全部熔断时的兜底）的请求作为探测请求"""
+        if backend.open_until:
+            backend.probing = True
+
+    @staticmethod
+    def release(backend: Backend):
+        """请求结束（包括被取消、对冲失败）后调用，半开的后端可以再放行一个探测请求"""
+        backend.probing = False
+
+    def record_success(self, backend: Backend, ttft: float | None = None):
+        backend.requests += 1
+        if backend.consecutive_failures >= self.failure_threshold:
+            logger.info("LLM 后端 {} 已恢复", backend.name)
+        backend.consecutive_failures = 0
+        backend.open_until = 0.0
+        backend_up.set(1, (backend.name,))
+        backend_requests_total.inc(1, (backend.name, "ok"))
+        if ttft is not None:
+            backend.ttfts.append(ttft)
+            backend_ttft_seconds.observe(ttft, (backend.name,))
+
+    def record_failure(self, backend: Backend, error: BaseException):
+        backend.requests += 1
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.last_error = repr(error)
+        backend_requests_total.inc(1, (backend.name, "error"))
+        if backend.consecutive_failures >= self.failure_threshold:
+            backend.open_until = time.monotonic() + self.cooldown
+            backend_up.set(0, (backend.name,))
+            logger.warning("LLM 后端 {} 连续失败 {} 次，暂停使用 {} 秒：{!r}", backend.name, backend.consecutive_failures, self.cooldown, error)
+        else:
+            logger.warning("LLM 后端 {} 请求失败：{!r}", backend.name, error)
+
+    async def open_stream(self, backend: Backend, params: dict[str, Any]) -> OpenedStream:
+        """发出流式请求并读到首个 token（或流结束）为止"""
+        start = time.perf_counter()
+        stream = await backend.client.chat.completions.create(**params, model=backend.model_id)
+        try:
+            iterator = stream.__aiter__()
+            buffered: list[Any] = []
+            async for chunk in iterator:
+                buffered.append(chunk)
+                if has_token(chunk):
+                    break
+            return OpenedStream(backend, stream, iterator, buffered, time.perf_counter() - start)
+        except BaseException: # 出错或被取消（对冲失败）时关闭连接
+            await stream.close()
+            raise
+
+    async def stream(self, params: dict[str, Any]) -> AsyncIterator[Any]:
+        """流式生成，params 为 chat.completions.create 的参数（不含 model），逐个产出响应块"""
+        candidates = iter(self.candidates())
+        pending: dict[asyncio.Task[OpenedStream], Backend] = {}
+        def launch() -> bool:
+            if (backend := next(candidates, None)) is None:
+                return False
+            self.acquire(backend)
+            pending[asyncio.ensure_future(self.open_stream(backend, params))] = backend
+            return True
+
+        launch()
+        winner: OpenedStream | None = None
+        last_error: BaseException | None = None
+        can_hedge = self.ttft_deadline > 0
+        try:
+            while pending and winner is None:
+                done, _ = await asyncio.wait(
+                    pending, timeout=self.ttft_deadline if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done: # 超过首 token 时限，向下一个后端发出对冲请求
+                    if launch():
+                        hedged_requests_total.inc()
+                        logger.info("LLM 后端 {:.1f} 秒内未返回首个 token，同时请求下一个后端", self.ttft_deadline)
+                    else:
+                        can_hedge = False
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    if (error := task.exception()) is not None:
+                        self.record_failure(backend, error)
+                        self.release(backend)
+                        last_error = error
+                    elif winner is None:
+                        winner = task.result()
+                    else: # 同时完成，只用先到的一个
+                        self.release(backend)
+                        await task.result().stream.close()
+                        backend_requests_total.inc(1, (backend.name, "hedge_lost"))
+                if winner is None and not pending:
+                    launch() # 故障转移
+        finally:
+            for task, backend in pending.items():
+                task.cancel()
+                self.release(backend)
+                if winner is not None:
+                    backend_requests_total.inc(1, (backend.name, "hedge_lost"))
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        if winner is None:
+            raise last_error or RuntimeError("没有可用的 LLM 后端")
+
+        backend = winner.backend
+        try:
+            for chunk in winner.buffered:
+                yield chunk
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(winner.iterator.__anext__(), self.chunk_timeout or None)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        except asyncio.TimeoutError as e:
+            self.record_failure(backend, e)
+            raise TimeoutError(f"LLM 后端 {backend.name} 超过 {self.chunk_timeout} 秒没有输出") from e
+        except Exception as e:
+            self.record_failure(backend, e)
+            raise
+        else:
+            self.record_success(backend, winner.ttft)
+        finally: # 也包括调用方中途停止（如被打断）
+            self.release(backend)
+            await winner.stream.close()
+
+    async def create(self, **params: Any) -> Any:
+        """非流式请求，出错时依次改用下一个后端"""
+        last_error: BaseException | None = None
+        for backend in self.candidates():
+            self.acquire(backend)
+            try:
+                response = await backend.client.chat.completions.create(**params, model=backend.model_id)
+            except Exception as e:
+                self.record_failure(backend, e)
+                last_error = e
+                continue
+            finally:
+                self.release(backend)
+            self.record_success(backend)
+            return response
+        raise last_error or RuntimeError("没有可用的 LLM 后端")
+
+    def get_stats(self) -> list[dict[str, Any]]:
+        return [backend.get_stats() for backend in self.backends]
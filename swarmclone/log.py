@@ -0,0 +1,54 @@
+"""
+日志
+基于 loguru：分级、可用 bind 附加结构化字段、惰性格式化，写入由后台线程处理的异步 sink（enqueue=True），
+因此记录日志不会阻塞事件循环。
+环境变量：
+SWARMCLONE_LOG_LEVEL: 日志级别，默认 INFO
+SWARMCLONE_LOG_SAMPLE: 消息总线调试日志的采样间隔，每 N 条只记录 1 条，默认 1（全部记录）
+"""
+from __future__ import annotations
+
+import os
+import sys
+from loguru import logger
+
+LOG_FORMAT = (
+    "<green>{time:HH:mm:ss.SSS}</green> | <level>{level: <7}</level> | "
+    "<cyan>{extra[module]}</cyan> | <level>{message}</level>"
+)
+
+class Sampler:
+    """每 every 次调用返回一次 True"""
+    def __init__(self, every: int = 1):
+        self.every = max(1, every)
+        self.count = 0
+
+    def __call__(self) -> bool:
+        self.count += 1
+        if self.count >= self.every:
+            self.count = 0
+            return True
+        return False
+
+debug_enabled: bool = False # 热路径上先检查此标志，调试日志关闭时完全不做格式化
+bus_sampler = Sampler()
+_handler_id: int | None = None
+
+def setup(level: str | None = None, sample_every: int | None = None):
+    """（重新）配置日志输出"""
+    global debug_enabled, _handler_id
+    level = (level or os.environ.get("SWARMCLONE_LOG_LEVEL", "INFO")).upper()
+    if sample_every is None:
+        sample_every = int(os.environ.get("SWARMCLONE_LOG_SAMPLE", "1"))
+    if _handler_id is None:
+        logger.remove() # 移除 loguru 默认的同步 sink
+    else:
+        logger.remove(_handler_id)
+    logger.configure(extra={"module": "-"})
+    _handler_id = logger.add(sys.stderr, level=level, format=LOG_FORMAT, enqueue=True)
+    debug_enabled = logger.level(level).no <= logger.level("DEBUG").no
+    bus_sampler.every = max(1, sample_every)
+
+setup()
+
+__all__ = ["logger", "setup", "Sampler", "bus_sampler"]
@@ -0,0 +1,254 @@
+"""
+MCP 工具注册表
+按工具名索引各服务器提供的工具，调用时 O(1) 找到对应会话；发送给模型的工具列表只在注册时构造一次。
+同一轮中的多个工具调用并行执行，每个调用有单独的超时；
+声明为幂等（annotations.idempotentHint）的工具，相同参数的结果在 cache_ttl 秒内直接复用。
+MCP 服务器（stdio 脚本/命令或 streamable HTTP 地址）各自在后台任务中启动，启动完成即注册其工具，不阻塞 LLM 模块；
+服务器退出或无响应时移除其工具并自动重启。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import shlex
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from typing import TYPE_CHECKING, Any
+from .metrics import Counter, Gauge, Histogram
+from .log import logger
+
+if TYPE_CHECKING:
+    from mcp import ClientSession
+    from mcp.types import Tool
+
+tool_calls_total = Counter("swarmclone_llm_tool_calls_total", "MCP tool calls by outcome", ("tool", "result"))
+tool_call_seconds = Histogram(
+    "swarmclone_llm_tool_call_seconds", "MCP tool call latency (cache hits excluded)", ("tool",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+mcp_tools_available = Gauge("swarmclone_llm_mcp_tools", "MCP tools currently available to the LLM")
+mcp_server_startup_seconds = Gauge(
+    "swarmclone_llm_mcp_server_startup_seconds", "Duration of each MCP server startup stage in its last start", ("server", "stage")
+)
+mcp_server_restarts_total = Counter("swarmclone_llm_mcp_server_restarts_total", "MCP server restarts after exiting or failing", ("server",))
+
+class ToolEntry:
+    __slots__ = ("session", "tool", "idempotent")
+    def __init__(self, session: ClientSession, tool: Tool):
+        self.session = session
+        self.tool = tool
+        self.idempotent = bool(tool.annotations is not None and tool.annotations.idempotentHint)
+
+def convert_result(result: Any) -> dict[str, Any]:
+    """将 CallToolResult 转为可序列化的字典格式"""
+    if not hasattr(result, 'content'): # 处理其他格式的结果
+        return {"content": [{"type": "text", "text": str(result)}]}
+    content_list = []
+    for content_item in result.content:
+        if hasattr(content_item, 'text'):
+            content_list.append({"type": "text", "text": content_item.text})
+        elif hasattr(content_item, 'type') and hasattr(content_item, 'data'):
+            content_list.append({"type": content_item.type, "data": content_item.data})
+    converted: dict[str, Any] = {"content": content_list}
+    if getattr(result, 'isError', False):
+        converted["isError"] = True
+    return converted
+
+class ToolRegistry:
+    def __init__(self, timeout: float = 10.0, cache_ttl: float = 0.0, cache_size: int = 256):
+        """
+        timeout: 单个工具调用的超时时间（秒），0 为不限制
+        cache_ttl: 幂等工具结果的缓存时间（秒），0 为不缓存
+        """
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.servers: dict[ClientSession, list[Tool]] = {} # 按注册顺序，重名时先注册的优先
+        self.tools: dict[str, ToolEntry] = {}
+        self.schemas: list[dict[str, Any]] = [] # 发送给模型的工具列表
+        self.cache: OrderedDict[tuple[str, str], tuple[float, dict[str, Any]]] = OrderedDict() # (工具名, 参数) -> (过期时间, 结果)
+
+    def add_server(self, session: ClientSession, tools: list[Tool]):
+        """注册一个服务器提供的工具，与已注册的工具重名时忽略"""
+        for tool in tools:
+            if (entry := self.tools.get(tool.name)) is not None and entry.session is not session:
+                logger.warning("MCP 工具 {} 重名，忽略后注册的工具", tool.name)
+        self.servers[session] = tools
+        self.rebuild()
+
+    def remove_server(self, session: ClientSession):
+        """移除一个服务器的工具（服务器退出或重启时）"""
+        if self.servers.pop(session, None) is not None:
+            self.rebuild()
+
+    def rebuild(self):
+        """按注册顺序重建索引和工具列表；工具列表总是新建，正在进行的请求仍使用旧列表"""
+        tools: dict[str, ToolEntry] = {}
+        for session, server_tools in self.servers.items():
+            for tool in server_tools:
+                tools.setdefault(tool.name, ToolEntry(session, tool))
+        self.tools = tools
+        self.schemas = [
+            {
+                "type": "function",
+                "function": {
+                    "name": entry.tool.name,
+                    "description": entry.tool.description,
+                    "parameters": entry.tool.inputSchema
+                }
+            }
+            for entry in tools.values()
+        ]
+        mcp_tools_available.set(len(tools))
+
+    def clear(self):
+        self.servers.clear()
+        self.rebuild()
+        self.cache.clear()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tools
+
+    def __len__(self) -> int:
+        return len(self.tools)
+
+    async def call(self, name: str, arguments: dict[str, Any]) -> dict[str, Any]:
+        """调用工具，工具不存在时抛出 ValueError；调用出错或超时返回 {"error": ...}"""
+        if (entry := self.tools.get(name)) is None:
+            raise ValueError(f"Tool {name} not found")
+        key = None
+        if entry.idempotent and self.cache_ttl > 0:
+            key = (name, json.dumps(arguments, sort_keys=True, ensure_ascii=False))
+            if (cached := self.cache.get(key)) is not None:
+                if cached[0] > time.monotonic():
+                    self.cache.move_to_end(key)
+                    tool_calls_total.inc(1, (name, "cached"))
+                    return cached[1]
+                del self.cache[key]
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(entry.session.call_tool(name, arguments), self.timeout or None)
+        except asyncio.TimeoutError:
+            tool_calls_total.inc(1, (name, "timeout"))
+            logger.error("MCP 工具 {} 调用超时（{} 秒）", name, self.timeout)
+            return {"error": f"timed out after {self.timeout} seconds"}
+        except Exception as e:
+            tool_calls_total.inc(1, (name, "error"))
+            logger.error("Error executing MCP tool {}: {}", name, e)
+            return {"error": str(e)}
+        finally:
+            tool_call_seconds.observe(time.perf_counter() - start, (name,))
+        converted = convert_result(result)
+        tool_calls_total.inc(1, (name, "ok"))
+        if key is not None and not converted.get("isError"):
+            self.cache[key] = (time.monotonic() + self.cache_ttl, converted)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return converted
+
+    async def call_many(self, calls: list[tuple[str, dict[str, Any]]]) -> list[dict[str, Any] | Exception]:
+        """并行调用多个工具，结果按调用顺序返回，失败的调用对应其异常"""
+        return await asyncio.gather(*(self.call(name, arguments) for name, arguments in calls), return_exceptions=True)
+
+def parse_servers(text: str) -> list[str]:
+    """每行一个服务器，忽略空行和 # 开头的注释行"""
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.strip().startswith("#")]
+
+class MCPServer:
+    """
+    一个 MCP 服务器，spec 可以是：
+    http(s):// 开头的 streamable HTTP 地址；以 .py 或 .js 结尾的脚本（分别用 python、node 运行）；其他为 stdio 服务器的启动命令
+    """
+    def __init__(self, spec: str, registry: ToolRegistry, timeout: float = 30.0, ping_interval: float = 15.0,
+                 restart_backoff: tuple[float, float] = (1.0, 60.0), stable_time: float = 60.0):
+        """
+        timeout: 连接、初始化、获取工具列表及心跳的超时时间（秒）
+        ping_interval: 心跳间隔（秒），心跳失败视为服务器已退出
+        restart_backoff: 重启等待时间的初始值和上限（秒），连续失败时加倍
+        stable_time: 运行超过这一时间（秒）后再退出时，重启等待时间恢复为初始值
+        """
+        self.spec = spec
+        self.registry = registry
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.restart_backoff = restart_backoff
+        self.stable_time = stable_time
+        self.status: dict[str, Any] = {"state": "starting", "tools": 0, "restarts": 0, "error": None}
+
+    async def connect(self, stack: AsyncExitStack) -> Any:
+        """建立连接，返回 (read, write) 流；传输层的上下文直接在当前任务中进入，以便在同一任务中退出"""
+        if self.spec.startswith(("http://", "https://")):
+            from mcp.client.streamable_http import streamablehttp_client
+            read, write, _get_session_id = await stack.enter_async_context(streamablehttp_client(self.spec))
+            return read, write
+        from mcp import StdioServerParameters
+        from mcp.client.stdio import stdio_client
+        if self.spec.endswith(".py"):
+            command, args = "python", [self.spec]
+        elif self.spec.endswith(".js"):
+            command, args = "node", [self.spec]
+        else:
+            command, *args = shlex.split(self.spec)
+        return await stack.enter_async_context(stdio_client(StdioServerParameters(command=command, args=args)))
+
+    async def start(self, stack: AsyncExitStack) -> ClientSession:
+        """
+        连接并初始化服务器、注册工具，记录各阶段用时
+        超时只限制初始化和获取工具列表：anyio 的上下文（任务组、取消域）必须在进入它的任务中按顺序退出，
+        不能放进 asyncio.wait_for 创建的任务里，也不能嵌套在超时的取消域之内
+        """
+        import anyio
+        from mcp import ClientSession
+        timings: dict[str, float] = {}
+        start = time.perf_counter()
+        read, write = await self.connect(stack)
+        session = await stack.enter_async_context(ClientSession(read, write))
+        timings["connect"] = time.perf_counter() - start
+        with anyio.fail_after(self.timeout):
+            await session.initialize()
+        timings["initialize"] = time.perf_counter() - start - timings["connect"]
+        with anyio.fail_after(self.timeout):
+            tools: list[Tool] = (await session.list_tools()).tools
+        timings["list_tools"] = time.perf_counter() - start - timings["connect"] - timings["initialize"]
+        self.registry.add_server(session, tools)
+        for stage, seconds in timings.items():
+            mcp_server_startup_seconds.set(seconds, (self.spec, stage))
+        self.status.update(state="running", tools=len(tools), error=None, **timings)
+        logger.info(
+            "MCP 服务器 {} 已启动：连接 {:.2f} 秒，初始化 {:.2f} 秒，获取工具列表 {:.2f} 秒，共 {} 个工具",
+            self.spec, timings["connect"], timings["initialize"], timings["list_tools"], len(tools)
+        )
+        return session
+
+    async def run(self):
+        """启动服务器并保持运行，退出或无响应时重启；任务被取消时关闭服务器并退出，不重启"""
+        import anyio
+        delay = self.restart_backoff[0]
+        while True:
+            started = time.monotonic()
+            session: ClientSession | None = None
+            try:
+                async with AsyncExitStack() as stack:
+                    session = await self.start(stack)
+                    while True: # 定期发送心跳，确认服务器仍在运行
+                        await asyncio.sleep(self.ping_interval)
+                        with anyio.fail_after(self.timeout):
+                            await session.send_ping()
+            except asyncio.CancelledError:
+                self.status.update(state="stopped")
+                raise
+            except Exception as e:
+                if time.monotonic() - started > self.stable_time: # 稳定运行过一段时间，不算连续失败
+                    delay = self.restart_backoff[0]
+                error = "timed out" if isinstance(e, (TimeoutError, asyncio.TimeoutError)) else repr(e)
+                self.status.update(state="failed", error=error)
+                logger.warning("MCP 服务器 {} 已退出：{}，{:.1f} 秒后重启", self.spec, error, delay)
+            finally:
+                if session is not None:
+                    self.registry.remove_server(session)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.restart_backoff[1])
+            self.status["restarts"] += 1
+            self.status["state"] = "starting"
+            mcp_server_restarts_total.inc(1, (self.spec,))
@@ -0,0 +1,74 @@
+"""
+消息日志——只追加的环形缓冲区
+每条消息获得一个单调递增的序号，客户端通过游标（since=序号）增量读取，多个客户端互不影响。
+记录中不保存消息本身（其中可能有整段音频等大对象），追加时即转为摘要，过长的值被截断；
+摘要的 JSON 编码只在第一次被读取时生成一次，之后所有客户端共享同一份编码结果。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+from collections import deque
+from typing import Any
+from .messages import Message
+
+MAX_VALUE_LENGTH = 1000 # 摘要中每个值的最大长度
+
+class LogEntry:
+    __slots__ = ("seq", "summary", "getters", "_dict", "_sse")
+    def __init__(self, seq: int, message: Message):
+        self.seq = seq
+        summary = message.get_dict_repr() # 字节串只记录长度
+        for item in summary["message"]:
+            if len(value := item["value"]) > MAX_VALUE_LENGTH:
+                item["value"] = f"{value[:MAX_VALUE_LENGTH]}...<{len(value)} chars>"
+        self.getters: list[dict[str, str | int]] = summary.pop("getters") # 转发后才陆续有模块获取，保留列表本身
+        self.summary = summary
+        self._dict: dict[str, Any] | None = None
+        self._sse: bytes | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        if self._dict is None:
+            self._dict = {"seq": self.seq, **self.summary, "getters": self.getters}
+        return self._dict
+
+    def to_sse(self) -> bytes:
+        """Server-Sent Events 格式的编码结果"""
+        if self._sse is None:
+            data = json.dumps(self.to_dict(), ensure_ascii=False)
+            self._sse = f"id: {self.seq}\nevent: message\ndata: {data}\n\n".encode("utf-8")
+        return self._sse
+
+class MessageLog:
+    def __init__(self, maxlen: int = 1000):
+        self.entries: deque[LogEntry] = deque(maxlen=maxlen)
+        self.last_seq: int = 0
+        self._new_entry: asyncio.Event | None = None
+
+    def append(self, message: Message) -> int:
+        self.last_seq += 1
+        self.entries.append(LogEntry(self.last_seq, message))
+        if self._new_entry is not None:
+            self._new_entry.set()
+            self._new_entry = None
+        return self.last_seq
+
+    def since(self, cursor: int, limit: int | None = None) -> list[LogEntry]:
+        """序号大于 cursor 的记录（已被挤出缓冲区的记录会被跳过）"""
+        if cursor >= self.last_seq or not self.entries:
+            return []
+        start = max(0, cursor - self.entries[0].seq + 1)
+        stop = len(self.entries) if limit is None else min(len(self.entries), start + limit)
+        return [self.entries[i] for i in range(start, stop)]
+
+    async def wait(self, cursor: int, timeout: float | None = None) -> bool:
+        """等待序号大于 cursor 的记录出现，超时返回 False"""
+        if self.last_seq > cursor:
+            return True
+        if self._new_entry is None:
+            self._new_entry = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._new_entry.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
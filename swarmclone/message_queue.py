@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter, deque
+from typing import TYPE_CHECKING, Any
+from .constants import MessageType, OverflowPolicy
+
+if TYPE_CHECKING:
+    from .messages import Message
+
+class MessageQueue(asyncio.Queue):
+    """
+    带溢出策略和信号优先通道的模块消息队列
+    可为每种消息类型单独指定队列满时的处理方式（见 OverflowPolicy），
+    被丢弃的消息按类型计入 dropped。
+    信号型消息（MessageType.SIGNAL）走单独的优先通道：总是先于数据型消息被取出，
+    不占用队列容量，也不会被丢弃
+    """
+    def __init__(self, maxsize: int = 0,
+                 default_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+                 policies: dict[type[Message], OverflowPolicy] | None = None):
+        super().__init__(maxsize)
+        self.default_policy = default_policy
+        self.policies: dict[type[Message], OverflowPolicy] = dict(policies or {})
+        self.dropped: Counter[str] = Counter() # 消息类名 -> 丢弃数量
+
+    def _init(self, maxsize: int):
+        super()._init(maxsize) # type: ignore
+        self._signals: deque[Message] = deque()
+
+    def _put(self, item: Message):
+        if item.message_type is MessageType.SIGNAL:
+            self._signals.append(item)
+        else:
+            self._queue.append(item) # type: ignore
+
+    def _get(self) -> Message:
+        if self._signals:
+            return self._signals.popleft()
+        return self._queue.popleft() # type: ignore
+
+    def _enqueue(self, item: Message):
+        """不检查容量直接放入（同 asyncio.Queue.put_nowait 的后半部分）"""
+        self._put(item)
+        self._unfinished_tasks += 1 # type: ignore
+        self._finished.clear() # type: ignore
+        self._wakeup_next(self._getters) # type: ignore
+
+    def qsize(self) -> int:
+        return len(self._signals) + len(self._queue) # type: ignore
+
+    def empty(self) -> bool:
+        return not (self._signals or self._queue) # type: ignore
+
+    def full(self) -> bool:
+        """只有数据通道会满"""
+        return 0 < self.maxsize <= len(self._queue) # type: ignore
+
+    def transfer_to(self, other: MessageQueue) -> int:
+        """把全部消息按原顺序移入另一个队列（不检查容量、不丢弃），返回移动的数量；等待放入本队列的协程会被唤醒"""
+        count = 0
+        while not self.empty():
+            other._enqueue(self.get_nowait())
+            count += 1
+        return count
+
+    async def hand_over(self, other: MessageQueue) -> int:
+        """
+        同 transfer_to，并等待已在等待放入本队列的协程（包括被 transfer_to 唤醒、尚未运行的）放入后一并移走，
+        返回移动的数量；之后不应再有协程向本队列放入消息
+        """
+        moved = self.transfer_to(other)
+        while True:
+            waiting = len(self._putters) # type: ignore
+            await asyncio.sleep(0) # 让被唤醒的协程放入消息
+            count = self.transfer_to(other)
+            moved += count
+            if not waiting and not count:
+                return moved
+
+    def set_policy(self, message_class: type[Message] | None, policy: OverflowPolicy):
+        """设置某种消息的溢出策略，message_class 为 None 时设置默认策略"""
+        if message_class is None:
+            self.default_policy = policy
+        else:
+            self.policies[message_class] = policy
+
+    def get_policy(self, message: Message) -> OverflowPolicy:
+        if self.policies:
+            for cls in type(message).__mro__: # 子类未指定时沿用父类的策略
+                if (policy := self.policies.get(cls)) is not None:
+                    return policy
+        return self.default_policy
+
+    def _drop(self, message: Message):
+        self.dropped[type(message).__name__] += 1
+
+    def _remove_at(self, index: int) -> Any:
+        message = self._queue[index] # type: ignore
+        del self._queue[index] # type: ignore
+        self._unfinished_tasks -= 1 # type: ignore
+        if self._unfinished_tasks == 0: # type: ignore
+            self._finished.set() # type: ignore
+        return message
+
+    def _try_coalesce(self, message: Message) -> bool:
+        """若队列中已有同类型消息，则原位替换为新消息"""
+        for i, queued in enumerate(self._queue): # type: ignore
+            if type(queued) is type(message):
+                self._queue[i] = message # type: ignore
+                self._drop(queued)
+                return True
+        return False
+
+    def _try_drop_oldest(self) -> bool:
+        """丢弃队列中最早的一条非阻塞策略的消息"""
+        for i, queued in enumerate(self._queue): # type: ignore
+            if self.get_policy(queued) is not OverflowPolicy.BLOCK:
+                self._drop(self._remove_at(i))
+                return True
+        return False
+
+    def _offer(self, message: Message, policy: OverflowPolicy) -> bool:
+        """
+        按非阻塞策略尝试放入消息
+        返回 True 表示已处理（放入、合并或丢弃），False 表示需要按阻塞方式等待
+        """
+        if message.message_type is MessageType.SIGNAL:
+            self._enqueue(message)
+            return True
+        if policy is OverflowPolicy.COALESCE_LATEST and self._try_coalesce(message):
+            return True
+        if not self.full():
+            self._enqueue(message)
+            return True
+        match policy:
+            case OverflowPolicy.BLOCK:
+                return False
+            case OverflowPolicy.DROP_OLDEST | OverflowPolicy.COALESCE_LATEST:
+                if self._try_drop_oldest():
+                    self._enqueue(message)
+                else: # 队列中全是不可丢弃的消息，只能丢弃新消息
+                    self._drop(message)
+            case OverflowPolicy.DROP_NEWEST:
+                self._drop(message)
+        return True
+
+    async def put(self, item: Message) -> None:
+        if not self._offer(item, self.get_policy(item)):
+            await super().put(item)
+
+    def put_nowait(self, item: Message) -> None:
+        if not self._offer(item, self.get_policy(item)):
+            raise asyncio.QueueFull
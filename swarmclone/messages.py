@@ -3,40 +3,60 @@ from __future__ import annotations # 为了延迟注解评估
 import time
 from typing import TYPE_CHECKING, Any
 from .constants import MessageType, ModuleRoles
+from .tracing import new_trace_id, tracer
+from . import log
+from .log import logger, bus_sampler
 from .utils import *
 
 if TYPE_CHECKING:
     from .module_manager import ModuleBase  # 使用延迟导入解决循环依赖
 
 class Message:
+    def __init_subclass__(cls, **kwargs: Any):
+        super().__init_subclass__(**kwargs)
+        message_classes[cls.__name__] = cls
+
     def __init__(self, message_type: MessageType,
-                 source: ModuleBase, destinations: list[ModuleRoles],
-                 **kwargs: Any):
+                 source: ModuleBase, destinations: list[ModuleRoles | ModuleBase],
+                 trace_id: str | None = None, **kwargs: Any):
         self.message_type: MessageType = message_type # 消息类型，数据型/信号型
         self.kwargs: dict[str, Any] = kwargs # 消息内容
         self.source: ModuleBase = source # 消息来源，发送者对象
-        self.destinations: list[ModuleRoles] = destinations # 消息目标，发送到哪几个角色中 ## TODO：支持精确到模块的消息目标
+        self.destinations: list[ModuleRoles | ModuleBase] = destinations # 消息目标，可以是角色（发送给该角色下订阅了此消息的模块）或具体的模块
         self.getters: list[dict[str, str | int]] = [] # 获取了信息的模块名
-        print(f"{source} -> {self} -> {destinations}")
+        self.trace_id: str | None = trace_id # 所属轮次，见 tracing.py
+        if log.debug_enabled and bus_sampler():
+            logger.opt(lazy=True).debug("{} -> {} -> {}", lambda: source, lambda: self, lambda: destinations)
         self.send_time = int(time.time())
+        self.created_ns: int = time.monotonic_ns() # 单调时钟的创建时间（纳秒），用于测量延迟
     
     def __repr__(self):
-        kwrepr = "{"
-        for k, v in self.kwargs.items():
-            if len(repr(v)) > 50:
-                v = repr(v)[:50] + "..."
-            kwrepr += f"{k}: {v}, "
-        kwrepr = kwrepr[:-2] + "}"
-        return f"{self.message_type.value} {kwrepr}"
+        kwrepr = ", ".join(f"{k}: {summarize_value(v)}" for k, v in self.kwargs.items())
+        return f"{self.message_type.value} {{{kwrepr}}}"
     
+    def to(self, *destinations: ModuleRoles | ModuleBase) -> Message:
+        """改写消息目标（可精确到模块），返回消息本身以便链式调用"""
+        self.destinations = list(destinations)
+        return self
+
+    def get_destination_names(self) -> list[str]:
+        return [
+            destination.value if isinstance(destination, ModuleRoles) else destination.name
+            for destination in self.destinations
+        ]
+
     def get_value(self, getter: ModuleBase) -> dict[str, Any]:
-        if not getter.role in self.destinations:
-            print(f"{getter} <x {self} (-> {[destination.value for destination in self.destinations]})")
+        if getter.role not in self.destinations and getter not in self.destinations:
+            logger.opt(lazy=True).warning(
+                "{} <x {} (-> {})", lambda: getter, lambda: self, lambda: self.get_destination_names()
+            )
             return {}
-        print(f"{getter} <- {self}")
+        if log.debug_enabled and bus_sampler():
+            logger.opt(lazy=True).debug("{} <- {}", lambda: getter, lambda: self)
         self.getters.append({
             'name': getter.name,
-            'time': int(time.time())
+            'time': int(time.time()),
+            'time_ns': time.monotonic_ns()
         })
         return self.kwargs
     
@@ -45,32 +65,38 @@ class Message:
         {
             "message_name": "【信息名】",
             "send_time": 【发送时间戳，整数】,
+            "created_ns": 【发送时的单调时钟时间，纳秒】,
+            "trace_id": "【所属轮次，可能为null】",
             "message_type": "【信息类型，DATA或者SIGNAL】",
             "message_source": "【消息来源模块名】",
             "message_destinations": [
                 "【消息目的地名】"
             ],
             "message": [
-                {"key": "键", "value": "值"},...
+                {"key": "键", "value": "值（字节串只给出长度）"},...
             ],
             "getters": [
-                {"name": "【获取者名】", "time": 【获取时间戳，整数】},...
+                {"name": "【获取者名】", "time": 【获取时间戳，整数】, "time_ns": 【获取时的单调时钟时间，纳秒】},...
             ]
         }
         """
         return {
             "message_name": get_type_name(self),
             "send_time": self.send_time,
+            "created_ns": self.created_ns,
+            "trace_id": self.trace_id,
             "message_type": self.message_type.value,
             "message_source": self.source.name,
-            "message_destinations": [destination.value for destination in self.destinations],
+            "message_destinations": self.get_destination_names(),
             "message": [
-                {"key": k, "value": repr(v)}
+                {"key": k, "value": f"<{len(v)} bytes>" if isinstance(v, (bytes, bytearray, memoryview)) else repr(v)}
                 for k, v in self.kwargs.items()
             ],
             "getters": self.getters
         }
 
+message_classes: dict[str, type[Message]] = {} # 所有消息类型，按类名索引
+
 class ASRActivated(Message):
     """
     语音活动激活信号，用于打断正在播放的语音和正在生成的回复
@@ -94,19 +120,22 @@ class ASRMessage(Message):
             MessageType.DATA,
             source,
             destinations=[ModuleRoles.LLM, ModuleRoles.FRONTEND],
+            trace_id=new_trace_id(),
             speaker_name=speaker_name,
             message=message
         )
+        tracer.start(self.trace_id, type(self).__name__, self.created_ns) # 语音结束，开启新的轮次
 
 class LLMEOS(Message):
     """
     LLM 生成结束信号
     """
-    def __init__(self, source: ModuleBase):
+    def __init__(self, source: ModuleBase, trace_id: str | None = None):
         super().__init__(
             MessageType.SIGNAL,
             source,
             destinations=[ModuleRoles.FRONTEND, ModuleRoles.TTS],
+            trace_id=trace_id,
             name="LLMEOS"
         )
 
@@ -117,11 +146,13 @@ class LLMMessage(Message):
     .id：消息的 id（uuid）
     .emotion：情感信息。含有like disgust anger happy sad neutral五个情感的概率
     """
-    def __init__(self, source: ModuleBase, content: str, id: str, emotion: dict[str, float]):
+    def __init__(self, source: ModuleBase, content: str, id: str, emotion: dict[str, float],
+                 trace_id: str | None = None):
         super().__init__(
             MessageType.DATA,
             source,
             destinations=[ModuleRoles.FRONTEND, ModuleRoles.TTS],
+            trace_id=trace_id,
             content=content,
             id=id,
             emotion=emotion
@@ -150,12 +181,14 @@ class TTSAlignedAudio(Message):
                  source: ModuleBase, 
                  id: str, 
                  audio_data: bytes, 
-                 align_data: list[dict[str, str | float]]
+                 align_data: list[dict[str, str | float]],
+                 trace_id: str | None = None
                  ):
         super().__init__(
             MessageType.DATA,
             source,
             destinations=[ModuleRoles.FRONTEND],
+            trace_id=trace_id,
             id=id,
             data=audio_data,
             align_data=align_data
@@ -172,9 +205,11 @@ class ChatMessage(Message):
             MessageType.DATA,
             source,
             destinations=[ModuleRoles.LLM, ModuleRoles.FRONTEND],
+            trace_id=new_trace_id(),
             user=user,
             content=content
         )
+        tracer.start(self.trace_id, type(self).__name__, self.created_ns) # 弹幕到达，开启新的轮次
 
 class SongInfo(Message):
     """
@@ -0,0 +1,106 @@
+"""
+极简的 Prometheus 文本格式指标
+记录指标只是一次字典读写，渲染（格式化）只在 /api/metrics 被请求时进行，因此可以在生产环境中常开。
+"""
+from __future__ import annotations
+
+from bisect import bisect_left
+from typing import Any
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(labelnames: tuple[str, ...], labels: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    type_name: str = "untyped"
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[tuple[str, ...], Any] = {}
+        registry.register(self)
+
+    def clear(self):
+        self.values.clear()
+
+    def render_samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self.values.items()
+        ]
+
+    def render(self) -> str:
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self.render_samples()
+        ])
+
+class Counter(Metric):
+    type_name = "counter"
+    def inc(self, amount: float = 1, labels: tuple[str, ...] = ()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set_total(self, value: float, labels: tuple[str, ...] = ()):
+        """由别处累计的计数在采集时直接写入"""
+        self.values[labels] = value
+
+class Gauge(Metric):
+    type_name = "gauge"
+    def set(self, value: float, labels: tuple[str, ...] = ()):
+        self.values[labels] = value
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram(Metric):
+    type_name = "histogram"
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, labels: tuple[str, ...] = ()):
+        if (state := self.values.get(labels)) is None:
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0] # 各桶计数、总和、次数
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render_samples(self) -> list[str]:
+        lines: list[str] = []
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        assert metric.name not in self.metrics, f"指标 {metric.name} 重复注册"
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+registry = Registry()
+
+# 主控相关的通用指标
+messages_total = Counter("swarmclone_messages_total", "Messages dispatched by the controller", ("message",))
+task_queue_depth = Gauge("swarmclone_task_queue_depth", "Messages waiting in a module's task_queue", ("module",))
+results_queue_depth = Gauge("swarmclone_results_queue_depth", "Messages waiting in a module's results_queue", ("module",))
+queue_dropped_total = Counter("swarmclone_queue_dropped_total", "Messages dropped by task_queue overflow policies", ("module", "message"))
+interrupt_latency_seconds = Histogram(
+    "swarmclone_interrupt_latency_seconds", "Time from ASRActivated creation to playback/synthesis stop", ("module",)
+)
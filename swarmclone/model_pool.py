@@ -0,0 +1,189 @@
+"""
+进程内的模型池
+/api/start 会重新构造所有模块，模块通过模型池获取加载较慢的资源（模型权重、识别器等），
+只要与加载相关的配置（模型路径、量化、设备、fp16 等）不变，重启或修改其他配置时即可直接复用已加载的模型。
+模型池按最近使用顺序（LRU）淘汰：条目数超过上限，或可用内存（显存）低于阈值时，淘汰最久未用的条目。
+淘汰只是去掉模型池的引用，仍在使用该模型的模块不受影响，模块被丢弃后内存才会真正释放。
+注意：子进程（process_worker.py）中的模块每次都会重新加载，远程节点上的模块复用见 remote.py。
+"""
+from __future__ import annotations
+
+import gc
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, TypeVar
+from .metrics import Counter, Gauge
+from .log import logger
+
+T = TypeVar("T")
+MISSING: Any = object()
+
+model_pool_hits_total = Counter("swarmclone_model_pool_hits_total", "Model pool lookups served from memory", ("kind",))
+model_pool_loads_total = Counter("swarmclone_model_pool_loads_total", "Models loaded into the model pool", ("kind",))
+model_pool_evictions_total = Counter("swarmclone_model_pool_evictions_total", "Models evicted from the model pool", ("kind",))
+model_pool_entries = Gauge("swarmclone_model_pool_entries", "Models currently held by the model pool")
+
+def available_memory() -> int | None:
+    """可用内存（字节），无法获取时返回 None"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def available_gpu_memory() -> int | None:
+    """当前 CUDA 设备的可用显存（字节），未导入 torch 或没有 CUDA 时返回 None"""
+    if (torch := sys.modules.get("torch")) is None: # 不为此导入 torch
+        return None
+    try:
+        if not torch.cuda.is_available():
+            return None
+        free, _total = torch.cuda.mem_get_info()
+        return free
+    except Exception:
+        return None
+
+def estimate_size(value: Any) -> int | None:
+    """估计模型占用的字节数（仅统计 torch 模型的参数），无法估计时返回 None"""
+    if isinstance(value, (tuple, list)):
+        sizes = [size for item in value if (size := estimate_size(item)) is not None]
+        return sum(sizes) if sizes else None
+    if callable(parameters := getattr(value, "parameters", None)):
+        try:
+            return sum(p.numel() * p.element_size() for p in parameters())
+        except Exception:
+            return None
+    if (model := getattr(value, "model", None)) is not None and model is not value: # 如 CosyVoice 实例
+        return estimate_size(model)
+    return None
+
+class PoolEntry:
+    def __init__(self, value: Any, load_time: float):
+        self.value = value
+        self.load_time = load_time
+        self.size = estimate_size(value)
+        self.hits = 0
+        self.last_used = time.time()
+
+class ModelPool:
+    def __init__(self, max_entries: int = 6, min_free_memory: int = 1 << 30, min_free_gpu_memory: int = 512 << 20):
+        """
+        max_entries: 最多保留的模型数
+        min_free_memory: 可用内存低于此值（字节）时淘汰最久未用的模型
+        min_free_gpu_memory: 可用显存低于此值（字节）时淘汰最久未用的模型
+        """
+        self.max_entries = max_entries
+        self.min_free_memory = min_free_memory
+        self.min_free_gpu_memory = min_free_gpu_memory
+        self.entries: OrderedDict[tuple[Hashable, ...], PoolEntry] = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading: dict[tuple[Hashable, ...], threading.Lock] = {} # 正在加载的键，同一个键只加载一次
+
+    def get(self, key: tuple[Hashable, ...], loader: Callable[[], T]) -> T:
+        """
+        获取 key 对应的模型，不存在时调用 loader 加载
+        key 的第一项为模型种类（用于统计），其余为与加载相关的配置；可在多个线程中同时调用，不同的键并行加载
+        """
+        with self.lock:
+            if (value := self.hit(key)) is not MISSING:
+                return value
+            key_lock = self.loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                if (value := self.hit(key)) is not MISSING: # 等待期间已被其他线程加载
+                    return value
+            self.evict() # 内存紧张时先腾出空间
+            start = time.perf_counter()
+            try:
+                value = loader()
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+            entry = PoolEntry(value, time.perf_counter() - start)
+            with self.lock:
+                self.entries[key] = entry
+                model_pool_loads_total.inc(1, (str(key[0]),))
+                model_pool_entries.set(len(self.entries))
+            logger.debug("模型池加载 {}，用时 {:.2f} 秒", key, entry.load_time)
+            self.evict(keep=key)
+        return value
+
+    def hit(self, key: tuple[Hashable, ...]) -> Any:
+        """调用时需持有 self.lock，不存在时返回 MISSING"""
+        if (entry := self.entries.get(key)) is None:
+            return MISSING
+        self.entries.move_to_end(key)
+        entry.hits += 1
+        entry.last_used = time.time()
+        model_pool_hits_total.inc(1, (str(key[0]),))
+        logger.debug("模型池命中 {}", key)
+        return entry.value
+
+    def memory_tight(self) -> bool:
+        free = available_memory()
+        if free is not None and free < self.min_free_memory:
+            return True
+        free_gpu = available_gpu_memory()
+        return free_gpu is not None and free_gpu < self.min_free_gpu_memory
+
+    def evict(self, keep: tuple[Hashable, ...] | None = None):
+        """按最近使用顺序淘汰，直到条目数和可用内存满足要求（keep 不会被淘汰）"""
+        evicted = 0
+        while True:
+            with self.lock:
+                if len(self.entries) <= self.max_entries and not self.memory_tight():
+                    break
+                victim = next((key for key in self.entries if key != keep), None)
+                if victim is None:
+                    break
+                del self.entries[victim]
+                model_pool_evictions_total.inc(1, (str(victim[0]),))
+                model_pool_entries.set(len(self.entries))
+            logger.info("模型池淘汰 {}", victim)
+            evicted += 1
+            self.collect_garbage()
+        if evicted:
+            logger.info("模型池共淘汰 {} 个模型，剩余 {} 个", evicted, len(self.entries))
+
+    @staticmethod
+    def collect_garbage():
+        gc.collect()
+        if (torch := sys.modules.get("torch")) is not None:
+            try:
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except Exception:
+                pass
+
+    def clear(self):
+        with self.lock:
+            for key in self.entries:
+                model_pool_evictions_total.inc(1, (str(key[0]),))
+            self.entries.clear()
+            model_pool_entries.set(0)
+        self.collect_garbage()
+
+    def get_stats(self) -> list[dict[str, Any]]:
+        with self.lock:
+            return [
+                {
+                    "kind": key[0],
+                    "key": [str(part) for part in key[1:]],
+                    "size": entry.size,
+                    "load_time": entry.load_time,
+                    "hits": entry.hits,
+                    "last_used": entry.last_used
+                }
+                for key, entry in reversed(self.entries.items()) # 最近使用的在前
+            ]
+
+model_pool = ModelPool()
@@ -1,8 +1,15 @@
-from typing import Any
+from typing import Any, Coroutine, TypeVar
 from .constants import *
 from .messages import *
+from .message_queue import MessageQueue
+from .metrics import interrupt_latency_seconds
+from .log import logger
 from dataclasses import dataclass
+from collections import deque
 import asyncio
+import time
+
+_T = TypeVar("_T")
 
 class ModuleManager(type):
     def __new__(cls, name: str, bases: tuple[type, ...], attrs: dict[str, Any]):
@@ -10,7 +17,7 @@ class ModuleManager(type):
         new_class = super().__new__(cls, name, bases, attrs)
         if name != "ModuleBase" and attrs["role"] not in [ModuleRoles.CONTROLLER]:
             assert attrs["role"] != ModuleRoles.UNSPECIFIED, "请指定模块角色"
-            print(f"Registering module {name}")
+            logger.debug("Registering module {}", name)
             module_classes[attrs["role"]][name] = new_class
         return new_class
 
@@ -24,12 +31,25 @@ class ModuleBase(metaclass=ModuleManager):
     role: ModuleRoles = ModuleRoles.UNSPECIFIED
     config_class = ModuleConfig
     name: str = "ModuleBase" # 会由metaclass自动赋值为类名
+    subscriptions: tuple[type[Message], ...] | None = None # 接收的消息类型，None表示接收所有发往本角色的消息
+    queue_policy: OverflowPolicy = OverflowPolicy.BLOCK # task_queue 满时的默认处理策略
+    queue_policies: dict[type[Message], OverflowPolicy] = {} # 按消息类型覆盖 queue_policy
+    run_in_process: bool = False # 是否默认在独立子进程中运行（见 process_worker.py）
+    load_in_thread: bool = True # 是否可以在线程池中构造，必须在主线程中初始化的模块（如使用 Qt 的模块）应设为 False
+    restart_on_failure: bool = True # 运行出错时是否由主控自动重启（带退避）
     def __init__(self, config: config_class | None = None, **kwargs):
         self.config = self.config_class(**kwargs) if config is None else config
-        self.task_queue: asyncio.Queue[Message] = asyncio.Queue(maxsize=128)
+        self.task_queue: MessageQueue = MessageQueue(
+            maxsize=128,
+            default_policy=self.queue_policy,
+            policies=self.queue_policies
+        )
         self.results_queue: asyncio.Queue[Message] = asyncio.Queue(maxsize=128)
         self.running = False
         self.err: BaseException | None = None
+        self.interrupt_latencies: deque[float] = deque(maxlen=100) # 最近的打断延迟（毫秒）
+        self.logger = logger.bind(module=self.name)
+        self.child_tasks: set[asyncio.Task[Any]] = set() # 由 create_task 创建、随模块一起停止的任务
     
     async def run(self) -> None:
         while True:
@@ -45,6 +65,35 @@ class ModuleBase(metaclass=ModuleManager):
     def __repr__(self):
         return f"<{self.role} {self.name}>"
 
+    def create_task(self, coro: Coroutine[Any, Any, _T], name: str | None = None) -> asyncio.Task[_T]:
+        """创建属于本模块的任务，单独停止或重启本模块时会被一并取消"""
+        task = asyncio.get_running_loop().create_task(coro, name=f"{self.name}: {name or coro.__qualname__}")
+        self.child_tasks.add(task)
+        task.add_done_callback(self.child_tasks.discard)
+        return task
+
+    async def cancel_child_tasks(self):
+        tasks = [task for task in self.child_tasks if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def record_interrupt(self, signal: Message):
+        """记录从打断信号产生到本模块完成打断（停止播放/生成）的延迟"""
+        self.record_interrupt_latency((time.monotonic_ns() - signal.created_ns) / 1e9)
+
+    def record_interrupt_latency(self, latency: float):
+        self.interrupt_latencies.append(latency * 1000)
+        interrupt_latency_seconds.observe(latency, (self.name,))
+
+    def collect_metrics(self):
+        """/api/metrics 被请求时调用，用于更新只需在采集时计算的指标"""
+
+    @classmethod
+    def accepts(cls, message_class: type[Message]) -> bool:
+        """是否订阅了某种消息"""
+        return cls.subscriptions is None or issubclass(message_class, cls.subscriptions)
+
     @classmethod
     def get_config_schema(cls) -> dict[str, Any]:
         """
@@ -93,10 +142,22 @@ class ModuleBase(metaclass=ModuleManager):
             required = field.metadata.get("required", False)
             desc = field.metadata.get("desc", "")
             options = field.metadata.get("options", [])
+            if callable(options): # 需要联网或导入较重的库才能获得的选项，在此时才获取
+                try:
+                    options = options()
+                except Exception as e:
+                    logger.warning("获取模块 {} 配置项 {} 的选项失败：{}", cls.name, name, e)
+                    options = []
             
+            if field.default_factory is not MISSING:
+                try:
+                    default = field.default_factory()
+                except Exception as e:
+                    logger.warning("获取模块 {} 配置项 {} 的默认值失败：{}", cls.name, name, e)
+                    default = None
             if field.default is not MISSING and (default := field.default) is not None:
                 pass
-            elif field.default_factory is not MISSING and (default := field.default_factory()) is not None:
+            elif field.default_factory is not MISSING and default is not None:
                 pass
             else:  # 无默认值则生成对应类型的空值
                 if _type == "str":
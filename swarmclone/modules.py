@@ -1,9 +1,18 @@
 from __future__ import annotations # 为了延迟注解评估
 import asyncio
+import time
 from dataclasses import dataclass, field
 from .constants import *
 from .messages import *
 from .module_manager import *
+from .tracing import tracer
+from .metrics import Counter, Histogram
+
+tts_sentences_total = Counter("swarmclone_tts_sentences_total", "Sentences synthesised by TTS", ("module",))
+tts_real_time_factor = Histogram(
+    "swarmclone_tts_real_time_factor", "TTS synthesis time divided by generated audio duration", ("module",),
+    buckets=(0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0)
+)
 
 class ControllerDummy(ModuleBase):
     role: ModuleRoles = ModuleRoles.CONTROLLER
@@ -11,30 +20,53 @@ class ControllerDummy(ModuleBase):
 
 class TTSBase(ModuleBase):
     role: ModuleRoles = ModuleRoles.TTS
+    subscriptions = (LLMMessage, ASRActivated)
     def __init__(self, config: ModuleConfig | None = None, **kwargs):
         super().__init__(config, **kwargs)
         self.processed_queue: asyncio.Queue[Message] = asyncio.Queue(128)
+        self.generate_task: asyncio.Task[TTSAlignedAudio] | None = None
 
     async def run(self):
-        loop = asyncio.get_running_loop()
-        loop.create_task(self.preprocess_tasks())
-        while True:
-            task = await self.processed_queue.get()
-            if isinstance(task, LLMMessage): # 是一个需要处理的句子
-                id = task.get_value(self).get("id", None)
-                content = task.get_value(self).get("content", None)
-                emotions = task.get_value(self).get("emotion", None)
-                assert isinstance(id, str)
-                assert isinstance(content, str)
-                assert isinstance(emotions, dict)
-                await self.results_queue.put(await self.generate_sentence(id, content, emotions))
+        self.create_task(self.preprocess_tasks())
+        try:
+            while True:
+                task = await self.processed_queue.get()
+                if isinstance(task, LLMMessage): # 是一个需要处理的句子
+                    value = task.get_value(self)
+                    id = value.get("id", None)
+                    content = value.get("content", None)
+                    emotions = value.get("emotion", None)
+                    assert isinstance(id, str)
+                    assert isinstance(content, str)
+                    assert isinstance(emotions, dict)
+                    start_time = time.perf_counter()
+                    self.generate_task = self.create_task(self.generate_sentence(id, content, emotions))
+                    await asyncio.wait((self.generate_task,))
+                    if self.generate_task.cancelled(): # 生成被打断
+                        continue
+                    result = self.generate_task.result()
+                    tts_sentences_total.inc(1, (self.name,))
+                    if (duration := sum(float(item["duration"]) for item in result.kwargs["align_data"])) > 0:
+                        tts_real_time_factor.observe((time.perf_counter() - start_time) / duration, (self.name,))
+                    result.trace_id = task.trace_id
+                    tracer.mark(task.trace_id, "tts")
+                    await self.results_queue.put(result)
+        finally:
+            if self.generate_task is not None:
+                self.generate_task.cancel()
 
     async def preprocess_tasks(self) -> None:
         while True:
             task = await self.task_queue.get()
             if isinstance(task, ASRActivated):
+                interrupted = not self.processed_queue.empty()
                 while not self.processed_queue.empty():
                     self.processed_queue.get_nowait() # 确保没有句子还在生成
+                if self.generate_task is not None and not self.generate_task.done():
+                    self.generate_task.cancel() # 停止正在生成的句子
+                    interrupted = True
+                if interrupted: # 空闲时收到的信号不计入打断延迟
+                    self.record_interrupt(task)
             else:
                 await self.processed_queue.put(task)
 
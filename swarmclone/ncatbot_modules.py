@@ -1,9 +1,5 @@
 from __future__ import annotations
-try:
-    from ncatbot.core import BotClient, GroupMessage
-    available = True
-except ImportError:
-    available = False
+from typing import TYPE_CHECKING
 from dataclasses import dataclass, field
 from .constants import *
 from .messages import *
@@ -11,6 +7,9 @@ from .modules import *
 import asyncio
 import random
 
+if TYPE_CHECKING:
+    from ncatbot.core import GroupMessage
+
 @dataclass
 class NCatBotChatConfig(ModuleConfig):
     target_group_id: str = field(default="", metadata={
@@ -45,7 +44,10 @@ class NCatBotChat(ModuleBase):
     config: config_class
     def __init__(self, config: config_class | None = None, **kwargs):
         super().__init__(config, **kwargs)
-        assert available, "NCatBotChat requires ncatbot to be installed"
+        try:
+            from ncatbot.core import BotClient
+        except ImportError:
+            raise ImportError("NCatBotChat requires ncatbot to be installed")
         self.bot = BotClient()
         self.target_group_id = self.config.target_group_id
         self.bot_id = self.config.bot_id
@@ -125,6 +127,7 @@ class NCatBotFrontendConfig(ModuleConfig):
 class NCatBotFrontend(ModuleBase):
     role: ModuleRoles = ModuleRoles.FRONTEND
     config_class = NCatBotFrontendConfig
+    subscriptions = (LLMMessage, LLMEOS) # 不需要音频
     config: config_class
     """接受LLM的信息并发送到目标群中"""
     def __init__(self, config: config_class | None = None, **kwargs):
@@ -0,0 +1,29 @@
+"""
+远程模块节点入口（见 remote.py）
+python -m swarmclone.node [--host 0.0.0.0] [--port 8010] [--token 令牌] [--import my_module ...]
+默认只监听本机；监听其他地址时请确保令牌足够长且不被泄露，主控需设置相同的环境变量 SWARMCLONE_NODE_TOKEN
+"""
+import argparse
+import asyncio
+import importlib
+import os
+from . import *
+from .remote import RemoteNode, DEFAULT_PORT, TOKEN_ENV
+
+def main():
+    parser = argparse.ArgumentParser(description="SwarmClone 远程模块节点")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--token", default=os.environ.get(TOKEN_ENV, ""),
+                        help=f"主控连接时需提供的令牌，默认读取环境变量 {TOKEN_ENV}")
+    parser.add_argument("--import", dest="imports", action="append", default=[],
+                        help="额外导入的 Python 模块（自定义模块所在的文件），可多次指定")
+    args = parser.parse_args()
+    if not args.token:
+        parser.error(f"必须通过 --token 或环境变量 {TOKEN_ENV} 设置令牌")
+    for name in args.imports:
+        importlib.import_module(name)
+    asyncio.run(RemoteNode(args.token, args.host, args.port).serve_forever())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+在独立子进程中运行模块
+主控中只保留一个代理模块（ProcessModule），它拥有和原模块相同的名字、角色、订阅和队列策略，
+负责把 task_queue 中的消息转发给子进程、把子进程产生的结果放回 results_queue。
+子进程中运行真正的模块，其推理/渲染不再与主控和其他模块争抢 GIL 和事件循环。
+
+进程间通过 multiprocessing.Pipe 传递消息头（小对象，pickle），
+较大的字节串（如 TTS 音频）放入共享内存，只传递共享内存名，接收方复制后通知发送方释放。
+子进程中的 tracer 记录和打断延迟会转发回主进程；模块自己定义的其他指标仍只存在于子进程中。
+"""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import threading
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable
+from .constants import *
+from .messages import *
+from .module_manager import ModuleBase, ModuleConfig
+from .tracing import tracer
+from .log import logger
+
+SHM_THRESHOLD = 64 * 1024 # 不小于此长度的字节串通过共享内存传递
+
+class ModuleRef:
+    """另一进程中的模块，只有名字和角色，用作消息的来源/目标"""
+    def __init__(self, name: str, role: ModuleRoles):
+        self.name = name
+        self.role = role
+
+    def __repr__(self):
+        return f"<{self.role} {self.name} (remote)>"
+
+Resolver = Callable[[str, ModuleRoles], Any]
+
+def encode_message(message: Message, segments: dict[str, SharedMemory]) -> dict[str, Any]:
+    """将消息编码为可 pickle 的消息头，大块字节串写入共享内存并登记到 segments"""
+    kwargs: dict[str, Any] = {}
+    shared: dict[str, tuple[str, int]] = {}
+    for key, value in message.kwargs.items():
+        if isinstance(value, (bytes, bytearray)) and len(value) >= SHM_THRESHOLD:
+            shm = SharedMemory(create=True, size=len(value))
+            shm.buf[:len(value)] = value
+            segments[shm.name] = shm
+            shared[key] = (shm.name, len(value))
+        else:
+            kwargs[key] = value
+    return {
+        "class": type(message).__name__,
+        "message_type": message.message_type,
+        "source": (message.source.name, message.source.role),
+        "destinations": [
+            destination if isinstance(destination, ModuleRoles) else (destination.name, destination.role)
+            for destination in message.destinations
+        ],
+        "kwargs": kwargs,
+        "shared": shared,
+        "trace_id": message.trace_id,
+        "send_time": message.send_time,
+        "created_ns": message.created_ns
+    }
+
+def decode_message(header: dict[str, Any], resolve: Resolver) -> Message:
+    """
+    由消息头还原消息（不调用消息类的 __init__，因此不会重复开启 trace 等）
+    共享内存中的数据会被复制出来，随后共享内存即被删除
+    """
+    message_class = message_classes[header["class"]]
+    message = message_class.__new__(message_class)
+    kwargs = header["kwargs"]
+    for key, (name, size) in header["shared"].items():
+        shm = SharedMemory(name=name)
+        try:
+            kwargs[key] = bytes(shm.buf[:size])
+        finally:
+            shm.close()
+            shm.unlink()
+    message.message_type = header["message_type"]
+    message.kwargs = kwargs
+    message.source = resolve(*header["source"])
+    message.destinations = [
+        destination if isinstance(destination, ModuleRoles) else resolve(*destination)
+        for destination in header["destinations"]
+    ]
+    message.getters = []
+    message.trace_id = header["trace_id"]
+    message.send_time = header["send_time"]
+    message.created_ns = header["created_ns"]
+    return message
+
+class MessageChannel:
+    """
+    Pipe 的一端，可在多个线程中发送
+    帧格式：("message", 消息头) / ("release", [共享内存名]) / ("trace", 方法名, 参数)
+    / ("interrupt", 延迟秒数) / ("ready",) / ("stop",) / ("exit", 错误信息或None)
+    """
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.segments: dict[str, SharedMemory] = {} # 已发出、对方尚未复制的共享内存
+
+    def send(self, frame: tuple[Any, ...]):
+        with self.send_lock:
+            self.conn.send(frame)
+
+    def send_message(self, message: Message):
+        self.send(("message", encode_message(message, self.segments)))
+
+    def receive_message(self, header: dict[str, Any], resolve: Resolver) -> Message:
+        message = decode_message(header, resolve)
+        if header["shared"]:
+            self.send(("release", [name for name, _size in header["shared"].values()]))
+        return message
+
+    def release(self, names: list[str]):
+        for name in names:
+            if (shm := self.segments.pop(name, None)) is not None:
+                shm.close()
+
+    def close(self):
+        """关闭连接并删除对方未读取的共享内存"""
+        for shm in self.segments.values():
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.segments.clear()
+        self.conn.close()
+
+class ModuleProxy(ModuleBase):
+    """
+    在别处（子进程、远程节点）运行的模块在主控中的代理
+    名字、角色、订阅和队列策略都与被代理的模块相同
+    """
+    role: ModuleRoles = ModuleRoles.CONTROLLER # 不作为可选模块注册，实际角色见实例属性
+    def __init__(self, module_class: type[ModuleBase], lookup: Callable[[str], ModuleBase | None] | None = None,
+                 config: ModuleConfig | None = None, **kwargs):
+        self.module_class = module_class
+        self.name = module_class.name
+        self.role = module_class.role
+        self.queue_policy = module_class.queue_policy
+        self.queue_policies = module_class.queue_policies
+        self.lookup = lookup # 按名字查找本进程中的模块
+        super().__init__(module_class.config_class(**kwargs) if config is None else config)
+        self.ready = asyncio.Event() # 被代理的模块加载完成
+
+    def accepts(self, message_class: type[Message]) -> bool: # type: ignore
+        return self.module_class.accepts(message_class)
+
+    def resolve(self, name: str, role: ModuleRoles) -> Any:
+        if name == self.name:
+            return self
+        if self.lookup is not None and (module := self.lookup(name)) is not None:
+            return module
+        return ModuleRef(name, role)
+
+    @staticmethod
+    def local_destinations(message: Message) -> Message:
+        """去掉本进程中不存在的目标模块（无法投递）"""
+        message.destinations = [
+            destination for destination in message.destinations
+            if not isinstance(destination, ModuleRef)
+        ]
+        return message
+
+class ProcessModule(ModuleProxy):
+    """子进程中模块的代理"""
+    role: ModuleRoles = ModuleRoles.CONTROLLER
+    def __init__(self, module_class: type[ModuleBase], lookup: Callable[[str], ModuleBase | None] | None = None,
+                 config: ModuleConfig | None = None, **kwargs):
+        super().__init__(module_class, lookup, config, **kwargs)
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self.channel: MessageChannel | None = None
+        self.child_error: str | None = None
+
+    def receive(self, loop: asyncio.AbstractEventLoop, exited: asyncio.Future[None]):
+        """接收线程"""
+        assert self.channel is not None
+        try:
+            while True:
+                frame = self.channel.conn.recv()
+                match frame[0]:
+                    case "message":
+                        message = self.local_destinations(self.channel.receive_message(frame[1], self.resolve))
+                        asyncio.run_coroutine_threadsafe(self.results_queue.put(message), loop).result()
+                    case "release":
+                        self.channel.release(frame[1])
+                    case "trace":
+                        loop.call_soon_threadsafe(getattr(tracer, frame[1]), *frame[2])
+                    case "interrupt":
+                        loop.call_soon_threadsafe(self.record_interrupt_latency, frame[1])
+                    case "ready":
+                        loop.call_soon_threadsafe(self.ready.set)
+                    case "exit":
+                        self.child_error = frame[1]
+                        break
+        except (EOFError, OSError):
+            self.child_error = self.child_error or "子进程意外退出"
+        finally:
+            loop.call_soon_threadsafe(lambda: exited.done() or exited.set_result(None))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(self.module_class, self.config, child_conn),
+            name=f"SwarmClone-{self.name}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.channel = MessageChannel(parent_conn)
+        self.logger.info("已在子进程 {} 中启动", self.process.pid)
+        exited: asyncio.Future[None] = loop.create_future()
+        threading.Thread(target=self.receive, args=(loop, exited), daemon=True).start()
+        try:
+            while True:
+                getter = asyncio.ensure_future(self.task_queue.get())
+                await asyncio.wait((getter, exited), return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    break
+                await asyncio.to_thread(self.channel.send_message, getter.result())
+        finally:
+            await self.shutdown()
+        if self.child_error is not None:
+            raise RuntimeError(f"子进程中的模块出错：{self.child_error}")
+
+    async def shutdown(self):
+        assert self.process is not None and self.channel is not None
+        if self.process.is_alive():
+            try:
+                self.channel.send(("stop",))
+            except OSError:
+                pass
+        # 即使本协程再次被取消，也要等子进程退出后再清理
+        await asyncio.shield(asyncio.to_thread(self.stop_process))
+
+    def stop_process(self):
+        assert self.process is not None and self.channel is not None
+        self.process.join(5)
+        if self.process.is_alive():
+            self.logger.warning("子进程未能及时退出，强制结束")
+            self.process.terminate()
+            self.process.join()
+        self.channel.close()
+
+def worker_main(module_class: type[ModuleBase], config: Any, conn: Connection):
+    """子进程入口"""
+    asyncio.run(serve(module_class, config, conn))
+
+async def serve(module_class: type[ModuleBase], config: Any, conn: Connection):
+    loop = asyncio.get_running_loop()
+    channel = MessageChannel(conn)
+    error: BaseException | None = None
+    try:
+        module = module_class(config)
+    except Exception as e:
+        logger.exception("加载模块 {} 失败：{}", module_class.name, e)
+        channel.send(("exit", repr(e)))
+        channel.close()
+        return
+    tracer.forward = lambda method, args: channel.send(("trace", method, args))
+    module.record_interrupt_latency = lambda latency: channel.send(("interrupt", latency)) # type: ignore
+    refs: dict[str, ModuleRef] = {}
+
+    def resolve(name: str, role: ModuleRoles) -> Any:
+        if name == module.name:
+            return module
+        return refs.setdefault(name, ModuleRef(name, role))
+
+    module_task = asyncio.ensure_future(module.run())
+    channel.send(("ready",))
+
+    def receive():
+        try:
+            while True:
+                frame = conn.recv()
+                match frame[0]:
+                    case "message":
+                        message = channel.receive_message(frame[1], resolve)
+                        asyncio.run_coroutine_threadsafe(module.task_queue.put(message), loop).result()
+                    case "release":
+                        channel.release(frame[1])
+                    case "stop":
+                        break
+        except (EOFError, OSError):
+            pass
+        loop.call_soon_threadsafe(module_task.cancel)
+
+    async def forward():
+        while True:
+            message = await module.results_queue.get()
+            await asyncio.to_thread(channel.send_message, message)
+
+    threading.Thread(target=receive, daemon=True).start()
+    forwarder = asyncio.ensure_future(forward())
+    try:
+        await module_task
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logger.exception("模块 {} 出错：{}", module.name, e)
+        error = e
+    finally:
+        forwarder.cancel()
+    try:
+        while not module.results_queue.empty():
+            channel.send_message(module.results_queue.get_nowait())
+        channel.send(("exit", None if error is None else repr(error)))
+    except OSError: # 主进程已关闭连接
+        pass
+    for shm in channel.segments.values(): # 剩余的共享内存由主进程读取后删除
+        shm.close()
+    channel.segments.clear()
+    conn.close()
+
+__all__ = ["ModuleProxy", "ProcessModule", "ModuleRef", "MessageChannel", "encode_message", "decode_message", "SHM_THRESHOLD"]
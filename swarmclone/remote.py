@@ -0,0 +1,409 @@
+"""
+网络消息总线：让模块运行在另一台机器上
+
+远程机器上运行节点（见 node.py）：python -m swarmclone.node [--host 0.0.0.0] [--port 8010] [--token 令牌] [--import my_module ...]
+主控启动时在 /api/start 的 "remotes" 中为模块指定节点地址，主控中的 RemoteModule 代理会连接节点、
+把令牌、模块名和配置发过去，节点验证令牌并加载模块后双方互相转发消息。
+节点可以按主控发来的配置运行任意模块（如启动 MCP 服务器命令），因此必须设置令牌：
+节点和主控都从环境变量 SWARMCLONE_NODE_TOKEN 读取（节点也可用 --token 指定），令牌不符的连接在加载模块前即被拒绝。
+连接断开后主控按指数退避重连，节点上的模块不会因断线而重新加载（配置不变时）。
+
+帧格式：8 字节头（JSON 头长度、二进制数据长度，均为大端 uint32）+ JSON 头 + 二进制数据，
+消息中的字节串（如音频）原样放在二进制数据部分，不做 base64 编码。
+不同机器的单调时钟不可比，因此消息和 tracer 记录只传递“已经过的时间”，接收方用 RTT/2 估计单程延迟后还原。
+"""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import os
+import struct
+import time
+from collections import deque
+from dataclasses import asdict
+from typing import Any, Callable
+from .constants import *
+from .messages import *
+from .module_manager import ModuleBase, ModuleConfig, module_classes
+from .process_worker import ModuleProxy, ModuleRef
+from .metrics import Counter, Histogram
+from .tracing import tracer
+from .log import logger
+
+DEFAULT_PORT = 8010
+TOKEN_ENV = "SWARMCLONE_NODE_TOKEN"
+PING_INTERVAL = 2.0 # 心跳间隔（秒）
+PING_TIMEOUT = 3 # 连续多少个心跳周期没有回应即认为连接已断开
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 10.0
+FRAME_HEADER = struct.Struct("!II")
+MAX_HELLO_SIZE = 1 << 20 # 验证令牌前只接受这么大的帧
+
+link_rtt_seconds = Histogram(
+    "swarmclone_link_rtt_seconds", "Round-trip time of remote module links", ("module",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+link_bytes_total = Counter("swarmclone_link_bytes_total", "Bytes sent/received on remote module links", ("module", "direction"))
+link_reconnects_total = Counter("swarmclone_link_reconnects_total", "Reconnections of remote module links", ("module",))
+
+class RemoteModuleError(Exception):
+    """远程节点上的模块加载失败或运行出错"""
+
+def pack_frame(header: dict[str, Any], blobs: list[bytes] | None = None) -> list[bytes]:
+    data = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    blobs = blobs or []
+    return [FRAME_HEADER.pack(len(data), sum(len(blob) for blob in blobs)), data, *blobs]
+
+def pack_message(message: Message) -> list[bytes]:
+    """字节串放入二进制部分，其余内容必须能被 JSON 序列化（元组会变成列表）"""
+    kwargs: dict[str, Any] = {}
+    blobs: list[bytes] = []
+    sizes: list[tuple[str, int]] = []
+    for key, value in message.kwargs.items():
+        if isinstance(value, (bytes, bytearray)):
+            blobs.append(value)
+            sizes.append((key, len(value)))
+        else:
+            kwargs[key] = value
+    return pack_frame({
+        "t": "message",
+        "class": type(message).__name__,
+        "type": message.message_type.value,
+        "source": [message.source.name, message.source.role.value],
+        "destinations": [
+            destination.value if isinstance(destination, ModuleRoles) else [destination.name, destination.role.value]
+            for destination in message.destinations
+        ],
+        "kwargs": kwargs,
+        "blobs": sizes,
+        "trace_id": message.trace_id,
+        "send_time": message.send_time,
+        "age_ns": time.monotonic_ns() - message.created_ns
+    }, blobs)
+
+def unpack_message(header: dict[str, Any], payload: memoryview,
+                   resolve: Callable[[str, ModuleRoles], Any], one_way_ns: int) -> Message:
+    message_class = message_classes[header["class"]]
+    message = message_class.__new__(message_class)
+    kwargs = header["kwargs"]
+    offset = 0
+    for key, size in header["blobs"]:
+        kwargs[key] = bytes(payload[offset:offset + size])
+        offset += size
+    message.message_type = MessageType(header["type"])
+    message.kwargs = kwargs
+    message.source = resolve(header["source"][0], ModuleRoles(header["source"][1]))
+    message.destinations = [
+        ModuleRoles(destination) if isinstance(destination, str) else resolve(destination[0], ModuleRoles(destination[1]))
+        for destination in header["destinations"]
+    ]
+    message.getters = []
+    message.trace_id = header["trace_id"]
+    message.send_time = header["send_time"]
+    message.created_ns = time.monotonic_ns() - header["age_ns"] - one_way_ns
+    return message
+
+class LinkStats:
+    """一条连接的统计信息"""
+    def __init__(self, name: str):
+        self.name = name
+        self.connected = False
+        self.reconnects = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.rtts: deque[float] = deque(maxlen=100) # 最近的 RTT（毫秒）
+        self.srtt_ns = 0 # 平滑后的 RTT（纳秒），算法同 TCP
+        self.last_pong = time.monotonic()
+
+    @property
+    def one_way_ns(self) -> int:
+        return self.srtt_ns // 2
+
+    def add_rtt(self, rtt_ns: int):
+        self.srtt_ns = rtt_ns if self.srtt_ns == 0 else (7 * self.srtt_ns + rtt_ns) // 8
+        self.rtts.append(rtt_ns / 1e6)
+        self.last_pong = time.monotonic()
+        link_rtt_seconds.observe(rtt_ns / 1e9, (self.name,))
+
+    def to_dict(self) -> dict[str, Any]:
+        rtts = sorted(self.rtts)
+        return {
+            "module": self.name,
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "messages_sent": self.messages_sent,
+            "messages_received": self.messages_received,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "rtt_ms": {
+                "last": self.rtts[-1] if rtts else None,
+                "p50": rtts[len(rtts) // 2] if rtts else None,
+                "p95": rtts[min(len(rtts) - 1, int(len(rtts) * 0.95))] if rtts else None,
+                "smoothed": self.srtt_ns / 1e6
+            }
+        }
+
+class Link:
+    """一条 TCP 连接"""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, stats: LinkStats):
+        self.reader = reader
+        self.writer = writer
+        self.stats = stats
+
+    def send_nowait(self, chunks: list[bytes]):
+        """不等待发送缓冲区清空，只用于很小的帧"""
+        self.writer.writelines(chunks)
+        size = sum(len(chunk) for chunk in chunks)
+        self.stats.bytes_sent += size
+        link_bytes_total.inc(size, (self.stats.name, "sent"))
+
+    async def send(self, chunks: list[bytes]):
+        self.send_nowait(chunks)
+        await self.writer.drain()
+
+    async def send_message(self, message: Message):
+        """消息无法序列化时抛出 TypeError，此时不会发送任何数据"""
+        await self.send(pack_message(message))
+        self.stats.messages_sent += 1
+
+    async def receive(self, max_size: int = 0) -> tuple[dict[str, Any], memoryview]:
+        """max_size：帧的最大长度，0 为不限制，超过时抛出 ConnectionError"""
+        header_size, payload_size = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+        if max_size and header_size + payload_size > max_size:
+            raise ConnectionError(f"帧过长（{header_size + payload_size} 字节）")
+        data = memoryview(await self.reader.readexactly(header_size + payload_size))
+        self.stats.bytes_received += FRAME_HEADER.size + len(data)
+        link_bytes_total.inc(FRAME_HEADER.size + len(data), (self.stats.name, "received"))
+        return json.loads(data[:header_size].tobytes()), data[header_size:]
+
+    def receive_message(self, header: dict[str, Any], payload: memoryview,
+                        resolve: Callable[[str, ModuleRoles], Any]) -> Message:
+        self.stats.messages_received += 1
+        return unpack_message(header, payload, resolve, self.stats.one_way_ns)
+
+    def close(self):
+        self.writer.close()
+
+class RemoteModule(ModuleProxy):
+    """远程节点上模块的代理"""
+    role: ModuleRoles = ModuleRoles.CONTROLLER
+    def __init__(self, module_class: type[ModuleBase], address: str,
+                 lookup: Callable[[str], ModuleBase | None] | None = None,
+                 config: ModuleConfig | None = None, **kwargs):
+        super().__init__(module_class, lookup, config, **kwargs)
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+        self.host = host or "127.0.0.1"
+        self.port = int(port) if port else DEFAULT_PORT
+        self.token = os.environ.get(TOKEN_ENV, "")
+        self.stats = LinkStats(self.name)
+        self.connected_once = False
+
+    async def run(self):
+        delay = RECONNECT_MIN
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                self.logger.warning("连接节点 {}:{} 失败：{}，{:.1f} 秒后重试", self.host, self.port, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX)
+                continue
+            link = Link(reader, writer, self.stats)
+            if self.connected_once:
+                link_reconnects_total.inc(1, (self.name,))
+                self.stats.reconnects += 1
+            self.connected_once = True
+            try:
+                await self.serve(link)
+            except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+                self.logger.warning("与节点 {}:{} 的连接断开：{}", self.host, self.port, e)
+            finally:
+                self.stats.connected = False
+                self.ready.clear()
+                link.close()
+            delay = RECONNECT_MIN
+            await asyncio.sleep(delay)
+
+    async def serve(self, link: Link):
+        await link.send(pack_frame({
+            "t": "hello",
+            "token": self.token,
+            "module": self.name,
+            "role": self.role.value,
+            "config": asdict(self.config)
+        }))
+        header, _ = await link.receive() # 节点加载模块可能需要较长时间
+        if header["t"] == "exit":
+            raise RemoteModuleError(header["error"])
+        self.stats.connected = True
+        self.stats.last_pong = time.monotonic()
+        self.ready.set()
+        self.logger.info("已连接节点 {}:{}", self.host, self.port)
+        tasks = [
+            asyncio.ensure_future(self.send_tasks(link)),
+            asyncio.ensure_future(self.receive_results(link)),
+            asyncio.ensure_future(self.heartbeat(link))
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def send_tasks(self, link: Link):
+        while True:
+            message = await self.task_queue.get()
+            try:
+                await link.send_message(message)
+            except TypeError as e:
+                self.logger.error("消息 {} 无法序列化，已丢弃：{}", message, e)
+
+    async def receive_results(self, link: Link):
+        while True:
+            header, payload = await link.receive()
+            match header["t"]:
+                case "message":
+                    message = link.receive_message(header, payload, self.resolve)
+                    await self.results_queue.put(self.local_destinations(message))
+                case "pong":
+                    self.stats.add_rtt(time.monotonic_ns() - header["t0"])
+                case "trace":
+                    t_ns = time.monotonic_ns() - header["age_ns"] - self.stats.one_way_ns
+                    getattr(tracer, header["method"])(*header["args"], t_ns)
+                case "interrupt":
+                    self.record_interrupt_latency(header["latency"])
+                case "exit":
+                    raise RemoteModuleError(header["error"])
+
+    async def heartbeat(self, link: Link):
+        while True:
+            if time.monotonic() - self.stats.last_pong > PING_INTERVAL * PING_TIMEOUT:
+                raise ConnectionError("心跳超时")
+            await link.send(pack_frame({"t": "ping", "t0": time.monotonic_ns()}))
+            await asyncio.sleep(PING_INTERVAL)
+
+class RemoteNode:
+    """远程节点，一次服务一个主控连接，运行主控指定的模块"""
+    def __init__(self, token: str, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        assert token, "节点必须设置令牌"
+        self.token = token
+        self.host = host
+        self.port = port
+        self.module: ModuleBase | None = None
+        self.module_task: asyncio.Task[None] | None = None
+        self.link: Link | None = None
+        self.stats = LinkStats("node")
+        self.refs: dict[str, ModuleRef] = {}
+        tracer.forward = self.forward_trace
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info("节点已在 {}:{} 上监听", self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+    def resolve(self, name: str, role: ModuleRoles) -> Any:
+        if self.module is not None and name == self.module.name:
+            return self.module
+        return self.refs.setdefault(name, ModuleRef(name, role))
+
+    def forward_trace(self, method: str, args: tuple[Any, ...]):
+        if self.link is not None:
+            self.link.send_nowait(pack_frame({
+                "t": "trace", "method": method, "args": list(args[:2]), "age_ns": time.monotonic_ns() - args[2]
+            }))
+
+    def forward_interrupt(self, latency: float):
+        if self.link is not None:
+            self.link.send_nowait(pack_frame({"t": "interrupt", "latency": latency}))
+
+    async def load_module(self, hello: dict[str, Any]):
+        """按主控发来的模块名和配置加载模块，与正在运行的模块相同时直接沿用"""
+        try:
+            module_class = module_classes[ModuleRoles(hello["role"])][hello["module"]]
+        except KeyError:
+            raise RemoteModuleError(f"节点上没有模块 {hello['module']}（是否忘记使用 --import 导入？）")
+        config = module_class.config_class(**hello["config"])
+        if self.module is not None and type(self.module) is module_class and self.module.config == config:
+            return
+        if self.module_task is not None:
+            self.module_task.cancel()
+        logger.info("加载模块 {}", module_class.name)
+        self.module = module_class(config)
+        self.module.record_interrupt_latency = self.forward_interrupt # type: ignore
+        self.module_task = asyncio.create_task(self.run_module(self.module))
+
+    async def run_module(self, module: ModuleBase):
+        try:
+            await module.run()
+            error = "模块已退出"
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            logger.exception("模块 {} 出错：{}", module.name, e)
+            error = repr(e)
+        if self.module is module:
+            self.module = None
+        if self.link is not None:
+            self.link.send_nowait(pack_frame({"t": "exit", "error": error}))
+
+    async def send_results(self, link: Link, module: ModuleBase):
+        """正在发送时连接断开的那条消息会丢失"""
+        while True:
+            message = await module.results_queue.get()
+            try:
+                await link.send_message(message)
+            except TypeError as e:
+                module.logger.error("消息 {} 无法序列化，已丢弃：{}", message, e)
+
+    def authenticate(self, hello: dict[str, Any]) -> bool:
+        token = hello.get("token")
+        return hello.get("t") == "hello" and isinstance(token, str) and \
+            hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        link = Link(reader, writer, self.stats)
+        peer = writer.get_extra_info("peername")
+        sender: asyncio.Future[None] | None = None
+        try:
+            hello, _ = await link.receive(MAX_HELLO_SIZE)
+            if not self.authenticate(hello):
+                logger.warning("拒绝来自 {} 的连接：令牌错误", peer)
+                await link.send(pack_frame({"t": "exit", "error": "节点令牌错误"}))
+                return
+            if self.link is not None: # 新的主控连接取代旧连接
+                self.link.close()
+            self.link = link
+            logger.info("主控 {} 已连接", peer)
+            try:
+                await self.load_module(hello)
+            except Exception as e:
+                logger.exception("加载模块失败：{}", e)
+                await link.send(pack_frame({"t": "exit", "error": repr(e)}))
+                return
+            assert self.module is not None
+            module = self.module
+            await link.send(pack_frame({"t": "ready"}))
+            sender = asyncio.ensure_future(self.send_results(link, module))
+            while True:
+                header, payload = await link.receive()
+                match header["t"]:
+                    case "message":
+                        await module.task_queue.put(link.receive_message(header, payload, self.resolve))
+                    case "ping":
+                        link.send_nowait(pack_frame({"t": "pong", "t0": header["t0"]}))
+        except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+            logger.warning("与主控 {} 的连接断开：{}", peer, e)
+        finally:
+            if sender is not None:
+                sender.cancel()
+            if self.link is link:
+                self.link = None
+            link.close()
+
+__all__ = ["RemoteModule", "RemoteNode", "RemoteModuleError", "LinkStats", "pack_message", "unpack_message", "DEFAULT_PORT", "TOKEN_ENV"]
@@ -0,0 +1,75 @@
+"""
+弹幕回复缓存
+直播弹幕重复度很高（“晚上好”“主播好”、刷屏的表情、短时间内多人问同一个问题），
+对归一化后内容相同、上下文指纹相同的弹幕，在 ttl 秒内直接复用上一次回复的句子和情感，省去一次模型调用。
+归一化：全角转半角、转小写、去掉标点、空白和“~”等符号（保留表情），连续重复的字符（如“哈哈哈哈”“🤣🤣🤣”）折叠为两个。
+"""
+from __future__ import annotations
+
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Hashable
+from .metrics import Counter, Gauge
+
+response_cache_lookups_total = Counter("swarmclone_llm_response_cache_lookups_total", "LLM response cache lookups by result", ("result",))
+response_cache_entries = Gauge("swarmclone_llm_response_cache_entries", "Replies held by the LLM response cache")
+
+_REPEAT = re.compile(r"(.)\1{2,}")
+
+def normalize_chat(text: str) -> str:
+    normalized = unicodedata.normalize("NFKC", text).lower()
+    normalized = "".join(
+        char for char in normalized
+        if not unicodedata.category(char).startswith(("P", "Z", "C", "Sm", "Sk")) # 标点、空白、控制字符及“~”“^”等符号，保留表情
+        or char == "\u200d" # 保留组合表情的连接符
+    )
+    normalized = _REPEAT.sub(r"\1\1", normalized)
+    return normalized or text.strip() # 全是标点时保留原文
+
+Reply = list[tuple[str, dict[str, float]]] # [(句子, 情感), ...]
+
+class ResponseCache:
+    def __init__(self, ttl: float = 300.0, max_entries: int = 256):
+        """
+        ttl: 回复的有效时间（秒）
+        max_entries: 最多保存的回复数，超过时淘汰最久未用的
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple[Hashable, ...], tuple[float, Reply]] = OrderedDict() # 键 -> (过期时间, 回复)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(fingerprint: Hashable, content: str) -> tuple[Hashable, ...]:
+        return (fingerprint, normalize_chat(content))
+
+    def get(self, key: tuple[Hashable, ...]) -> Reply | None:
+        if (entry := self.entries.get(key)) is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                response_cache_lookups_total.inc(1, ("hit",))
+                return entry[1]
+            del self.entries[key]
+            response_cache_entries.set(len(self.entries))
+        self.misses += 1
+        response_cache_lookups_total.inc(1, ("miss",))
+        return None
+
+    def put(self, key: tuple[Hashable, ...], reply: Reply):
+        self.entries[key] = (time.monotonic() + self.ttl, reply)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        response_cache_entries.set(len(self.entries))
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / total if (total := self.hits + self.misses) else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        response_cache_entries.set(0)
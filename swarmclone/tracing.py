@@ -0,0 +1,107 @@
+"""
+轮次级延迟追踪
+一次“输入 -> 回复 -> 播放”称为一个轮次（turn），由 trace_id 串联：
+ChatMessage/ASRMessage 产生时开启新的 trace_id，LLM 生成的 LLMMessage/LLMEOS 沿用触发它的输入的 trace_id，
+TTS 生成的 TTSAlignedAudio 沿用对应 LLMMessage 的 trace_id。
+各模块在关键节点调用 tracer.mark 记录（单调时钟，纳秒）时间戳，每个阶段只记录第一次。
+在子进程中运行的模块的记录会转发到主进程的 tracer（单调时钟在同一台机器的各进程间是一致的）。
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable
+from uuid import uuid4
+
+STAGES: list[str] = [
+    "input", # 输入产生（弹幕到达/语音结束）
+    "first_token", # LLM 输出第一个 token
+    "first_sentence", # 第一句话切分完成
+    "emotion", # 第一句话情感分类完成
+    "tts", # 第一段音频合成完成
+    "playback" # 第一段音频开始播放
+]
+
+def new_trace_id() -> str:
+    return uuid4().hex[:16]
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+class Tracer:
+    def __init__(self, max_traces: int = 200, max_samples: int = 1000):
+        self.traces: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self.max_traces = max_traces
+        self.stage_samples: dict[str, deque[float]] = {
+            stage: deque(maxlen=max_samples) for stage in STAGES[1:]
+        } # 阶段 -> 距上一阶段的耗时（毫秒）
+        self.total_samples: deque[float] = deque(maxlen=max_samples) # 输入到播放的总耗时（毫秒）
+        self.forward: Callable[[str, tuple[Any, ...]], None] | None = None # 在子进程中设置，把记录转发给主进程
+
+    def start(self, trace_id: str, source: str, t_ns: int | None = None):
+        """开始一个轮次"""
+        t_ns = time.monotonic_ns() if t_ns is None else t_ns
+        if self.forward is not None:
+            self.forward("start", (trace_id, source, t_ns))
+            return
+        self.traces[trace_id] = {
+            "source": source,
+            "wall_time": time.time(),
+            "marks": {"input": t_ns}
+        }
+        while len(self.traces) > self.max_traces:
+            self.traces.popitem(last=False)
+
+    def mark(self, trace_id: str | None, stage: str, t_ns: int | None = None):
+        """记录某一阶段的时间，同一轮次中每个阶段只记录第一次"""
+        if trace_id is None:
+            return
+        if self.forward is not None:
+            self.forward("mark", (trace_id, stage, time.monotonic_ns() if t_ns is None else t_ns))
+            return
+        if (trace := self.traces.get(trace_id)) is None:
+            return
+        marks: dict[str, int] = trace["marks"]
+        if stage in marks:
+            return
+        marks[stage] = now = time.monotonic_ns() if t_ns is None else t_ns
+        if stage in self.stage_samples:
+            index = STAGES.index(stage)
+            previous = next((marks[s] for s in reversed(STAGES[:index]) if s in marks), marks["input"])
+            self.stage_samples[stage].append((now - previous) / 1e6)
+        if stage == STAGES[-1]:
+            self.total_samples.append((now - marks["input"]) / 1e6)
+
+    def get_waterfalls(self, limit: int = 20) -> list[dict[str, Any]]:
+        """最近若干轮次各阶段相对输入时间的偏移（毫秒）"""
+        res: list[dict[str, Any]] = []
+        for trace_id in list(self.traces.keys())[-limit:][::-1]:
+            trace = self.traces[trace_id]
+            t0 = trace["marks"]["input"]
+            res.append({
+                "trace_id": trace_id,
+                "source": trace["source"],
+                "wall_time": trace["wall_time"],
+                "stages": [
+                    {"stage": stage, "offset_ms": (trace["marks"][stage] - t0) / 1e6}
+                    for stage in STAGES if stage in trace["marks"]
+                ]
+            })
+        return res
+
+    def get_histograms(self) -> dict[str, dict[str, float | int]]:
+        """各阶段（相对上一阶段）以及总耗时的 p50/p95/p99（毫秒）"""
+        res: dict[str, dict[str, float | int]] = {}
+        for stage, samples in [*self.stage_samples.items(), ("total", self.total_samples)]:
+            if not samples:
+                continue
+            values = sorted(samples)
+            res[stage] = {
+                "count": len(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99)
+            }
+        return res
+
+tracer = Tracer()
@@ -6,15 +6,10 @@ import tempfile
 import asyncio
 from dataclasses import dataclass, field
 
-import torch
-import torchaudio
-import jieba
-
 from ..modules import *
 from ..messages import *
+from ..model_pool import model_pool
 
-from cosyvoice.cli.cosyvoice import CosyVoice 
-from .funcs import tts_generate
 from time import time # time被某个模块覆盖了
 
 # 忽略警告
@@ -49,6 +44,7 @@ class TTSCosyvoiceConfig(ModuleConfig):
     })
 def init_tts(config: TTSCosyvoiceConfig):
     # TTS Model 初始化
+    from cosyvoice.cli.cosyvoice import CosyVoice
     model_path = config.model_path
     sft_model = config.sft_model
     ins_model = config.ins_model
@@ -84,10 +80,17 @@ class TTSCosyvoice(TTSBase):
     config: config_class
     def __init__(self, config: TTSCosyvoiceConfig | None = None, **kwargs):
         super().__init__(config, **kwargs)
-        self.cosyvoice_models = init_tts(self.config)
+        key = (
+            "cosyvoice", os.path.expanduser(self.config.model_path),
+            self.config.sft_model if is_linux else None, self.config.ins_model, self.config.float16
+        )
+        self.cosyvoice_models = model_pool.get(key, lambda: init_tts(self.config)) # 只改音色等配置时不必重新加载
 
-    @torch.no_grad()
     async def generate_sentence(self, id: str, content: str, emotions: dict[str, float]) -> TTSAlignedAudio:
+        import torch
+        import torchaudio
+        import jieba
+        from .funcs import tts_generate # tts_generate 中已使用 torch.no_grad
         try:
             assert isinstance((tune := self.config.tune), str)
             output = await asyncio.to_thread(
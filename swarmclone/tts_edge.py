@@ -3,22 +3,18 @@ from .utils import *
 from .modules import *
 from .messages import *
 from dataclasses import dataclass, field
-import edge_tts
-import torchaudio
-import jieba
 from io import BytesIO
 
-voices = get_voices()
 @dataclass
 class TTSEdgeConfig(ModuleConfig):
     """使用微软的 TTS"""
-    voice: str = field(default=voices[0]['voice'], metadata={
+    voice: str = field(default="zh-CN-XiaoxiaoNeural", metadata={
         "required": False,
         "desc": "选择声音",
         "selection": True,
-        "options": [
+        "options": lambda: [ # 需要联网获取，在请求配置信息时才获取
             {"key": voice['friendly_name'], "value": voice['voice']}
-            for voice in voices
+            for voice in get_voices()
         ]
     })
 
@@ -31,6 +27,9 @@ class TTSEdge(TTSBase):
         self.voice = self.config.voice
     
     async def generate_sentence(self, id: str, content: str, emotions: dict[str, float]) -> TTSAlignedAudio:
+        import edge_tts
+        import torchaudio
+        import jieba
         try:
             communicate = edge_tts.Communicate(content, self.voice)
             
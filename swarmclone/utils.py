@@ -1,12 +1,16 @@
-from modelscope import snapshot_download as modelscope_snapshot_download
-from huggingface_hub import snapshot_download as huggingface_snapshot_download
 import re
+from functools import cache
+from typing import Any
+
+# 注意：本文件会被所有模块导入，不要在文件顶层导入 torch 等较重的库，应在用到的函数中导入
 
 def download_model(model_id: str, model_source: str, local_dir: str):
     match model_source:
         case "modelscope":
+            from modelscope import snapshot_download as modelscope_snapshot_download
             modelscope_snapshot_download(model_id, local_dir=local_dir, repo_type="model")
         case "huggingface":
+            from huggingface_hub import snapshot_download as huggingface_snapshot_download
             huggingface_snapshot_download(model_id, local_dir=local_dir, repo_type="model")
         case x if x.startswith("openai+"):
             raise ValueError((
@@ -38,6 +42,82 @@ def split_text(s: str, separators: str="。？！～.?!~\n\r") -> list[str]: # B
     
     return result
 
+class StreamingSentenceSegmenter:
+    """
+    流式分句：逐段输入模型输出的文本，只扫描新增的字符，返回已完整的句子
+    句末标点（可连续，如“？！”“...”）之后出现其他字符时，句子才算完整；数字之间的“.”“,”（如 3.14、1,000）不作为断句点。
+    first_clause_length > 0 时，第一句在逗号等处达到该长度即提前输出，以缩短首个音频的等待时间；
+    句子超过 max_length 时在最后一个逗号处（没有则直接）截断，避免 TTS 收到一整段话
+    """
+    def __init__(self, separators: str = "。？！～….?!~\n\r", clause_separators: str = "，,、；;：:",
+                 first_clause_length: int = 0, max_length: int = 0):
+        self.separators = frozenset(separators)
+        self.clause_separators = frozenset(clause_separators)
+        self.first_clause_length = first_clause_length
+        self.max_length = max_length
+        self.buffer = ""
+        self.pos = 0 # 已扫描到的位置
+        self.start = 0 # 当前句子的起始位置
+        self.clause_end = 0 # 当前句子中最后一个逗号之后的位置
+        self.in_run = False # 刚扫描过句末标点，等待下一个字符确认句子结束
+        self.emitted = 0 # 已输出的句子数
+
+    def is_number_mark(self, i: int) -> bool | None:
+        """buffer[i] 是否为数字中的小数点或千分位，需要看下一个字符而还没有收到时返回 None"""
+        if self.buffer[i] not in ".," or i == 0 or not self.buffer[i - 1].isdigit():
+            return False
+        if i + 1 == len(self.buffer):
+            return None
+        return self.buffer[i + 1].isdigit()
+
+    def cut(self, end: int, result: list[str]):
+        if sentence := self.buffer[self.start:end].strip():
+            result.append(sentence)
+            self.emitted += 1
+        self.start = self.clause_end = end
+
+    def feed(self, text: str) -> list[str]:
+        """输入新的文本，返回其中已完整的句子（已去除首尾空白）"""
+        self.buffer += text
+        result: list[str] = []
+        while self.pos < len(self.buffer):
+            i = self.pos
+            char = self.buffer[i]
+            if char in self.separators or char in self.clause_separators:
+                if (number := self.is_number_mark(i)) is None:
+                    break # 等待下一个字符再判断
+                if number:
+                    char = "0" # 按普通字符处理
+            if char in self.separators:
+                self.in_run = True
+            else:
+                if self.in_run: # 句末标点之后出现了其他字符
+                    self.in_run = False
+                    self.cut(i, result)
+                if char in self.clause_separators:
+                    self.clause_end = i + 1
+                    if self.emitted == 0 and 0 < self.first_clause_length <= i + 1 - self.start:
+                        self.cut(i + 1, result)
+                elif 0 < self.max_length <= i + 1 - self.start:
+                    self.cut(self.clause_end if self.clause_end > self.start else i + 1, result)
+            self.pos = i + 1
+        if self.start: # 丢弃已输出的部分，下标随之平移
+            self.buffer = self.buffer[self.start:]
+            self.pos -= self.start
+            self.clause_end = max(self.clause_end - self.start, 0)
+            self.start = 0
+        return result
+
+    def flush(self) -> str:
+        """输出结束时取出剩余的文本（已去除首尾空白），并重置状态"""
+        rest = self.buffer[self.start:].strip()
+        if rest:
+            self.emitted += 1
+        self.buffer = ""
+        self.pos = self.start = self.clause_end = 0
+        self.in_run = False
+        return rest
+
 def escape_all(s: str) -> str: # By Kimi-K2 & Doubao-Seed-1.6
     # 把非可打印字符（含换行、制表等）统一转成 \xhh 或 \uXXXX
     def _escape(m: re.Match[str]):
@@ -61,8 +141,9 @@ def unescape_all(s: str) -> str: # By Kimi-K2 & KyvYang
     s = s.replace("\"", r"\"")
     return ast.literal_eval(f'"""{s}"""')
 
-import torch
+@cache
 def get_devices() -> dict[str, str]:
+    import torch
     devices: dict[str, str] = {}
     for i in range(torch.cuda.device_count()):
         devices[f"cuda:{i}"] = f"cuda:{i} " + torch.cuda.get_device_name(i)
@@ -100,13 +181,13 @@ def get_live2d_models() -> dict[str, str]:
         models[name] = str(path)
     return models
 
-import srt
 def parse_srt_to_list(srt_text: str) -> list[dict[str, float | str]]: # By: Kimi-K2
     """
     把 SRT 全文转换成：
     [{'token': <歌词>, 'duration': <秒>}, ...]
     若字幕间有空档，用空字符串占位。
     """
+    import srt
     subs = list(srt.parse(srt_text))
     if not subs:          # 空字幕直接返回
         return []
@@ -139,11 +220,13 @@ def parse_srt_to_list(srt_text: str) -> list[dict[str, float | str]]: # By: Kimi
     return result
 
 import asyncio
-from edge_tts import VoicesManager
+@cache
 def get_voices():
     """
     获得 edge-tts 提供的所有中文声音，并返回[{'friendly_name': [人类易读的名称], 'voice': [声音标签]}, ...]
+    需要联网，结果会被缓存；不要在事件循环所在的线程中调用
     """
+    from edge_tts import VoicesManager
     async def _get_voices():
         voices = await VoicesManager.create()
         chinese_voices = voices.find(Gender="Female", Locale="zh-CN")
@@ -164,3 +247,14 @@ def get_voices():
         return asyncio.run(_get_voices())
 
 get_type_name = lambda obj: type(obj).__name__
+
+def summarize_value(value: Any, limit: int = 50) -> str:
+    """生成消息内容的简短描述，不会对大块数据（音频字节串、长列表）做完整的 repr"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        return repr(value) if len(value) <= limit else repr(value[:limit]) + "..."
+    if isinstance(value, (list, tuple, dict)) and len(value) > 8:
+        return f"<{type(value).__name__} of {len(value)} items>"
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + "..."